@@ -0,0 +1,265 @@
+"""
+Async-чтение для SERVER_MODE=asgi (uvicorn-воркеры gunicorn).
+
+Лента и карточка рецепта, поиск ингредиентов, профиль пользователя
+и короткая ссылка отвечают из event loop: пока запрос ждёт БД, воркер
+принимает следующие. В БД ходят async-методы ORM (aget, afirst,
+acount, aiterator) — в Django они всё ещё выполняют запрос в потоке,
+но занят поток на время запроса, а не процесс-воркер.
+
+Маршруты и имена те же, что в api.urls: with_async_reads подменяет
+обработчики в foodgram.urls_async. Async-обработчик берёт только GET
+в JSON; запись, browsable API, курсор, неверный токен и ошибки (404,
+403...) он отдаёт синхронному DRF-представлению в потоке (возвращает
+None) — ответы в обоих режимах одинаковые.
+
+Сериализаторы работают прямо в event loop: связи и флаги зрителя
+подгружены заранее, а запрос к БД из сериализатора Django не пропустит
+(SynchronousOnlyOperation) — N+1 здесь сразу виден.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.http import Http404, HttpResponse
+from django.shortcuts import redirect
+from django.urls import URLPattern, URLResolver, reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.authentication import (
+    TokenAuthentication, get_authorization_header,
+)
+from rest_framework.exceptions import APIException, AuthenticationFailed
+from rest_framework.response import Response
+
+from recipes.models import Recipe
+from . import conditional, response_cache
+from .instrumentation import section
+from .viewer_state import ViewerState
+
+
+# авторизация
+async def _authenticate(view, request):
+    """
+    (user, token) как у TokenAuthentication представления (с кэшем
+    токенов — обычно без БД); None — заголовок неверный или токена нет:
+    ошибку вернёт синхронное представление.
+    """
+    classes = view.authentication_classes
+    if any(not issubclass(cls, TokenAuthentication) for cls in classes):
+        return None
+    auth = get_authorization_header(request).split()
+    if not classes or not auth or auth[0].lower() != b'token':
+        return AnonymousUser(), None
+    if len(auth) != 2:
+        return None
+    try:
+        key = auth[1].decode()
+        return await sync_to_async(
+            classes[0]().authenticate_credentials)(key)
+    except (UnicodeError, AuthenticationFailed):
+        return None
+
+
+# обработчики: view — экземпляр DRF-представления маршрута
+async def _cached(view, build, version=None):
+    """RecipeViewSet._cached для async: build() собирает ответ."""
+    request = view.request
+    if not view._cacheable(request):
+        return await build()
+    key, entry = await sync_to_async(_lookup)(
+        request, view.cached_params, version)
+    if entry is None:
+        response = await build()
+        if response is not None:
+            if response.status_code == status.HTTP_200_OK:
+                await sync_to_async(response_cache.store)(key, response)
+            response['X-Cache'] = 'MISS'
+        return response
+    data, headers = entry
+    if version is None:
+        data = await response_cache.arefresh_counters(data)
+    response = Response(
+        await response_cache.apersonalize(data, request), headers=headers)
+    response['X-Cache'] = 'HIT'
+    return response
+
+
+def _lookup(request, params, version=None):
+    key = response_cache.cache_key(request, params, version)
+    return key, response_cache.lookup(key)
+
+
+async def recipe_list(view, **kwargs):
+    request = view.request
+    params = request.query_params
+    paginator = view.paginator
+    if (paginator.cursor_query_param in params
+            or params.get(paginator.count_query_param) == 'estimated'):
+        return None
+
+    async def build():
+        page = await paginator.apaginate_queryset(
+            view.filter_queryset(view.get_queryset()), request)
+        await ViewerState.of(request).aload_recipes(page)
+        response = view.get_paginated_response(
+            view.get_serializer(page, many=True).data)
+        if page:
+            response['Last-Modified'] = http_date(
+                max(recipe.updated_at for recipe in page).timestamp())
+        return response
+
+    response = await _cached(view, build)
+    etag = conditional.data_etag(request, response.data)
+    conditional.set_validators(response, etag)
+    return get_conditional_response(request, etag=etag, response=response)
+
+
+async def recipe_detail(view, pk, **kwargs):
+    request = view.request
+    validators = await conditional.arecipe_validators(request, pk)
+    if validators is None:
+        return None
+    etag, last_modified, version = validators
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+
+    async def build():
+        try:
+            recipe = await view.get_queryset().aget(pk=pk)
+        except Recipe.DoesNotExist:
+            return None  # удалён между запросами
+        view.check_object_permissions(request, recipe)
+        await ViewerState.of(request).aload_recipes([recipe])
+        return Response(view.get_serializer(recipe).data)
+
+    if response is None:
+        response = await _cached(view, build, version)
+        if response is None:
+            return None
+    return conditional.set_validators(response, etag, last_modified)
+
+
+async def ingredient_list(view, **kwargs):
+    # индекс в памяти: в БД (и в кэш за версией справочника) ходит
+    # только проверка свежести — поэтому поиск целиком в потоке
+    request = view.request
+    name = request.query_params.get('name')
+    if name:
+        return Response(await sync_to_async(view._search)(request, name))
+    return await sync_to_async(view._catalog_response)(request)
+
+
+async def user_detail(view, id, **kwargs):
+    request = view.request
+    try:
+        user = await view.get_queryset().aget(id=id)
+    except (ObjectDoesNotExist, ValueError, ValidationError):
+        return None
+    view.check_object_permissions(request, user)
+    await ViewerState.of(request).aload_authors([user.pk])
+    return Response(view.get_serializer(user).data)
+
+
+async def user_me(view, **kwargs):
+    request = view.request
+    await ViewerState.of(request).aload_authors([request.user.pk])
+    return Response(view.get_serializer(request.user).data)
+
+
+async def recipe_link(view, pk, **kwargs):
+    if not await Recipe.objects.filter(pk=pk).aexists():
+        return None
+    return redirect(reverse('recipe-detail', args=[pk]))
+
+
+HANDLERS = {
+    'recipe-list': recipe_list,
+    'recipe-detail': recipe_detail,
+    'ingredient-list': ingredient_list,
+    'users-detail': user_detail,
+    'users-me': user_me,
+    'recipe-link': recipe_link,
+}
+
+
+# маршруты
+async def _serve(handler, fallback, request, args, kwargs):
+    """Представление как в DRF dispatch, но обработчик — корутина."""
+    view = fallback.cls(**fallback.initkwargs)
+    actions = getattr(fallback, 'actions', None)
+    if actions:  # как ViewSetMixin.as_view
+        view.action_map = actions
+        for method, action in actions.items():
+            setattr(view, method, getattr(view, action))
+    auth = await _authenticate(view, request)
+    if auth is None:
+        return None
+    view.setup(request, *args, **kwargs)
+    drf_request = view.initialize_request(request, *args, **kwargs)
+    drf_request.user, drf_request.auth = auth
+    view.request = drf_request
+    view.headers = view.default_response_headers
+    try:
+        view.initial(drf_request, *args, **kwargs)
+        if drf_request.accepted_renderer.format != 'json':
+            return None
+        response = await handler(view, *args, **kwargs)
+    except (APIException, Http404):
+        return None
+    if response is None:
+        return None
+    return _rendered(view.finalize_response(
+        drf_request, response, *args, **kwargs))
+
+
+def _rendered(response):
+    """
+    Ответ DRF — готовыми байтами: шаблонный ответ Django в async-режиме
+    рендерит (и прогоняет через process_template_response) в потоке.
+    """
+    if not isinstance(response, Response):
+        return response
+    with section('render'):
+        response.render()
+    plain = HttpResponse(response.content, status=response.status_code)
+    for header, value in response.items():
+        plain[header] = value
+    return plain
+
+
+def async_read(handler, fallback):
+    """GET — handler в event loop; остальное — fallback в потоке."""
+    sync_fallback = sync_to_async(fallback)
+
+    @wraps(fallback)
+    async def view(request, *args, **kwargs):
+        response = None
+        if request.method == 'GET':
+            response = await _serve(handler, fallback, request, args, kwargs)
+        if response is None:
+            response = await sync_fallback(request, *args, **kwargs)
+        return response
+
+    return view
+
+
+def with_async_reads(patterns):
+    """Те же маршруты, у которых есть async-обработчик, — через него."""
+    result = []
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            pattern = URLResolver(
+                pattern.pattern, with_async_reads(pattern.url_patterns),
+                pattern.default_kwargs, pattern.app_name, pattern.namespace,
+            )
+        elif pattern.name in HANDLERS:
+            pattern = URLPattern(
+                pattern.pattern,
+                async_read(HANDLERS[pattern.name], pattern.callback),
+                pattern.default_args, pattern.name,
+            )
+        result.append(pattern)
+    return result
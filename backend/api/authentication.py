@@ -0,0 +1,165 @@
+"""
+Аутентификация по токену без запроса Token + User на каждый запрос.
+
+Токен с пользователем хранится в общем кэше (TOKEN_CACHE_TIMEOUT)
+и в LRU процесса (TOKEN_LRU_SIZE токенов, не дольше TOKEN_LRU_TTL).
+Свежесть проверяется версией токена в общем кэше — одно обращение
+к кэшу на запрос, к БД — ни одного. Версию увеличивают сигналы
+(api/signals.py) после коммита: выход (токен удалён), смена пароля,
+блокировка, правка профиля и аватара. Запись, сделанная до смены
+версии, больше не совпадёт — во всех воркерах сразу.
+
+Ключи кэша — хэш токена, а не сам токен. В кэше — только значения
+полей пользователя без хэша пароля: password у восстановленного
+пользователя отложенный и при обращении (смена пароля) читается из БД.
+Каждый запрос собирает свою копию пользователя: представления его
+меняют (аватар, пароль).
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import router
+from django.db.models.fields.files import FieldFile
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+ENTRY_KEY = 'api:auth:token:{}'
+VERSION_KEY = 'api:auth:version:{}'
+# в кэш не попадает: хэш пароля
+SECRET_FIELDS = ('password',)
+
+User = get_user_model()
+
+
+def _digest(key):
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def _new_version(digest):
+    # старт со времени: вытесненная версия не совпадёт со старыми записями
+    cache.add(VERSION_KEY.format(digest), time.time_ns(), None)
+    return cache.get(VERSION_KEY.format(digest))
+
+
+def invalidate(keys):
+    """Записи этих токенов устарели (вызывать после коммита)."""
+    for digest in map(_digest, keys):
+        try:
+            cache.incr(VERSION_KEY.format(digest))
+        except ValueError:
+            _new_version(digest)
+
+
+def invalidate_user(user_id):
+    invalidate(Token.objects.filter(
+        user_id=user_id).values_list('key', flat=True))
+
+
+# запись кэша
+def _pack(token):
+    """Токен -> (ключ, создан, поля пользователя, значения) без секретов."""
+    user = token.user
+    fields = [field.attname for field in user._meta.concrete_fields
+              if field.attname not in SECRET_FIELDS]
+    # FieldFile тянет за собой весь объект — храним только имя файла
+    values = [value.name if isinstance(value, FieldFile) else value
+              for value in map(user.__dict__.get, fields)]
+    return token.key, token.created, fields, values
+
+
+def _unpack(entry):
+    """Новые объекты токена и пользователя из записи кэша."""
+    key, created, fields, values = entry
+    user = User.from_db(router.db_for_read(User), fields, values)
+    token = Token.from_db(router.db_for_read(Token),
+                          ['key', 'user_id', 'created'],
+                          [key, user.pk, created])
+    token.user = user
+    return token
+
+
+class _LRU:
+    """digest -> (запись, версия, срок); потокобезопасный."""
+
+    def __init__(self):
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            item = self._items.get(digest)
+            if item is None:
+                return None
+            if item[2] < time.monotonic():
+                del self._items[digest]
+                return None
+            self._items.move_to_end(digest)
+            entry, version, _ = item
+        return entry, version
+
+    def put(self, digest, entry, version):
+        with self._lock:
+            self._items[digest] = (
+                entry, version, time.monotonic() + settings.TOKEN_LRU_TTL)
+            self._items.move_to_end(digest)
+            while len(self._items) > settings.TOKEN_LRU_SIZE:
+                self._items.popitem(last=False)
+
+    def discard(self, digest):
+        with self._lock:
+            self._items.pop(digest, None)
+
+
+_local = _LRU()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication с кэшем; TOKEN_CACHE_TIMEOUT=0 — без него."""
+
+    def authenticate_credentials(self, key):
+        if not settings.TOKEN_CACHE_TIMEOUT:
+            return super().authenticate_credentials(key)
+        digest = _digest(key)
+        version_key = VERSION_KEY.format(digest)
+        local = _local.get(digest)
+        if local is not None:
+            entry, version = local
+            if cache.get(version_key) == version:
+                token = _unpack(entry)
+                return token.user, token
+            _local.discard(digest)
+
+        entry_key = ENTRY_KEY.format(digest)
+        found = cache.get_many([entry_key, version_key])
+        version = found.get(version_key) or _new_version(digest)
+        if version is None:  # кэш ничего не хранит (DummyCache)
+            token = self._load(key)
+            return token.user, token
+        cached = found.get(entry_key)
+        if cached is not None and cached[1] == version:
+            entry = cached[0]
+        else:
+            # версия прочитана до БД: если профиль поменяют, пока
+            # идёт запрос, запись с этой версией уже не пройдёт
+            entry = _pack(self._load(key))
+            cache.set(entry_key, (entry, version),
+                      settings.TOKEN_CACHE_TIMEOUT)
+        _local.put(digest, entry, version)
+        token = _unpack(entry)
+        return token.user, token
+
+    def _load(self, key):
+        try:
+            token = Token.objects.select_related('user').get(key=key)
+        except Token.DoesNotExist:
+            raise AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return token
@@ -0,0 +1,355 @@
+"""
+Замеры эндпоинтов API тестовым клиентом (manage.py bench_api).
+
+Маршруты берутся из api.urls, так что новый эндпоинт попадает в замер
+сам. GET меряется для анонима и для пользователя с токеном; запись —
+парами «создать → удалить» (избранное, корзина, подписка, аватар,
+рецепт), чтобы после прогона данные остались прежними. Остальная запись
+(регистрация, смена пароля, выход) пропускается и перечисляется в отчёте.
+
+На каждый замер: p50/p95/среднее время, число SQL-запросов, статус
+и размер ответа. Результат — JSON со стабильными ключами: два прогона
+(до и после правки) сравнивает bench_api --compare.
+"""
+import base64
+import math
+import statistics
+import time
+from collections import Counter
+from io import BytesIO
+
+import django
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver, reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from jobs.models import Job
+from recipes.models import (
+    Favorite, Ingredient, Recipe, RecipeIngredient, ShoppingCart,
+)
+from users.models import Follow
+
+from . import response_cache
+
+User = get_user_model()
+
+METHODS = ('get', 'post', 'put', 'patch', 'delete')
+# дополнительные варианты запроса к GET-маршрутам
+QUERIES = {
+    'recipe-list': (
+        '', '?cursor=', '?count=estimated', '?is_favorited=1',
+        '?is_in_shopping_cart=1', '?author={author}', '?ordering=popular',
+        '?ordering=popular&cursor=',
+    ),
+    'ingredient-list': ('', '?name=са'),
+    'recipe-pantry': ('?{pantry}', '?{pantry}&max_missing=0'),
+    'recipe-download-shopping-cart': ('?type=txt', '?type=csv', '?type=pdf'),
+}
+# пары записи: маршрут -> (метод «создать», метод «удалить»)
+TOGGLES = {
+    'recipe-favorite': ('post', 'delete'),
+    'recipe-shopping-cart': ('post', 'delete'),
+    'users-subscribe': ('post', 'delete'),
+    'users-avatar': ('put', 'delete'),
+    'recipe-favorite-batch': ('post', 'delete'),
+    'recipe-shopping-cart-batch': ('post', 'delete'),
+}
+# рецептов в одном запросе к пакетным маршрутам
+BATCH_SIZE = 10
+# продуктов «в холодильнике» у замера подбора — самые частые
+PANTRY_SIZE = 15
+# запись, которую меряет сценарий рецепта
+RECIPE_WRITES = {('recipe-list', 'post'), ('recipe-detail', 'patch'),
+                 ('recipe-detail', 'delete')}
+
+
+def _image():
+    buffer = BytesIO()
+    Image.new('RGB', (400, 300), (200, 120, 80)).save(buffer, 'PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+def routes():
+    """[(имя маршрута, параметры пути, методы)] из api.urls."""
+    def walk(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                yield from walk(pattern.url_patterns)
+            elif pattern.name:
+                yield pattern
+
+    result = {}
+    for pattern in walk(get_resolver('api.urls').url_patterns):
+        params = tuple(pattern.pattern.regex.groupindex)
+        if 'format' in params or pattern.name in result:
+            continue  # варианты с суффиксом .json — те же обработчики
+        callback = pattern.callback
+        actions = getattr(callback, 'actions', None)
+        if actions:
+            methods = tuple(method for method in METHODS if method in actions)
+        else:
+            view = callback.view_class
+            methods = tuple(method for method in METHODS
+                            if hasattr(view, method))
+        result[pattern.name] = (params, methods)
+    return [(name, *value) for name, value in sorted(result.items())]
+
+
+def percentile(values, share):
+    """Ближайший ранг: p95 из 20 замеров — 19-й по возрастанию."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(share * len(ordered)) - 1)]
+
+
+def default_user():
+    """Самый «тяжёлый» зритель: больше всего подписок и избранного."""
+    return User.objects.annotate(
+        weight=Count('following', distinct=True)
+        + Count('favorites', distinct=True),
+    ).order_by('-weight', 'pk').first()
+
+
+class Bench:
+    def __init__(self, user=None, iterations=20, warmup=2, cold=False):
+        self.iterations, self.warmup, self.cold = iterations, warmup, cold
+        self.user = user or default_user()
+        if self.user is None:
+            raise ValueError('в базе нет пользователей — seed_foodgram')
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.clients = {'anon': APIClient(), 'auth': APIClient()}
+        self.clients['auth'].credentials(
+            HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.results, self.skipped = [], []
+        self.context = self._context()
+
+    def _context(self):
+        """Объекты для параметров пути: детальные и цели пар записи."""
+        user = self.user
+        recipe = Recipe.objects.order_by('-favorites_count', 'pk').first()
+        author = (User.objects.exclude(pk=user.pk)
+                  .order_by('-followers_count', 'pk').first())
+        fresh_recipes = list(Recipe.objects.exclude(
+            pk__in=Favorite.objects.filter(user=user).values('recipe_id'),
+        ).exclude(
+            pk__in=ShoppingCart.objects.filter(
+                user=user).values('recipe_id'),
+        ).order_by('-favorites_count', 'pk').values_list(
+            'pk', flat=True)[:BATCH_SIZE])
+        fresh_author = User.objects.exclude(pk=user.pk).exclude(
+            pk__in=Follow.objects.filter(user=user).values('author_id'),
+        ).order_by('-followers_count', 'pk').first()
+        job = Job.objects.filter(user=user).order_by('-pk').first()
+        ingredient = Ingredient.objects.order_by('pk').first()
+        pantry = RecipeIngredient.objects.values('ingredient_id').annotate(
+            uses=Count('pk')).order_by('-uses', 'ingredient_id').values_list(
+            'ingredient_id', flat=True)[:PANTRY_SIZE]
+        return {
+            'recipe': recipe and recipe.pk,
+            'users': author and author.pk,
+            'jobs': job and job.pk,
+            'ingredient': ingredient and ingredient.pk,
+            'fresh_recipe': fresh_recipes[0] if fresh_recipes else None,
+            'fresh_recipes': fresh_recipes,
+            'fresh_users': fresh_author and fresh_author.pk,
+            'author': author and author.pk,
+            'pantry': '&'.join(f'ingredients={pk}' for pk in pantry),
+        }
+
+    # замер
+    def _request(self, client, method, path, data=None):
+        if self.cold:
+            response_cache.bump_generation()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, method)(path, data, format='json')
+            # потоковый ответ (выгрузка списка) строится при чтении
+            body = (b''.join(response.streaming_content)
+                    if response.streaming else response.content)
+            elapsed = time.perf_counter() - started
+        return response, body, elapsed, len(queries)
+
+    def _record(self, name, method, query, viewer, samples):
+        timings = [elapsed for _, _, elapsed, _ in samples]
+        queries = [count for _, _, _, count in samples]
+        statuses = Counter(response.status_code for response, *_ in samples)
+        self.results.append({
+            'key': f'{method.upper()} {name}{query} [{viewer}]',
+            'endpoint': name,
+            'method': method.upper(),
+            'query': query,
+            'viewer': viewer,
+            'status': statuses.most_common(1)[0][0],
+            'p50_ms': round(percentile(timings, 0.5) * 1000, 2),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 2),
+            'mean_ms': round(statistics.fmean(timings) * 1000, 2),
+            'queries': int(statistics.median(queries)),
+            'queries_max': max(queries),
+            'bytes': len(samples[-1][1]),
+        })
+
+    def measure(self, name, method, path, query='', viewer='auth',
+                data=None):
+        client = self.clients[viewer]
+        # в ключ замера идёт шаблон: id в наборах данных разные
+        url = path + query.format(**self.context)
+        samples = [
+            self._request(client, method, url, data)
+            for _ in range(self.warmup + self.iterations)
+        ][self.warmup:]
+        self._record(name, method, query, viewer, samples)
+
+    def measure_pair(self, name, path, methods, data=None,
+                     delete_data=None):
+        """Создать и удалить по очереди; каждая половина — свой замер."""
+        client = self.clients['auth']
+        create, delete = methods
+        # исходное состояние — «нет»
+        getattr(client, delete)(path, delete_data, format='json')
+        samples = {create: [], delete: []}
+        for number in range(self.warmup + self.iterations):
+            for method in methods:
+                sample = self._request(
+                    client, method, path,
+                    data if method == create else delete_data)
+                if number >= self.warmup:
+                    samples[method].append(sample)
+        for method in methods:
+            self._record(name, method, '', 'auth', samples[method])
+
+    def measure_recipe_writes(self):
+        """Создание, правка и удаление своего рецепта."""
+        client = self.clients['auth']
+        ingredients = list(Ingredient.objects.order_by('pk').values_list(
+            'pk', flat=True)[:3])
+        payload = {
+            'name': 'Замер', 'text': 'Рецепт для замера', 'cooking_time': 10,
+            'image': _image(),
+            'ingredients': [{'id': pk, 'amount': 10} for pk in ingredients],
+        }
+        samples = {'create': [], 'update': [], 'delete': []}
+        for number in range(self.warmup + self.iterations):
+            created = self._request(
+                client, 'post', reverse('recipe-list'), payload)
+            if created[0].status_code != 201:
+                raise ValueError(
+                    f'создание рецепта: {created[0].status_code}')
+            path = reverse('recipe-detail', args=[created[0].data['id']])
+            steps = [
+                ('create', created),
+                ('update', self._request(client, 'patch', path, {
+                    **payload, 'name': 'Замер (правка)'})),
+                ('delete', self._request(client, 'delete', path)),
+            ]
+            if number >= self.warmup:
+                for step, sample in steps:
+                    samples[step].append(sample)
+        self._record('recipe-list', 'post', '', 'auth', samples['create'])
+        self._record('recipe-detail', 'patch', '', 'auth', samples['update'])
+        self._record('recipe-detail', 'delete', '', 'auth',
+                     samples['delete'])
+
+    # прогон
+    def _path(self, name, params, fresh=False):
+        if not params:
+            return reverse(name)
+        value = self.context.get(
+            ('fresh_' if fresh else '') + name.split('-')[0])
+        if value is None:
+            return None
+        return reverse(name, kwargs={params[0]: value})
+
+    def run(self, only=None):
+        """only — подстроки имён маршрутов, которые мерить."""
+        def selected(name):
+            return not only or any(part in name for part in only)
+
+        for name, params, methods in routes():
+            if not selected(name):
+                continue
+            for method in methods:
+                if method == 'get':
+                    path = self._path(name, params)
+                    if path is None:
+                        self.skipped.append(f'GET {name}: нет данных')
+                        continue
+                    viewers = list(self.clients)
+                    status = self.clients['anon'].get(path).status_code
+                    if status in (401, 403):
+                        # только для своих — анонимный отказ не меряем
+                        viewers.remove('anon')
+                        self.skipped.append(f'GET {name} [anon]: {status}')
+                    for query in QUERIES.get(name, ('',)):
+                        for viewer in viewers:
+                            self.measure(name, method, path, query, viewer)
+                elif name in TOGGLES and method == TOGGLES[name][0]:
+                    path = self._path(name, params, fresh=True)
+                    if path is None:
+                        self.skipped.append(f'{name}: нет данных')
+                        continue
+                    data = delete_data = None
+                    if name == 'users-avatar':
+                        data = {'avatar': _image()}
+                    elif name.endswith('-batch'):
+                        if not self.context['fresh_recipes']:
+                            self.skipped.append(f'{name}: нет данных')
+                            continue
+                        data = delete_data = {
+                            'recipes': self.context['fresh_recipes']}
+                    self.measure_pair(
+                        name, path, TOGGLES[name], data, delete_data)
+                elif name in TOGGLES or (name, method) in RECIPE_WRITES:
+                    continue  # вторая половина пары / сценарий рецепта
+                else:
+                    self.skipped.append(f'{method.upper()} {name}')
+        if any(selected(name) for name, _ in RECIPE_WRITES):
+            self.measure_recipe_writes()
+        return self.report()
+
+    def report(self):
+        return {
+            'meta': {
+                'created': timezone.now().isoformat(timespec='seconds'),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'iterations': self.iterations,
+                'warmup': self.warmup,
+                'cold': self.cold,
+                'dataset': {
+                    'users': User.objects.count(),
+                    'recipes': Recipe.objects.count(),
+                    'ingredients': Ingredient.objects.count(),
+                    'follows': Follow.objects.count(),
+                    'favorites': Favorite.objects.count(),
+                    'carts': ShoppingCart.objects.count(),
+                },
+            },
+            'results': sorted(self.results, key=lambda row: row['key']),
+            'skipped': sorted(self.skipped),
+        }
+
+
+def compare(old, new, tolerance=0.2):
+    """
+    Строки сравнения [(ключ, было, стало, регрессия ли)]: регрессия —
+    больше запросов или p95 выросло больше чем на tolerance.
+    """
+    before = {row['key']: row for row in old['results']}
+    rows = []
+    for row in new['results']:
+        previous = before.get(row['key'])
+        if previous is None:
+            rows.append((row['key'], None, row, False))
+            continue
+        regressed = (
+            row['queries'] > previous['queries']
+            or row['p95_ms'] > previous['p95_ms'] * (1 + tolerance)
+        )
+        rows.append((row['key'], previous, row, regressed))
+    return rows
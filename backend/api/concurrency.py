@@ -0,0 +1,220 @@
+"""
+Чтение под нагрузкой в двух режимах (manage.py bench_concurrency).
+
+Одни и те же GET (лента, карточка, поиск ингредиентов, профиль,
+короткая ссылка) идут через WSGIHandler, у которого не больше workers
+запросов одновременно — как у стольких же синхронных воркеров gunicorn,
+и через ASGIHandler с foodgram.urls_async — как у одного
+uvicorn-воркера. Перед каждым SQL-запросом добавляется задержка
+(удалённая или перегруженная БД): синхронный воркер всё это время
+занят, async-воркер принимает следующие запросы.
+
+Клиентов clients, каждый шлёт следующий запрос, получив ответ;
+время ответа включает ожидание свободного воркера. Перед замером
+ответы обоих режимов сравниваются побайтно.
+"""
+import asyncio
+import itertools
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Recipe
+from users.models import Follow
+
+from .benchmark import percentile
+
+URLCONFS = {'wsgi': 'foodgram.urls', 'asgi': 'foodgram.urls_async'}
+
+
+@contextmanager
+def db_latency(seconds):
+    """Задержка перед каждым SQL-запросом во всех соединениях."""
+    def delay(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def install(sender=None, connection=None, **kwargs):
+        if delay not in connection.execute_wrappers:
+            connection.execute_wrappers.append(delay)
+
+    # соединения у каждого потока свои — ставим и на будущие
+    connection_created.connect(install, weak=False)
+    for connection in connections.all():
+        install(connection=connection)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(install)
+        for connection in connections.all():
+            if delay in connection.execute_wrappers:
+                connection.execute_wrappers.remove(delay)
+
+
+def targets(user):
+    """Пути запросов; короткая ссылка — без API, как из мессенджера."""
+    recipe = Recipe.objects.order_by('-favorites_count', 'pk').first()
+    if recipe is None:
+        raise ValueError('в базе нет рецептов — seed_foodgram')
+    author = (Follow.objects.filter(user=user)
+              .values_list('author_id', flat=True).first()
+              or recipe.author_id)
+    paths = [
+        reverse('recipe-list'),
+        reverse('recipe-list') + '?page=2',
+        reverse('recipe-list') + f'?author={author}',
+        reverse('recipe-detail', args=[recipe.pk]),
+        reverse('ingredient-list') + '?name=са',
+        reverse('users-detail', args=[author]),
+        reverse('recipe-link', args=[recipe.pk]),
+    ]
+    if user is not None:
+        paths.append(reverse('users-me'))
+    return paths
+
+
+class Load:
+    def __init__(self, user=None, clients=32, requests=500):
+        self.clients, self.requests = clients, requests
+        self.paths = targets(user)
+        self.headers = {}
+        if user is not None:
+            token, _ = Token.objects.get_or_create(user=user)
+            self.headers['Authorization'] = f'Token {token.key}'
+
+    # один запрос
+    def wsgi_get(self, handler, path):
+        environ = RequestFactory().get(
+            path, headers=self.headers).environ
+        status = []
+        result = handler(
+            environ, lambda line, headers, exc_info=None: status.append(
+                int(line.split()[0])))
+        try:
+            body = b''.join(result)
+        finally:
+            result.close()  # request_finished: соединение закрывается
+        return status[0], body
+
+    async def asgi_get(self, app, path):
+        url = urlsplit(path)
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'},
+            'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': url.path, 'raw_path': url.path.encode(),
+            'query_string': url.query.encode(), 'root_path': '',
+            'headers': [(b'host', b'testserver'), *(
+                (name.lower().encode(), value.encode())
+                for name, value in self.headers.items())],
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+        }
+        messages = iter([{'type': 'http.request', 'body': b''}])
+        response = {'status': None, 'body': []}
+
+        async def receive():
+            message = next(messages, None)
+            if message is None:  # клиент не уходит, пока не получит ответ
+                await asyncio.Event().wait()
+            return message
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            else:
+                response['body'].append(message.get('body', b''))
+
+        await app(scope, receive, send)
+        return response['status'], b''.join(response['body'])
+
+    # сверка ответов
+    def mismatches(self):
+        """Пути, где async-режим ответил не так, как синхронный."""
+        with override_settings(ROOT_URLCONF=URLCONFS['wsgi']):
+            handler = WSGIHandler()
+            expected = {path: self.wsgi_get(handler, path)
+                        for path in self.paths}
+        with override_settings(ROOT_URLCONF=URLCONFS['asgi']):
+            app = ASGIHandler()
+            actual = asyncio.run(self._asgi_all(app))
+        return [path for path in self.paths
+                if expected[path] != actual[path]]
+
+    async def _asgi_all(self, app):
+        return {path: await self.asgi_get(app, path) for path in self.paths}
+
+    # нагрузка
+    def run_wsgi(self, workers):
+        handler = WSGIHandler()
+        queue, lock = self._queue(), threading.Lock()
+
+        def client(workers):
+            samples = []
+            while True:
+                with lock:
+                    path = next(queue, None)
+                if path is None:
+                    return samples
+                started = time.perf_counter()
+                # очередь к воркерам — по порядку прихода, как у gunicorn
+                status, _ = workers.submit(
+                    self.wsgi_get, handler, path).result()
+                samples.append((status, time.perf_counter() - started))
+
+        with override_settings(ROOT_URLCONF=URLCONFS['wsgi']), \
+                ThreadPoolExecutor(workers) as pool, \
+                ThreadPoolExecutor(self.clients) as clients:
+            started = time.perf_counter()
+            futures = [clients.submit(client, pool)
+                       for _ in range(self.clients)]
+            samples = [sample for future in futures
+                       for sample in future.result()]
+            return self._summary('wsgi', samples, started)
+
+    def run_asgi(self):
+        app = ASGIHandler()
+        queue = self._queue()
+
+        async def client():
+            samples = []
+            for path in queue:
+                started = time.perf_counter()
+                status, _ = await self.asgi_get(app, path)
+                samples.append((status, time.perf_counter() - started))
+            return samples
+
+        async def run():
+            results = await asyncio.gather(
+                *(client() for _ in range(self.clients)))
+            return [sample for samples in results for sample in samples]
+
+        with override_settings(ROOT_URLCONF=URLCONFS['asgi']):
+            started = time.perf_counter()
+            samples = asyncio.run(run())
+            return self._summary('asgi', samples, started)
+
+    def _queue(self):
+        return itertools.islice(itertools.cycle(self.paths), self.requests)
+
+    def _summary(self, mode, samples, started):
+        elapsed = time.perf_counter() - started
+        timings = [seconds for _, seconds in samples]
+        return {
+            'mode': mode,
+            'requests': len(samples),
+            'errors': sum(status >= 500 for status, _ in samples),
+            'rps': round(len(samples) / elapsed, 1),
+            'p50_ms': round(percentile(timings, 0.5) * 1000, 2),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 2),
+            'mean_ms': round(statistics.fmean(timings) * 1000, 2),
+        }
@@ -0,0 +1,99 @@
+"""
+Условные GET для рецептов: ETag и Last-Modified.
+
+Карточка: валидаторы берутся одним запросом по первичному ключу
+(updated_at + флаги зрителя через EXISTS), поэтому 304 отдаётся
+до get_object() и сериализатора. Last-Modified — только для анонима:
+флаги авторизованного в updated_at не отражаются. Тот же updated_at —
+версия карточки в ключе кэша ответов: валидаторы и отданное тело
+описывают одно и то же состояние рецепта.
+
+Лента зависит от многих строк (и от удалённых), дешёвого валидатора
+у неё нет — ETag считается по готовым данным страницы (обычно
+из кэша ответов), Last-Modified только информирует.
+"""
+import hashlib
+import json
+
+from django.db.models import Exists, OuterRef
+from django.utils.http import http_date
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Follow
+
+
+def _etag(request, *parts):
+    # одни и те же данные в JSON и в browsable API — разные тела,
+    # ссылки на картинки абсолютные — тело зависит и от хоста
+    raw = '|'.join(map(str, (
+        request.accepted_media_type, request.scheme, request.get_host(),
+        *parts,
+    )))
+    return f'"{hashlib.sha256(raw.encode()).hexdigest()[:32]}"'
+
+
+def _validators_query(request, pk):
+    """values_list для валидаторов карточки; None — pk не число."""
+    user = request.user
+    try:
+        recipes = Recipe.objects.filter(pk=pk)
+    except ValueError:  # pk не число
+        return None
+    fields = ['updated_at']
+    if user.is_authenticated:
+        recipes = recipes.annotate(
+            viewer_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            viewer_in_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            viewer_subscribed=Exists(Follow.objects.filter(
+                user=user, author=OuterRef('author_id'))),
+        )
+        fields += ['viewer_favorited', 'viewer_in_cart', 'viewer_subscribed']
+    return recipes.values_list(*fields)
+
+
+def _validators(request, row):
+    if row is None:
+        return None
+    user = request.user
+    updated_at = row[0]
+    etag = _etag(request, user.pk, *(
+        value.isoformat() if hasattr(value, 'isoformat') else value
+        for value in row))
+    # HTTP-даты с точностью до секунды
+    last_modified = int(updated_at.timestamp())
+    return (etag, None if user.is_authenticated else last_modified,
+            updated_at.isoformat())
+
+
+def recipe_validators(request, pk):
+    """
+    (etag, last_modified или None, версия для кэша ответов) карточки;
+    None — рецепта нет.
+    """
+    rows = _validators_query(request, pk)
+    if rows is None:
+        return None
+    return _validators(request, rows.first())
+
+
+async def arecipe_validators(request, pk):
+    """recipe_validators для async-представлений."""
+    rows = _validators_query(request, pk)
+    if rows is None:
+        return None
+    return _validators(request, await rows.afirst())
+
+
+def data_etag(request, data):
+    """ETag по данным ответа (флаги зрителя уже в них)."""
+    body = json.dumps(data, sort_keys=True, default=str)
+    return _etag(request, hashlib.sha256(body.encode()).hexdigest())
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -0,0 +1,189 @@
+"""
+Форматы выгрузки списка покупок: txt, csv, json, pdf.
+
+Каждый экспортёр — генератор кусков ответа для StreamingHttpResponse:
+строки уходят клиенту по мере чтения из БД, память не растёт
+с размером корзины.
+"""
+import csv
+import json
+import textwrap
+import zlib
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable
+
+from django.conf import settings
+from PIL import Image, ImageDraw, ImageFont
+
+
+def text_lines(shopping_list):
+    yield shopping_list.title
+    yield 'Продукты:'
+    for i, (name, unit, total) in enumerate(shopping_list.products(), 1):
+        yield f'{i}. {name.title()} ({unit}) — {total}'
+    yield 'Рецепты:'
+    for name, author in shopping_list.recipes():
+        yield f'{name} — {author}'
+
+
+def render_txt(shopping_list):
+    for line in text_lines(shopping_list):
+        yield f'{line}\n'
+
+
+class _Echo:
+    """Буфер для csv.writer, который просто возвращает строку."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(shopping_list):
+    writer = csv.writer(_Echo())
+    yield '\ufeff'  # BOM — чтобы Excel понял UTF-8
+    yield writer.writerow(('Продукт', 'Ед. измерения', 'Количество'))
+    for row in shopping_list.products():
+        yield writer.writerow(row)
+
+
+def render_json(shopping_list):
+    def dump(value):
+        return json.dumps(value, ensure_ascii=False)
+
+    yield (f'{{"user":{dump(shopping_list.user.username)},'
+           f'"created":{dump(shopping_list.created.isoformat())},'
+           '"products":[')
+    for i, (name, unit, total) in enumerate(shopping_list.products()):
+        yield ',' * bool(i) + dump(
+            {'name': name, 'measurement_unit': unit, 'total': total})
+    yield '],"recipes":['
+    for i, (name, author) in enumerate(shopping_list.recipes()):
+        yield ',' * bool(i) + dump({'name': name, 'author': author})
+    yield ']}'
+
+
+class _PdfPages:
+    """
+    Минимальный потоковый PDF: каждая страница — растр с текстом
+    (так кириллица не требует встраивания шрифтов). Страницы пишутся
+    сразу, дерево страниц и xref — в конце файла.
+    """
+
+    DPI = 150
+    WIDTH, HEIGHT = 1240, 1754  # A4 при 150 dpi
+    MARGIN = 110
+    FONT_SIZE = 28
+    LINE_HEIGHT = 40
+    LINE_WIDTH = 70  # символов в строке
+    PAGES_ID = 1
+
+    def __init__(self):
+        self.offset = 0
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = self.PAGES_ID + 1
+
+    def _write(self, chunk):
+        self.offset += len(chunk)
+        return chunk
+
+    def _object(self, number, body, stream=None):
+        self.offsets[number] = self.offset
+        chunk = f'{number} 0 obj\n'.encode() + body
+        if stream is not None:
+            chunk += b'\nstream\n' + stream + b'\nendstream'
+        return self._write(chunk + b'\nendobj\n')
+
+    def _new_id(self):
+        self.next_id += 1
+        return self.next_id - 1
+
+    def header(self):
+        return self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def page(self, lines):
+        image = Image.new('L', (self.WIDTH, self.HEIGHT), 255)
+        draw = ImageDraw.Draw(image)
+        font = _font(self.FONT_SIZE)
+        for row, line in enumerate(lines):
+            draw.text((self.MARGIN, self.MARGIN + row * self.LINE_HEIGHT),
+                      line, font=font, fill=0)
+        pixels = zlib.compress(image.tobytes(), 6)
+        image_id, content_id, page_id = (
+            self._new_id(), self._new_id(), self._new_id())
+        self.page_ids.append(page_id)
+        width, height = (round(size * 72 / self.DPI)
+                         for size in (self.WIDTH, self.HEIGHT))
+        content = f'q {width} 0 0 {height} 0 0 cm /Im0 Do Q'.encode()
+        yield self._object(image_id, (
+            f'<< /Type /XObject /Subtype /Image /Width {self.WIDTH} '
+            f'/Height {self.HEIGHT} /ColorSpace /DeviceGray '
+            f'/BitsPerComponent 8 /Filter /FlateDecode '
+            f'/Length {len(pixels)} >>').encode(), pixels)
+        yield self._object(
+            content_id, f'<< /Length {len(content)} >>'.encode(), content)
+        yield self._object(page_id, (
+            f'<< /Type /Page /Parent {self.PAGES_ID} 0 R '
+            f'/MediaBox [0 0 {width} {height}] '
+            f'/Resources << /XObject << /Im0 {image_id} 0 R >> >> '
+            f'/Contents {content_id} 0 R >>').encode())
+
+    def trailer(self):
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self.page_ids)
+        yield self._object(self.PAGES_ID, (
+            f'<< /Type /Pages /Kids [{kids}] '
+            f'/Count {len(self.page_ids)} >>').encode())
+        catalog_id = self._new_id()
+        yield self._object(
+            catalog_id, f'<< /Type /Catalog /Pages {self.PAGES_ID} 0 R >>'
+            .encode())
+        xref_at = self.offset
+        rows = ['0000000000 65535 f ']
+        rows += [f'{self.offsets[number]:010d} 00000 n '
+                 for number in range(1, self.next_id)]
+        yield self._write((
+            f'xref\n0 {self.next_id}\n' + '\n'.join(rows) + '\n'
+            f'trailer\n<< /Size {self.next_id} /Root {catalog_id} 0 R >>\n'
+            f'startxref\n{xref_at}\n%%EOF\n').encode())
+
+    @property
+    def lines_per_page(self):
+        return (self.HEIGHT - 2 * self.MARGIN) // self.LINE_HEIGHT
+
+
+@lru_cache(maxsize=None)
+def _font(size):
+    try:
+        return ImageFont.truetype(settings.SHOPPING_LIST_PDF_FONT, size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+def render_pdf(shopping_list):
+    pdf = _PdfPages()
+    yield pdf.header()
+    page = []
+    for line in text_lines(shopping_list):
+        for part in textwrap.wrap(line, pdf.LINE_WIDTH) or ['']:
+            page.append(part)
+            if len(page) == pdf.lines_per_page:
+                yield from pdf.page(page)
+                page = []
+    if page or not pdf.page_ids:
+        yield from pdf.page(page)
+    yield from pdf.trailer()
+
+
+@dataclass(frozen=True)
+class Exporter:
+    content_type: str
+    render: Callable
+
+
+EXPORTERS = {
+    'txt': Exporter('text/plain; charset=utf-8', render_txt),
+    'csv': Exporter('text/csv; charset=utf-8', render_csv),
+    'json': Exporter('application/json', render_json),
+    'pdf': Exporter('application/pdf', render_pdf),
+}
@@ -0,0 +1,202 @@
+"""
+Замеры запроса: SQL (число и время), сериализация, рендеринг, итог.
+
+RequestMetricsMiddleware кладёт метрики запроса в контекстную переменную;
+SQL считает execute_wrapper, который ставится на каждое соединение
+при его создании (install) — соединения у каждого потока свои, а в
+async-режиме ORM ходит в БД из потоков sync_to_async, куда переменная
+копируется вместе с контекстом. Участки кода отмечаются section()
+(сериализаторы — через InstrumentedSerializerMixin). Итог уходит:
+
+- в заголовок Server-Timing — всем (SERVER_TIMING=all) или только
+  персоналу (staff); браузер показывает его во вкладке Network;
+- в лог api.requests одной JSON-строкой; запрос, превысивший
+  REQUEST_QUERY_BUDGET запросов к БД, пишется с уровнем WARNING —
+  так N+1 видно сразу;
+- в метрики Prometheus (api.prometheus).
+"""
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject, empty
+
+from . import prometheus
+
+logger = logging.getLogger('api.requests')
+
+_current = ContextVar('request_metrics', default=None)
+
+
+@dataclass
+class Metrics:
+    queries: int = 0
+    db: float = 0.0
+    # участок -> секунды; вложенный вызов того же участка не считается
+    sections: dict = field(default_factory=dict)
+    active: set = field(default_factory=set)
+
+    def execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db += time.perf_counter() - started
+
+    def add(self, name, seconds):
+        self.sections[name] = self.sections.get(name, 0.0) + seconds
+
+
+def _execute(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics.execute(execute, sql, params, many, context)
+
+
+def install(sender, connection, **kwargs):
+    """connection_created: счётчик SQL на соединение (один раз)."""
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+def current():
+    """Метрики текущего запроса или None (вне запроса)."""
+    return _current.get()
+
+
+@contextmanager
+def section(name):
+    """Засечь участок кода; повторный вход в тот же участок — без счёта."""
+    metrics = _current.get()
+    if metrics is None or name in metrics.active:
+        yield
+        return
+    metrics.active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.active.discard(name)
+        metrics.add(name, time.perf_counter() - started)
+
+
+class InstrumentedSerializerMixin:
+    """to_representation — участок serialize (с запросами внутри него)."""
+
+    def to_representation(self, instance):
+        with section('serialize'):
+            return super().to_representation(instance)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+class RequestMetricsMiddleware:
+    """Должен стоять первым в MIDDLEWARE — тогда total полный."""
+
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        metrics, started = Metrics(), time.perf_counter()
+        with self._collect(metrics):
+            response = self.get_response(request)
+        return self._finish(request, response, metrics, started)
+
+    async def _acall(self, request):
+        metrics, started = Metrics(), time.perf_counter()
+        with self._collect(metrics):
+            response = await self.get_response(request)
+        return self._finish(request, response, metrics, started)
+
+    @staticmethod
+    @contextmanager
+    def _collect(metrics):
+        token = _current.set(metrics)
+        try:
+            with prometheus.IN_FLIGHT.track_inprogress():
+                yield
+        finally:
+            _current.reset(token)
+
+    def _finish(self, request, response, metrics, started):
+        total = time.perf_counter() - started
+        self._report(request, response, metrics, total)
+        prometheus.observe(request, response, metrics, total)
+        return response
+
+    def process_template_response(self, request, response):
+        # ответы DRF рендерятся сразу после этого хука
+        metrics = _current.get()
+        started = time.perf_counter()
+        response.add_post_render_callback(
+            lambda response: metrics.add(
+                'render', time.perf_counter() - started))
+        return response
+
+    @staticmethod
+    def _user(request):
+        """
+        Пользователь, если его уже определили: пользователя по токену
+        DRF проставляет и в исходный request. Ленивый пользователь сессии
+        не трогаем — в async-режиме это запрос к БД из event loop.
+        """
+        user = getattr(request, 'user', None)
+        if isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+            return None
+        return user
+
+    def _visible(self, request):
+        mode = settings.SERVER_TIMING
+        if mode == 'all':
+            return True
+        user = self._user(request)
+        return mode == 'staff' and bool(user and user.is_staff)
+
+    def _report(self, request, response, metrics, total):
+        budget = settings.REQUEST_QUERY_BUDGET
+        over_budget = bool(budget) and metrics.queries > budget
+        if self._visible(request):
+            timings = [
+                f'db;dur={_ms(metrics.db)};desc="{metrics.queries} queries"',
+                *(f'{name};dur={_ms(seconds)}'
+                  for name, seconds in metrics.sections.items()),
+                f'total;dur={_ms(total)}',
+            ]
+            if over_budget:
+                timings.append(f'budget;desc="over {budget} queries"')
+            response['Server-Timing'] = ', '.join(timings)
+
+        level = logging.WARNING if over_budget else logging.INFO
+        if not logger.isEnabledFor(level):
+            return
+        match = request.resolver_match
+        user = self._user(request)
+        logger.log(level, json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'user': user.pk if user and user.is_authenticated else None,
+            'queries': metrics.queries,
+            'db_ms': _ms(metrics.db),
+            **{f'{name}_ms': _ms(seconds)
+               for name, seconds in metrics.sections.items()},
+            'total_ms': _ms(total),
+            'over_budget': over_budget,
+        }, ensure_ascii=False))
@@ -0,0 +1,124 @@
+import json
+import logging
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    setup_test_environment, teardown_test_environment,
+)
+
+from api import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет эндпоинты api.urls тестовым клиентом: p50/p95 "
+        "и число SQL-запросов; --output пишет JSON для --compare"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument(
+            "--warmup", type=int, default=2,
+            help="прогревочных запросов (в замер не идут)",
+        )
+        parser.add_argument(
+            "--cold", action="store_true",
+            help="сбрасывать кэш ответов перед каждым запросом",
+        )
+        parser.add_argument(
+            "--user", metavar="EMAIL",
+            help="от чьего имени (по умолчанию — самый активный)",
+        )
+        parser.add_argument(
+            "--only", action="append", metavar="ROUTE",
+            help="только маршруты, в имени которых есть подстрока",
+        )
+        parser.add_argument("--output", help="записать результат в JSON")
+        parser.add_argument(
+            "--compare", metavar="JSON",
+            help="сравнить с результатом прошлого прогона",
+        )
+        parser.add_argument(
+            "--tolerance", type=float, default=0.2,
+            help="рост p95 больше этой доли считается регрессией",
+        )
+        parser.add_argument(
+            "--fail-on-regression", action="store_true",
+            help="код выхода 1, если есть регрессии",
+        )
+
+    def handle(self, *args, **options):
+        if options["iterations"] < 1:
+            raise CommandError("--iterations должен быть положительным.")
+        user = None
+        if options["user"]:
+            user = get_user_model().objects.filter(
+                email=options["user"]).first()
+            if user is None:
+                raise CommandError(f"Нет пользователя {options['user']}.")
+        # тестовый клиент ходит на хост testserver; ответы 4xx
+        # (удаление того, чего нет, в начале пары) — не повод для логов
+        setup_test_environment()
+        request_logger = logging.getLogger("django.request")
+        level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            bench = benchmark.Bench(
+                user=user,
+                iterations=options["iterations"],
+                warmup=options["warmup"],
+                cold=options["cold"],
+            )
+            report = bench.run(options["only"])
+        except ValueError as exc:
+            raise CommandError(str(exc)) from exc
+        finally:
+            request_logger.setLevel(level)
+            teardown_test_environment()
+
+        self._table(report)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as fp:
+                json.dump(report, fp, ensure_ascii=False, indent=2,
+                          sort_keys=True)
+            self.stdout.write(f"Результат записан в {options['output']}.")
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as fp:
+                old = json.load(fp)
+            regressions = self._compare(
+                old, report, options["tolerance"])
+            if regressions and options["fail_on_regression"]:
+                raise CommandError(f"Регрессий: {regressions}.")
+
+    def _table(self, report):
+        self.stdout.write(
+            f"{'запрос':<60} {'код':>4} {'p50, мс':>9} {'p95, мс':>9} "
+            f"{'SQL':>4}"
+        )
+        for row in report["results"]:
+            self.stdout.write(
+                f"{row['key']:<60} {row['status']:>4} {row['p50_ms']:>9} "
+                f"{row['p95_ms']:>9} {row['queries']:>4}"
+            )
+        if report["skipped"]:
+            self.stdout.write(
+                "Пропущено: " + ", ".join(report["skipped"]))
+
+    def _compare(self, old, new, tolerance):
+        regressions = 0
+        self.stdout.write("\nСравнение с прошлым прогоном:")
+        for key, before, after, regressed in benchmark.compare(
+                old, new, tolerance):
+            if before is None:
+                self.stdout.write(f"  {key}: новый замер")
+                continue
+            line = (
+                f"  {key}: p95 {before['p95_ms']} → {after['p95_ms']} мс, "
+                f"SQL {before['queries']} → {after['queries']}"
+            )
+            if regressed:
+                regressions += 1
+                line = self.style.ERROR(line + "  РЕГРЕССИЯ")
+            self.stdout.write(line)
+        return regressions
@@ -0,0 +1,97 @@
+import logging
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.test.utils import (
+    setup_test_environment, teardown_test_environment,
+)
+
+from api import benchmark, concurrency
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает WSGI (N синхронных воркеров) и ASGI (async-чтение) "
+        "на одних и тех же GET при искусственной задержке SQL"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--latency", type=float, default=20,
+            help="задержка каждого SQL-запроса, мс",
+        )
+        parser.add_argument(
+            "--clients", type=int, default=32,
+            help="одновременных клиентов",
+        )
+        parser.add_argument(
+            "--requests", type=int, default=500,
+            help="запросов на режим",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=4,
+            help="синхронных воркеров в режиме WSGI",
+        )
+        parser.add_argument(
+            "--user", metavar="EMAIL",
+            help="от чьего имени (по умолчанию — самый активный)",
+        )
+        parser.add_argument(
+            "--anon", action="store_true", help="без токена",
+        )
+        parser.add_argument(
+            "--keep-cache", action="store_true",
+            help="не выключать кэш ответов рецептов",
+        )
+
+    def handle(self, *args, **options):
+        if min(options["clients"], options["requests"],
+               options["workers"]) < 1:
+            raise CommandError(
+                "--clients, --requests и --workers должны быть "
+                "положительными.")
+        user = None
+        if not options["anon"]:
+            users = get_user_model().objects
+            user = (users.filter(email=options["user"]).first()
+                    if options["user"] else benchmark.default_user())
+            if user is None:
+                raise CommandError("Нет пользователя.")
+        cache = {} if options["keep_cache"] else {"RECIPE_CACHE_TIMEOUT": 0}
+
+        # тестовый клиент ходит на хост testserver
+        setup_test_environment()
+        request_logger = logging.getLogger("django.request")
+        level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            with override_settings(**cache):
+                load = concurrency.Load(
+                    user, options["clients"], options["requests"])
+                mismatches = load.mismatches()
+                with concurrency.db_latency(options["latency"] / 1000):
+                    results = [load.run_wsgi(options["workers"]),
+                               load.run_asgi()]
+        except ValueError as exc:
+            raise CommandError(str(exc)) from exc
+        finally:
+            request_logger.setLevel(level)
+            teardown_test_environment()
+
+        self.stdout.write(
+            f"Задержка SQL {options['latency']} мс, клиентов "
+            f"{options['clients']}, WSGI-воркеров {options['workers']}.")
+        self.stdout.write(
+            f"{'режим':<6} {'запросов':>8} {'ошибок':>6} {'RPS':>8} "
+            f"{'p50, мс':>9} {'p95, мс':>9}")
+        for row in results:
+            self.stdout.write(
+                f"{row['mode']:<6} {row['requests']:>8} {row['errors']:>6} "
+                f"{row['rps']:>8} {row['p50_ms']:>9} {row['p95_ms']:>9}")
+        wsgi, asgi = results
+        self.stdout.write(
+            f"ASGI/WSGI по RPS: {asgi['rps'] / wsgi['rps']:.1f}×")
+        if mismatches:
+            self.stdout.write(self.style.ERROR(
+                "Ответы режимов различаются: " + ", ".join(mismatches)))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from api import response_cache
+
+
+class Command(BaseCommand):
+    help = "Статистика кэша ответов рецептов; --clear сбрасывает кэш"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--clear", action="store_true",
+            help="Новое поколение: все закэшированные ответы устаревают",
+        )
+        parser.add_argument(
+            "--reset-stats", action="store_true",
+            help="Обнулить счётчики попаданий и промахов",
+        )
+
+    def handle(self, *args, **options):
+        stats = response_cache.stats()
+        total = sum(stats.values())
+        ratio = stats["hit"] / total if total else 0
+        self.stdout.write(
+            f"Поколение: {response_cache.generation()}\n"
+            f"Попаданий: {stats['hit']}, промахов: {stats['miss']} "
+            f"({ratio:.1%} попаданий)"
+        )
+        if options["reset_stats"]:
+            response_cache.reset_stats()
+            self.stdout.write("Счётчики обнулены.")
+        if options["clear"]:
+            response_cache.bump_generation()
+            self.stdout.write(self.style.SUCCESS("Кэш сброшен."))
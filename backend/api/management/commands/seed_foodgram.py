@@ -0,0 +1,71 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import response_cache
+from recipes import seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Заполняет базу синтетическими пользователями, рецептами, "
+        "подписками, избранным и корзинами (для замеров)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--recipes", type=int, default=1000)
+        parser.add_argument(
+            "--follows", type=float, default=5,
+            help="подписок на пользователя в среднем",
+        )
+        parser.add_argument(
+            "--favorites", type=float, default=10,
+            help="рецептов в избранном на пользователя в среднем",
+        )
+        parser.add_argument(
+            "--carts", type=float, default=3,
+            help="рецептов в корзине на пользователя в среднем",
+        )
+        parser.add_argument(
+            "--ingredients", type=int, nargs=2, default=(3, 12),
+            metavar=("MIN", "MAX"), help="продуктов в рецепте",
+        )
+        parser.add_argument(
+            "--days", type=int, default=365,
+            help="за сколько дней разбросать даты публикации",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--seed", type=int,
+            help="зерно генератора — для воспроизводимых наборов",
+        )
+
+    def handle(self, *args, **options):
+        low, high = options["ingredients"]
+        if not 1 <= low <= high:
+            raise CommandError("--ingredients: нужно 1 <= MIN <= MAX.")
+        started = time.monotonic()
+        try:
+            created = seed.seed(
+                users=options["users"],
+                recipes=options["recipes"],
+                follows=options["follows"],
+                favorites=options["favorites"],
+                carts=options["carts"],
+                ingredients=(low, high),
+                days=options["days"],
+                batch_size=options["batch_size"],
+                random_seed=options["seed"],
+                progress=self.stdout.write,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc)) from exc
+        # bulk_create не шлёт сигналов — кэш ответов сбрасываем сами
+        response_cache.bump_generation()
+        self.stdout.write(self.style.SUCCESS(
+            "Создано: " + ", ".join(
+                f"{name} {count}" for name, count in created.items())
+            + f" за {time.monotonic() - started:.1f} с. "
+            f"Пароль пользователей: {seed.PASSWORD}"
+        ))
@@ -1,7 +1,184 @@
+import base64
+import binascii
+import json
+
+from django.core.paginator import InvalidPage, Page
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from recipes.utils import EstimatedCountPaginator
+
+
+class KeysetCursor:
+    """
+    Курсорная (keyset) пагинация по сортировке queryset.
+
+    Курсор — значения полей сортировки у крайней строки страницы,
+    следующая страница — WHERE (pub_date, id) < (..., ...) без OFFSET
+    и без COUNT(*). Сортировка берётся из queryset (или Meta.ordering)
+    и дополняется pk, чтобы ключ был уникальным.
+    """
+
+    def __init__(self, queryset):
+        opts = queryset.model._meta
+        ordering = list(queryset.query.order_by or opts.ordering)
+        if not all(isinstance(field, str) for field in ordering):
+            raise ValueError('Курсор поддерживает только сортировку по полям')
+        names = [field.lstrip('-') for field in ordering]
+        if 'pk' not in names and opts.pk.name not in names:
+            last_desc = ordering[-1].startswith('-') if ordering else True
+            ordering.append('-pk' if last_desc else 'pk')
+        self.queryset = queryset.order_by(*ordering)
+        self.fields = [
+            (self._attname(opts, field.lstrip('-')),
+             self._output_field(queryset, opts, field.lstrip('-')),
+             field.startswith('-'))
+            for field in ordering
+        ]
+
+    @staticmethod
+    def _attname(opts, name):
+        return opts.pk.attname if name == 'pk' else name
+
+    @staticmethod
+    def _output_field(queryset, opts, name):
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return opts.pk if name == 'pk' else opts.get_field(name)
+
+    # кодирование курсора
+    def encode(self, obj, reverse):
+        values = [self._dump(getattr(obj, name)) for name, _, _ in self.fields]
+        raw = json.dumps({'v': values, 'r': reverse}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def _dump(value):
+        if value is None or isinstance(value, (int, float, str)):
+            return value
+        return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+    def decode(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            data = json.loads(raw)
+            values = [field.to_python(value) for value, (_, field, _)
+                      in zip(data['v'], self.fields, strict=True)]
+            return values, bool(data['r'])
+        except (binascii.Error, ValueError, KeyError, TypeError) as error:
+            raise NotFound('Некорректный курсор.') from error
+
+    # страница
+    def _after(self, values, reverse):
+        """Строки строго после ключа values в порядке сортировки."""
+        condition, equal = Q(), Q()
+        for (name, _, desc), value in zip(self.fields, values):
+            lookup = 'lt' if desc != reverse else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        # первое поле ещё и диапазоном — чтобы планировщик взял индекс
+        name, _, desc = self.fields[0]
+        lookup = 'lte' if desc != reverse else 'gte'
+        return Q(**{f'{name}__{lookup}': values[0]}) & condition
+
+    def page(self, cursor, size):
+        """(объекты, курсор назад или None, курсор вперёд или None)."""
+        values, reverse = self.decode(cursor) if cursor else (None, False)
+        queryset = self.queryset
+        if reverse:
+            queryset = queryset.reverse()
+        if values is not None:
+            queryset = queryset.filter(self._after(values, reverse))
+        rows = list(queryset[:size + 1])
+        has_more = len(rows) > size
+        rows = rows[:size]
+        if reverse:
+            rows.reverse()
+        if not rows:
+            return rows, None, None
+        has_next = has_more if not reverse else True
+        has_previous = values is not None if not reverse else has_more
+        return (
+            rows,
+            self.encode(rows[0], True) if has_previous else None,
+            self.encode(rows[-1], False) if has_next else None,
+        )
 
 
 class FoodgramPagination(PageNumberPagination):
-    """Кастомный пагинатор."""
+    """
+    Кастомный пагинатор.
+
+    По умолчанию — номера страниц (?page=, ?limit=). Дополнительно:
+    ?cursor= (пустой для первой страницы) — курсорный режим без COUNT(*)
+    и OFFSET; ?count=estimated — номера страниц, но на больших выборках
+    count берётся из статистики планировщика. Готовая выдача не из БД
+    (recipes.pantry.Ranking) — только номера страниц.
+    """
     page_size = 6
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        params = request.query_params
+        from_db = isinstance(queryset, QuerySet)
+        self.cursor_mode = from_db and self.cursor_query_param in params
+        if not self.cursor_mode:
+            estimated = (from_db and params.get(self.count_query_param)
+                         == 'estimated')
+            self.django_paginator_class = (
+                EstimatedCountPaginator if estimated else DjangoPaginator)
+            return super().paginate_queryset(queryset, request, view)
+
+        rows, self.previous_cursor, self.next_cursor = KeysetCursor(
+            queryset
+        ).page(
+            params[self.cursor_query_param],
+            self.get_page_size(request),
+        )
+        return rows
+
+    async def apaginate_queryset(self, queryset, request):
+        """
+        Номера страниц для async-представлений (api.async_views):
+        count и страница — через async ORM. Курсор и ?count=estimated
+        async-лента не берёт — их отдаёт синхронное представление.
+        """
+        self.request = request
+        self.cursor_mode = False
+        page_size = self.get_page_size(request)
+        paginator = DjangoPaginator(queryset, page_size)
+        paginator.count = await queryset.acount()
+        number = self.get_page_number(request, paginator)
+        try:
+            number = paginator.validate_number(number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=number, message=str(exc))) from exc
+        bottom = (number - 1) * page_size
+        rows = [obj async for obj in queryset[
+            bottom:bottom + page_size].aiterator(chunk_size=page_size)]
+        self.page = Page(rows, number, paginator)
+        return rows
+
+    def _cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self._cursor_link(self.next_cursor),
+            'previous': self._cursor_link(self.previous_cursor),
+            'results': data,
+        })
@@ -0,0 +1,106 @@
+"""
+Метрики в формате Prometheus: GET /metrics.
+
+Запросы (число, время, SQL) пишет RequestMetricsMiddleware
+(api.instrumentation) по маршрутам DRF: recipe-list,
+recipe-download-shopping-cart... — не по путям, чтобы число рядов
+не росло с числом рецептов.
+
+gunicorn держит несколько процессов-воркеров, поэтому значения живут
+в mmap-файлах общего каталога PROMETHEUS_MULTIPROC_DIR (его готовит
+gunicorn.conf.py) и при выдаче складываются по всем воркерам — ответ
+не зависит от того, какой воркер принял запрос. Без этой переменной
+(runserver) — обычный реестр одного процесса.
+
+Кэш ответов и очередь задач и так общие (кэш и БД) — их значения
+читаются в момент выдачи.
+"""
+import os
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils import timezone
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+    Histogram, generate_latest, multiprocess,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from jobs import queue
+
+from . import response_cache
+
+REQUESTS = Counter(
+    'foodgram_http_requests', 'HTTP-запросы',
+    ('method', 'route', 'status'),
+)
+LATENCY = Histogram(
+    'foodgram_http_request_duration_seconds', 'Время ответа',
+    ('method', 'route'),
+)
+QUERIES = Histogram(
+    'foodgram_db_queries_per_request', 'SQL-запросов на HTTP-запрос',
+    ('route',), buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+DB_TIME = Histogram(
+    'foodgram_db_duration_seconds', 'Время SQL на HTTP-запрос',
+    ('route',),
+)
+IN_FLIGHT = Gauge(
+    'foodgram_http_requests_in_flight', 'Запросы в обработке',
+    multiprocess_mode='livesum',
+)
+
+
+def observe(request, response, metrics, total):
+    match = request.resolver_match
+    route = match.view_name if match else 'unmatched'
+    REQUESTS.labels(request.method, route, response.status_code).inc()
+    LATENCY.labels(request.method, route).observe(total)
+    QUERIES.labels(route).observe(metrics.queries)
+    DB_TIME.labels(route).observe(metrics.db)
+
+
+class SharedStateCollector:
+    """Кэш ответов и очередь задач — на момент выдачи."""
+
+    def collect(self):
+        events = CounterMetricFamily(
+            'foodgram_response_cache_events', 'Кэш ответов рецептов',
+            labels=('event',))
+        for event, count in response_cache.stats().items():
+            events.add_metric((event,), count)
+        yield events
+
+        counts, oldest = queue.status()
+        jobs = GaugeMetricFamily(
+            'foodgram_jobs', 'Фоновые задачи', labels=('task', 'status'))
+        for (name, status), count in counts.items():
+            jobs.add_metric((name, status), count)
+        yield jobs
+        lag = GaugeMetricFamily(
+            'foodgram_jobs_queue_lag_seconds',
+            'Сколько ждёт самая старая готовая к запуску задача')
+        lag.add_metric(
+            (), (timezone.now() - oldest).total_seconds() if oldest else 0)
+        yield lag
+
+
+shared = CollectorRegistry(auto_describe=False)
+shared.register(SharedStateCollector())
+
+
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden()
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        # реестр на каждую выдачу: складывает файлы всех воркеров
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(
+        generate_latest(registry) + generate_latest(shared),
+        content_type=CONTENT_TYPE_LATEST,
+    )
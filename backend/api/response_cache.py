@@ -0,0 +1,213 @@
+"""
+Кэш ответов ленты и карточки рецепта.
+
+Хранятся уже сериализованные данные «как для анонима» (флаги зрителя
+выключены) под ключом из поколения, хоста, пути и значимых параметров
+запроса. Аноним получает их как есть, авторизованному флаги
+подставляются пачкой через ViewerState — рецепты заново
+не сериализуются.
+
+Поколение — счётчик в общем кэше; его увеличивают сигналы
+(api/signals.py) после коммита записи в рецепты, их ингредиенты,
+справочник и профили пользователей. Избранное и корзины меняются
+на порядки чаще — они поколение не сдвигают, иначе кэш сбрасывался бы
+с частотой кликов всех пользователей:
+- карточка хранится под своей версией (updated_at, его сдвигает
+  и добавление в избранное), по которой посчитаны её ETag
+  и Last-Modified, — устаревает только она;
+- в страницах ленты из кэша счётчики (COUNTERS) подставляются
+  при чтении одним запросом по id, как флаги зрителя. Порядок
+  ?ordering=popular в закэшированной странице может отстать
+  от популярности не больше чем на RECIPE_CACHE_TIMEOUT.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+
+from recipes.models import Recipe
+
+from .viewer_state import ViewerState
+
+GENERATION_KEY = 'api:recipes:generation'
+STATS_KEY = 'api:recipes:stats:{}'
+EVENTS = ('hit', 'miss')
+# поля рецепта, которые меняются без сдвига поколения, — в страницах
+# из кэша берутся из БД
+COUNTERS = ('favorites_count',)
+# заголовки ответа, не зависящие от зрителя, — хранятся вместе с данными
+CACHED_HEADERS = ('Last-Modified',)
+# локальные счётчики попаданий сбрасываются в общий кэш пачками,
+# чтобы не писать в кэш на каждый запрос
+FLUSH_EVERY = 100
+
+
+# поколение
+def generation():
+    value = cache.get(GENERATION_KEY)
+    if value is None:
+        # старт со времени, а не с 1: если ключ вытеснили, старые
+        # записи не совпадут с новым поколением
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        value = cache.get(GENERATION_KEY)
+    return value
+
+
+def bump_generation():
+    """Все закэшированные ответы устарели."""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+
+
+# ключ, чтение, запись
+def cache_key(request, params, version=None):
+    """
+    Ключ по хосту, пути и только тем параметрам, что влияют на ответ;
+    version — версия данных (updated_at карточки), по которой посчитаны
+    валидаторы ответа.
+    """
+    query = sorted(
+        (name, value)
+        for name in params
+        for value in request.query_params.getlist(name)
+    )
+    raw = (f'{request.scheme}://{request.get_host()}{request.path}'
+           f'?{urlencode(query)}#{version or ""}')
+    digest = hashlib.sha256(raw.encode()).hexdigest()[:32]
+    return f'api:recipes:{generation()}:{digest}'
+
+
+def lookup(key):
+    """(данные, заголовки) или None."""
+    entry = cache.get(key)
+    _count('miss' if entry is None else 'hit')
+    return entry
+
+
+def store(key, response):
+    headers = {name: response[name]
+               for name in CACHED_HEADERS if response.has_header(name)}
+    cache.set(key, (_map_recipes(response.data, _anonymous), headers),
+              settings.RECIPE_CACHE_TIMEOUT)
+
+
+# счётчики
+def _counters_query(data):
+    recipes = data['results'] if 'results' in data else [data]
+    return Recipe.objects.filter(
+        pk__in=[recipe['id'] for recipe in recipes],
+    ).values_list('pk', *COUNTERS)
+
+
+def _with_counters(data, rows):
+    counters = {pk: dict(zip(COUNTERS, values)) for pk, *values in rows}
+    # удалённый после записи в кэш рецепт — с прежними значениями
+    return _map_recipes(data, lambda recipe: {
+        **recipe, **counters.get(recipe['id'], {})})
+
+
+def refresh_counters(data):
+    """Подставить в данные из кэша текущие счётчики: один запрос."""
+    return _with_counters(data, _counters_query(data))
+
+
+async def arefresh_counters(data):
+    """refresh_counters для async-представлений."""
+    return _with_counters(
+        data, [row async for row in _counters_query(data)])
+
+
+# флаги зрителя
+def _map_recipes(data, func):
+    """Применить func к каждому рецепту страницы или к одному рецепту."""
+    if 'results' in data:
+        return {**data, 'results': [func(recipe)
+                                    for recipe in data['results']]}
+    return func(data)
+
+
+def _anonymous(recipe):
+    return {
+        **recipe,
+        'author': {**recipe['author'], 'is_subscribed': False},
+        'is_favorited': False,
+        'is_in_shopping_cart': False,
+    }
+
+
+def personalize(data, request):
+    """Подставить флаги текущего пользователя: запрос на отношение."""
+    state = ViewerState.of(request)
+    if state.is_anonymous:
+        return data
+    recipes = data['results'] if 'results' in data else [data]
+    state.load_recipe_ids(recipe['id'] for recipe in recipes)
+    state.load_authors(recipe['author']['id'] for recipe in recipes)
+    return _with_flags(data, state)
+
+
+async def apersonalize(data, request):
+    """personalize для async-представлений."""
+    state = ViewerState.of(request)
+    if state.is_anonymous:
+        return data
+    recipes = data['results'] if 'results' in data else [data]
+    await state.aload_recipe_ids(recipe['id'] for recipe in recipes)
+    await state.aload_authors(recipe['author']['id'] for recipe in recipes)
+    return _with_flags(data, state)
+
+
+def _with_flags(data, state):
+    return _map_recipes(data, lambda recipe: {
+        **recipe,
+        'author': {
+            **recipe['author'],
+            'is_subscribed': state.is_subscribed(recipe['author']['id']),
+        },
+        'is_favorited': state.is_favorited(recipe['id']),
+        'is_in_shopping_cart': state.is_in_shopping_cart(recipe['id']),
+    })
+
+
+# статистика
+_lock = threading.Lock()
+_pending = Counter()
+
+
+def _count(event):
+    with _lock:
+        _pending[event] += 1
+        if sum(_pending.values()) < FLUSH_EVERY:
+            return
+        pending = dict(_pending)
+        _pending.clear()
+    _flush(pending)
+
+
+def _flush(pending):
+    for event, count in pending.items():
+        key = STATS_KEY.format(event)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key, count)
+        except ValueError:
+            cache.set(key, count, None)
+
+
+def stats():
+    """{'hit': N, 'miss': M}: общие счётчики + ещё не сброшенные свои."""
+    with _lock:
+        pending = dict(_pending)
+    return {event: (cache.get(STATS_KEY.format(event)) or 0)
+            + pending.get(event, 0)
+            for event in EVENTS}
+
+
+def reset_stats():
+    cache.delete_many([STATS_KEY.format(event) for event in EVENTS])
@@ -1,43 +1,78 @@
 from __future__ import annotations
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import models, transaction
 from djoser.serializers import UserSerializer as DjoserUserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
+from jobs.models import Job
+from recipes import pantry, shopping_list
+from recipes.images import variant_urls
 from recipes.models import (
     Ingredient,
     Recipe,
     RecipeIngredient,
-    Favorite,
-    ShoppingCart,
+    ShoppingListItem,
 )
-from users.models import Follow
+from .instrumentation import InstrumentedSerializerMixin
+from .viewer_state import ViewerState
 
 User = get_user_model()
 
+
+class ViewerStateListSerializer(
+    InstrumentedSerializerMixin, serializers.ListSerializer
+):
+    """Перед сериализацией страницы подгружает флаги зрителя пачкой."""
+
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        self.child.load_viewer_state(
+            ViewerState.of(self.context['request']), items)
+        return super().to_representation(items)
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """{thumb|card|detail: {webp, jpeg}} — пусто, пока копии не готовы."""
+
+    def to_representation(self, variants):
+        request = self.context.get("request")
+        return {
+            name: {ext: request.build_absolute_uri(url) if request else url
+                   for ext, url in urls.items()}
+            for name, urls in variant_urls(variants).items()
+        }
+
+
 class AvatarSerializer(serializers.Serializer):
     avatar = Base64ImageField(required=True)
 
 
-class UserSerializer(DjoserUserSerializer):
+class UserSerializer(InstrumentedSerializerMixin, DjoserUserSerializer):
     """Базовый пользователь + avatar / is_subscribed."""
 
     avatar = serializers.ImageField(read_only=True)
+    avatar_variants = ImageVariantsField()
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta(DjoserUserSerializer.Meta):
-        fields = (*DjoserUserSerializer.Meta.fields, "avatar", "is_subscribed")
+        fields = (*DjoserUserSerializer.Meta.fields, "avatar",
+                  "avatar_variants", "is_subscribed")
+        list_serializer_class = ViewerStateListSerializer
+
+    @staticmethod
+    def load_viewer_state(state, authors):
+        state.load_authors(author.pk for author in authors)
 
     def get_is_subscribed(self, author):
-        user = self.context["request"].user
-        return (
-            user.is_authenticated
-            and Follow.objects.filter(user=user, author=author).exists()
-        )
+        return ViewerState.of(self.context["request"]).is_subscribed(author)
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(
+    InstrumentedSerializerMixin, serializers.ModelSerializer
+):
     class Meta:
         model = Ingredient
         fields = ("id", "name", "measurement_unit")
@@ -58,12 +93,15 @@ class RecipeIngredientReadSerializer(serializers.ModelSerializer):  # ③
         read_only_fields = fields
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class RecipeReadSerializer(
+    InstrumentedSerializerMixin, serializers.ModelSerializer
+):
     author = UserSerializer(read_only=True)
     ingredients = RecipeIngredientReadSerializer(
         many=True, source="recipe_ingredients", read_only=True
     )
     image = serializers.ImageField(read_only=True)
+    image_variants = ImageVariantsField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
@@ -77,29 +115,45 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             "is_in_shopping_cart",
             "name",
             "image",
+            "image_variants",
             "text",
             "cooking_time",
+            "favorites_count",
         )
         read_only_fields = fields
+        list_serializer_class = ViewerStateListSerializer
 
     # helpers
+    @staticmethod
+    def load_viewer_state(state, recipes):
+        state.load_recipes(recipes)
+
     def get_is_favorited(self, recipe):
-        user = self.context["request"].user
-        return (
-            user.is_authenticated
-            and Favorite.objects.filter(user=user, recipe=recipe).exists()
-        )
+        return ViewerState.of(self.context["request"]).is_favorited(recipe)
 
     def get_is_in_shopping_cart(self, recipe):
-        user = self.context["request"].user
-        return (
-            user.is_authenticated
-            and ShoppingCart.objects.filter(user=user, recipe=recipe).exists()
-        )
+        return ViewerState.of(
+            self.context["request"]).is_in_shopping_cart(recipe)
+
+
+class ShoppingListItemSerializer(
+    InstrumentedSerializerMixin, serializers.ModelSerializer
+):
+    id = serializers.IntegerField(source="ingredient_id", read_only=True)
+    name = serializers.CharField(source="ingredient.name", read_only=True)
+    measurement_unit = serializers.CharField(
+        source="ingredient.measurement_unit", read_only=True
+    )
+
+    class Meta:
+        model = ShoppingListItem
+        fields = ("id", "name", "measurement_unit", "total", "recipes_count")
+        read_only_fields = fields
 
 
 class IngredientAmount(serializers.Serializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    # продукты всех строк проверяет один IN-запрос (validate_ingredients)
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(min_value=1)
 
 
@@ -124,6 +178,19 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         ids = [i['id'] for i in items]
         if len(ids) != len(set(ids)):
             raise serializers.ValidationError('Ингредиенты повторяются')
+        # id вне диапазона ключа БД заведомо не найдутся
+        found = Ingredient.objects.in_bulk(
+            pk for pk in ids if 0 < pk <= models.BigIntegerField.MAX_BIGINT)
+        if len(found) != len(ids):
+            # ошибки по строкам — как у PrimaryKeyRelatedField
+            message = (serializers.PrimaryKeyRelatedField
+                       .default_error_messages['does_not_exist'])
+            raise serializers.ValidationError([
+                {} if pk in found else {'id': [message.format(pk_value=pk)]}
+                for pk in ids
+            ], code='does_not_exist')
+        for item in items:
+            item['id'] = found[item['id']]
         return items
 
     # PATCH без `ingredients`  / пустая `image`
@@ -139,27 +206,54 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         return attrs
 
     # helpers
-    @staticmethod
-    def _save_ingredients(recipe: Recipe, items):
-        recipe.recipe_ingredients.all().delete()
+    def _save_ingredients(self, recipe, items, created=False):
+        """
+        Записать ингредиенты разницей с тем, что в БД: вставить новые,
+        обновить изменившиеся количества, удалить лишние — нетронутые
+        строки не переписываются.
+        """
+        amounts = {item["id"].pk: item["amount"] for item in items}
+        products = {item["id"].pk: item["id"] for item in items}
+        # внутри транзакции и после UPDATE рецепта: строка рецепта
+        # заблокирована, параллельная правка ждёт коммита
+        current = {} if created else {
+            row.ingredient_id: row
+            for row in RecipeIngredient.objects.filter(recipe=recipe)}
+        old = {pk: row.amount for pk, row in current.items()}
+
+        stale = [row.pk for pk, row in current.items() if pk not in amounts]
+        if stale:
+            RecipeIngredient.objects.filter(pk__in=stale).delete()
+        changed = []
+        for pk, row in current.items():
+            if pk in amounts and row.amount != amounts[pk]:
+                row.amount = amounts[pk]
+                changed.append(row)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ["amount"])
         RecipeIngredient.objects.bulk_create(
-            RecipeIngredient(
-                recipe=recipe,
-                ingredient=item["id"],
-                amount=item["amount"],
-            )
-            for item in items
+            RecipeIngredient(recipe=recipe, ingredient=products[pk],
+                             amount=amount)
+            for pk, amount in amounts.items() if pk not in current
         )
+        if not created:
+            # рецепт может лежать в корзинах — правим их списки покупок
+            shopping_list.recipe_changed(recipe, old, amounts)
+        pantry.recipe_changed(recipe.pk, old, amounts)
 
     # create / update
+    @transaction.atomic
     def create(self, validated_data):
         items = validated_data.pop("ingredients")
         recipe = super().create(validated_data)
-        self._save_ingredients(recipe, items)
+        self._save_ingredients(recipe, items, created=True)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         items = validated_data.pop("ingredients", None)
+        # save() внутри сдвигает updated_at (auto_now) — в том числе
+        # когда меняются только ингредиенты
         instance = super().update(instance, validated_data)         # ⑥
         if items is not None:
             self._save_ingredients(instance, items)
@@ -167,31 +261,98 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
 
     # отдаём «карточку» после POST / PATCH
     def to_representation(self, instance):
+        # ингредиенты только что переписаны: прежний кэш prefetch
+        # устарел, перечитываем их одним запросом вместе с продуктами
+        instance._prefetched_objects_cache = {}
+        models.prefetch_related_objects([instance], models.Prefetch(
+            "recipe_ingredients",
+            queryset=RecipeIngredient.objects.select_related("ingredient"),
+        ))
         return RecipeReadSerializer(instance, context=self.context).data
 
 
-class RecipeShortSerializer(serializers.ModelSerializer):
+class RecipeShortSerializer(
+    InstrumentedSerializerMixin, serializers.ModelSerializer
+):
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "image_variants", "cooking_time",
+                  "favorites_count")
+        read_only_fields = fields
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Пачка id рецептов для избранного/корзины; повторы отбрасываются."""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(
+            min_value=1, max_value=models.BigIntegerField.MAX_BIGINT),
+        allow_empty=False,
+    )
+
+    def validate_recipes(self, ids):
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > settings.RECIPE_BATCH_LIMIT:
+            raise serializers.ValidationError(
+                f'Не больше {settings.RECIPE_BATCH_LIMIT} рецептов за раз')
+        return ids
+
+
+class PantrySerializer(serializers.Serializer):
+    """?ingredients=<id>&ingredients=<id>...&max_missing= для подбора."""
+
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False)
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+
+    def validate_ingredients(self, ids):
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > settings.PANTRY_INGREDIENTS_LIMIT:
+            raise serializers.ValidationError(
+                f'Не больше {settings.PANTRY_INGREDIENTS_LIMIT} продуктов')
+        return ids
+
+    def validate_max_missing(self, value):
+        if value > settings.PANTRY_MAX_MISSING:
+            raise serializers.ValidationError(
+                f'Не больше {settings.PANTRY_MAX_MISSING}')
+        return value
+
+
+class PantryRecipeSerializer(RecipeShortSerializer):
+    """Рецепт из подбора по продуктам и чего для него не хватает."""
+
+    missing = RecipeIngredientReadSerializer(many=True, read_only=True)
+
+    class Meta(RecipeShortSerializer.Meta):
+        fields = (*RecipeShortSerializer.Meta.fields, "missing")
         read_only_fields = fields
 
 
 class AuthorCardSerializer(UserSerializer):                        # ⑨
-    """Автор + его рецепты (recipes_limit)."""
+    """
+    Автор + его рецепты (recipes_limit).
+    Рецепты view кладёт заранее в `short_recipes`,
+    числа — готовые счётчики на User.
+    """
 
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.IntegerField(
-        source="recipes.count", read_only=True
-    )
 
     class Meta(UserSerializer.Meta):
-        fields = (*UserSerializer.Meta.fields, "recipes", "recipes_count")
+        fields = (*UserSerializer.Meta.fields, "recipes", "recipes_count",
+                  "followers_count")
 
     def get_recipes(self, author):
-        limit = self.context["request"].query_params.get("recipes_limit")
-        qs = author.recipes.all()
-        if limit and limit.isdigit():
-            qs = qs[: int(limit)]
-        return RecipeShortSerializer(qs, many=True, context=self.context).data
+        return RecipeShortSerializer(
+            author.short_recipes, many=True, context=self.context
+        ).data
+
+
+class JobSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ("id", "name", "status", "attempts", "created_at",
+                  "finished_at", "result")
+        read_only_fields = fields
@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from recipes.images import variants_ready
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+
+from . import authentication, response_cache
+
+
+def _invalidate():
+    # после коммита: иначе параллельный запрос успеет положить в новое
+    # поколение ещё старые данные
+    transaction.on_commit(response_cache.bump_generation)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver(variants_ready)
+def recipes_changed(**kwargs):
+    """
+    Рецепт, его ингредиенты, справочник или уменьшенные копии
+    картинок — кэш ответов устарел. Избранное и корзины поколение
+    не сдвигают (response_cache.COUNTERS).
+    """
+    _invalidate()
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(instance, created, update_fields=None, **kwargs):
+    # новый пользователь ещё не автор, а вход обновляет только
+    # last_login — в ответах рецептов ни то, ни другое не видно
+    if created or update_fields and set(update_fields) == {'last_login'}:
+        return
+    _invalidate()
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_deleted(**kwargs):
+    _invalidate()
+
+
+# кэш токенов (api.authentication)
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_auth_changed(instance, created, **kwargs):
+    """Профиль, аватар, пароль, блокировка — пользователь в кэше устарел."""
+    if not created:
+        transaction.on_commit(
+            lambda: authentication.invalidate_user(instance.pk))
+
+
+@receiver(variants_ready, sender=settings.AUTH_USER_MODEL)
+def user_avatar_variants_ready(pk, **kwargs):
+    transaction.on_commit(lambda: authentication.invalidate_user(pk))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(instance, **kwargs):
+    """Выход (djoser auth/token/logout) и удаление пользователя."""
+    # key — первичный ключ: после delete() он уже None
+    key = instance.key
+    transaction.on_commit(lambda: authentication.invalidate([key]))
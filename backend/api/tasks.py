@@ -0,0 +1,42 @@
+"""Фоновые задачи api (выполняет manage.py run_worker)."""
+import tempfile
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from jobs.queue import enqueue, task
+from recipes.shopping_list import ShoppingList
+
+from .exporters import EXPORTERS
+
+User = get_user_model()
+
+
+@task()
+def export_shopping_list(user_id, file_type):
+    """Выгрузка списка покупок в файл; результат — ссылка на него."""
+    exporter = EXPORTERS[file_type]
+    shopping_list = ShoppingList(User.objects.get(pk=user_id))
+    # в памяти до 1 МБ, дальше — на диске
+    with tempfile.SpooledTemporaryFile(max_size=2 ** 20) as buffer:
+        for chunk in exporter.render(shopping_list):
+            buffer.write(chunk.encode() if isinstance(chunk, str) else chunk)
+        buffer.seek(0)
+        # имя не угадать — файл отдаётся как обычный media
+        name = default_storage.save(
+            f'shopping_lists/{uuid.uuid4().hex}/shopping_list.{file_type}',
+            File(buffer),
+        )
+    enqueue(delete_export, {'name': name},
+            delay=timedelta(seconds=settings.SHOPPING_LIST_EXPORT_TTL))
+    return {'file': default_storage.url(name),
+            'content_type': exporter.content_type}
+
+
+@task()
+def delete_export(name):
+    default_storage.delete(name)
@@ -1,3 +1,824 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from api import authentication
+from api.serializers import RecipeWriteSerializer
+from jobs import queue
+from jobs.models import Job
+from recipes import pantry
+from recipes.models import (
+    Favorite, Ingredient, Recipe, RecipeIngredient, ShoppingCart,
+    ShoppingListItem,
+)
+from recipes.pantry import pantry_index
+from users.models import Follow
+
+User = get_user_model()
+
+MEDIA_ROOT = tempfile.mkdtemp()
+IMAGE = 'recipes/images/test.jpg'
+
+
+def make_user(name):
+    return User.objects.create_user(
+        username=name, email=f'{name}@example.com', password='pass-12345',
+        first_name=name.title(), last_name='Тестов')
+
+
+def make_recipe(author, ingredients, name='Рецепт', **fields):
+    recipe = Recipe.objects.create(
+        author=author, name=name, image=IMAGE, text='Описание',
+        cooking_time=10, **fields)
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=100)
+        for ingredient in ingredients)
+    return recipe
+
+
+# кэш — свой у каждого теста, картинки — во временном каталоге
+@override_settings(
+    CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    MEDIA_ROOT=MEDIA_ROOT, IMAGE_PIPELINE='inline',
+)
+class APITestCase(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = make_user('viewer')
+        self.salt = Ingredient.objects.create(
+            name='соль', measurement_unit='г')
+        self.flour = Ingredient.objects.create(
+            name='мука', measurement_unit='г')
+
+    def login(self, user=None):
+        self.client.force_authenticate(user or self.user)
+
+
+@override_settings(RECIPE_CACHE_TIMEOUT=0)
+class QueryCountTests(APITestCase):
+    """Число запросов не растёт с числом рецептов и авторов на странице."""
+
+    def make_feed(self, authors, per_author):
+        """Ещё authors авторов с рецептами — зритель отметил всё."""
+        start = User.objects.count()
+        for number in range(start, start + authors):
+            author = make_user(f'author{number}')
+            Follow.objects.create(user=self.user, author=author)
+            for index in range(per_author):
+                recipe = make_recipe(author, [self.salt, self.flour],
+                                     name=f'Рецепт {number}-{index}')
+                Favorite.objects.create(user=self.user, recipe=recipe)
+                ShoppingCart.objects.create(user=self.user, recipe=recipe)
+
+    def test_recipe_list_anonymous(self):
+        # count, страница, строки ингредиентов и продукты (prefetch)
+        for size in (1, 3):
+            with self.subTest(authors=size):
+                self.make_feed(size, 2)
+                with self.assertNumQueries(4):
+                    response = self.client.get('/api/recipes/?limit=6')
+                self.assertEqual(response.status_code, 200)
+
+    def test_recipe_list_viewer_flags_are_batched(self):
+        # + избранное, корзина и подписки зрителя — по запросу на всю
+        # страницу, а не на рецепт
+        self.login()
+        for size in (1, 3):
+            with self.subTest(authors=size):
+                self.make_feed(size, 2)
+                with self.assertNumQueries(7):
+                    response = self.client.get('/api/recipes/?limit=6')
+                results = response.data['results']
+                self.assertTrue(all(recipe['is_favorited']
+                                    and recipe['is_in_shopping_cart']
+                                    and recipe['author']['is_subscribed']
+                                    for recipe in results))
+
+    def test_subscriptions_prefetch_sliced_recipes(self):
+        # count, авторы страницы, их рецепты — одним срезом
+        self.login()
+        for size in (1, 4):
+            with self.subTest(authors=size):
+                self.make_feed(size, 3)
+                with self.assertNumQueries(3):
+                    response = self.client.get(
+                        '/api/users/subscriptions/?recipes_limit=2')
+                self.assertEqual(response.status_code, 200)
+                for author in response.data['results']:
+                    self.assertEqual(len(author['recipes']), 2)
+                    self.assertEqual(author['recipes_count'], 3)
+                    self.assertTrue(author['is_subscribed'])
+
+
+class ConditionalGetTests(APITestCase):
+    """ETag / Last-Modified карточки и ленты."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = make_user('author')
+        self.recipe = make_recipe(self.author, [self.salt])
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+
+    def favorite(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(f'{self.url}favorite/')
+        self.assertEqual(response.status_code, 201)
+
+    def test_matching_etag_is_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_matching_last_modified_is_not_modified(self):
+        response = self.client.get(self.url)
+        response = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_favorite_changes_etag_and_body(self):
+        # тело из кэша ответов должно совпадать с новым ETag
+        first = self.client.get(self.url)
+        self.assertEqual(first.data['favorites_count'], 0)
+        self.favorite(self.user)
+        second = self.client.get(self.url)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(second.data['favorites_count'], 1)
+        third = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(third.status_code, 200)
+        self.assertEqual(third.data['favorites_count'], 1)
+
+    def test_edit_changes_etag(self):
+        first = self.client.get(self.url)
+        self.login(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.url, {
+                'name': 'Новое название',
+                'ingredients': [{'id': self.salt.pk, 'amount': 5}],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.client.force_authenticate(None)
+        second = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data['name'], 'Новое название')
+
+    def test_viewer_flags_are_part_of_etag(self):
+        self.login()
+        first = self.client.get(self.url)
+        self.favorite(self.user)
+        second = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertTrue(second.data['is_favorited'])
+
+    def test_list_etag(self):
+        first = self.client.get('/api/recipes/')
+        self.assertEqual(self.client.get(
+            '/api/recipes/', HTTP_IF_NONE_MATCH=first['ETag'],
+        ).status_code, 304)
+        self.favorite(make_user('fan'))
+        second = self.client.get(
+            '/api/recipes/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data['results'][0]['favorites_count'], 1)
+
+
+class ResponseCacheTests(APITestCase):
+    """Избранное и корзины не сбрасывают кэш ответов целиком."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = make_user('author')
+        self.recipe = make_recipe(self.author, [self.salt])
+        self.other = make_recipe(self.author, [self.flour], name='Другой')
+        self.fan = APIClient()
+        self.fan.force_authenticate(make_user('fan'))
+
+    def toggle(self, recipe, method='post'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.fan, method)(
+                f'/api/recipes/{recipe.pk}/favorite/')
+        self.assertLess(response.status_code, 300)
+
+    def counts(self, response):
+        return {recipe['id']: recipe['favorites_count']
+                for recipe in response.data['results']}
+
+    def test_list_stays_cached_with_fresh_counters(self):
+        self.assertEqual(self.client.get('/api/recipes/')['X-Cache'], 'MISS')
+        self.toggle(self.recipe)
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(self.counts(response),
+                         {self.recipe.pk: 1, self.other.pk: 0})
+        self.toggle(self.recipe, 'delete')
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(self.counts(response),
+                         {self.recipe.pk: 0, self.other.pk: 0})
+
+    def test_toggle_invalidates_only_its_card(self):
+        for recipe in (self.recipe, self.other):
+            self.client.get(f'/api/recipes/{recipe.pk}/')
+        self.toggle(self.recipe)
+        response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['favorites_count'], 1)
+        self.assertEqual(self.client.get(
+            f'/api/recipes/{self.other.pk}/')['X-Cache'], 'HIT')
+
+    def test_edit_still_invalidates(self):
+        self.client.get('/api/recipes/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.get(pk=self.other.pk).save()
+        self.assertEqual(self.client.get('/api/recipes/')['X-Cache'], 'MISS')
+
+    @override_settings(ROOT_URLCONF='foodgram.urls_async')
+    async def test_async_list_counters(self):
+        client = AsyncClient()
+        response = await client.get('/api/recipes/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        await Recipe.objects.filter(pk=self.recipe.pk).aupdate(
+            favorites_count=5)
+        response = await client.get('/api/recipes/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(
+            {recipe['id']: recipe['favorites_count']
+             for recipe in response.json()['results']},
+            {self.recipe.pk: 5, self.other.pk: 0})
+
+
+@override_settings(RECIPE_CACHE_TIMEOUT=0)
+class PaginationTests(APITestCase):
+    """Курсорная пагинация и ?count=estimated."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = make_user('author')
+        self.recipes = [make_recipe(self.author, [self.salt],
+                                    name=f'Рецепт {index}')
+                        for index in range(7)]
+
+    def walk(self, url):
+        """id рецептов всех страниц по ссылкам next и ссылки previous."""
+        ids, previous = [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            previous.append(response.data['previous'])
+            url = response.data['next']
+        return ids, previous
+
+    def test_cursor_walk(self):
+        expected = list(Recipe.objects.values_list('pk', flat=True))
+        ids, previous = self.walk('/api/recipes/?cursor=&limit=3')
+        self.assertEqual(ids, expected)
+        self.assertIsNone(previous[0])
+        self.assertTrue(all(previous[1:]))
+
+    def test_cursor_previous_returns_same_page(self):
+        first = self.client.get('/api/recipes/?cursor=&limit=3')
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+        self.assertIsNone(back.data['previous'])
+
+    def test_cursor_is_stable_under_inserts(self):
+        # новые рецепты встают в начало ленты — номера страниц
+        # сдвинулись бы, курсор — нет
+        expected = list(Recipe.objects.values_list('pk', flat=True))
+        first = self.client.get('/api/recipes/?cursor=&limit=3')
+        ids = [recipe['id'] for recipe in first.data['results']]
+        for index in range(2):
+            make_recipe(self.author, [self.flour], name=f'Новый {index}')
+        rest, _ = self.walk(first.data['next'])
+        self.assertEqual(ids + rest, expected)
+
+    def test_popular_cursor(self):
+        # с повторами оценки — порядок решает id
+        for recipe, score in zip(self.recipes, (3, 1, 3, 2, 5, 1, 3)):
+            Recipe.objects.filter(pk=recipe.pk).update(popularity=score)
+        expected = list(Recipe.objects.order_by(
+            '-popularity', '-id').values_list('pk', flat=True))
+        ids, _ = self.walk('/api/recipes/?ordering=popular&cursor=&limit=2')
+        self.assertEqual(ids, expected)
+
+    def test_bad_cursor(self):
+        response = self.client.get('/api/recipes/?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+    def test_estimated_count_small_table_is_exact(self):
+        response = self.client.get('/api/recipes/?count=estimated&limit=3')
+        self.assertEqual(response.data['count'], 7)
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_estimated_count(self):
+        # оценка планировщика (на Postgres) выше порога
+        with mock.patch('recipes.utils._planner_estimate',
+                        return_value=100_000):
+            response = self.client.get(
+                '/api/recipes/?count=estimated&limit=3')
+            self.assertEqual(response.data['count'], 100_000)
+            self.assertEqual(len(response.data['results']), 3)
+            self.assertIsNotNone(response.data['next'])
+            # страница за настоящим концом — пустая, а не 404
+            last = self.client.get(
+                '/api/recipes/?count=estimated&limit=3&page=5')
+        self.assertEqual(last.status_code, 200)
+        self.assertEqual(last.data['results'], [])
+        self.assertIsNone(last.data['next'])
+
+
+class RelationTests(APITestCase):
+    """Избранное и корзина: по одному рецепту и пачкой."""
+
+    endpoints = (
+        ('favorite', Favorite, 'favorites_count'),
+        ('shopping_cart', ShoppingCart, 'carts_count'),
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.author = make_user('author')
+        self.first = make_recipe(self.author, [self.salt, self.flour])
+        self.second = make_recipe(self.author, [self.salt])
+        self.login()
+
+    def assertCountersMatchRows(self):
+        for recipe in Recipe.objects.all():
+            self.assertEqual(recipe.favorites_count,
+                             Favorite.objects.filter(recipe=recipe).count())
+            self.assertEqual(
+                recipe.carts_count,
+                ShoppingCart.objects.filter(recipe=recipe).count())
+
+    def shopping_list(self):
+        return {
+            pk: (total, count)
+            for pk, total, count in ShoppingListItem.objects.filter(
+                user=self.user,
+            ).values_list('ingredient_id', 'total', 'recipes_count')
+        }
+
+    def test_toggle(self):
+        for path, model, counter in self.endpoints:
+            with self.subTest(path):
+                url = f'/api/recipes/{self.first.pk}/{path}/'
+                response = self.client.post(url)
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(response.data['id'], self.first.pk)
+                self.assertEqual(self.client.post(url).status_code, 400)
+                self.first.refresh_from_db()
+                self.assertEqual(getattr(self.first, counter), 1)
+                self.assertTrue(model.objects.filter(
+                    user=self.user, recipe=self.first).exists())
+
+                self.assertEqual(self.client.delete(url).status_code, 204)
+                self.assertEqual(self.client.delete(url).status_code, 400)
+                self.first.refresh_from_db()
+                self.assertEqual(getattr(self.first, counter), 0)
+                self.assertFalse(model.objects.exists())
+
+    def test_unknown_recipe(self):
+        for path, _, _ in self.endpoints:
+            for pk in (10 ** 6, 'abc'):
+                url = f'/api/recipes/{pk}/{path}/'
+                with self.subTest(path, pk=pk):
+                    self.assertEqual(self.client.post(url).status_code, 404)
+                    self.assertEqual(self.client.delete(url).status_code, 404)
+
+    def test_anonymous(self):
+        self.client.force_authenticate(None)
+        for path, _, _ in self.endpoints:
+            with self.subTest(path):
+                self.assertEqual(self.client.post(
+                    f'/api/recipes/{self.first.pk}/{path}/').status_code, 401)
+                self.assertEqual(self.client.post(
+                    f'/api/recipes/{path}/',
+                    {'recipes': [self.first.pk]}, format='json',
+                ).status_code, 401)
+
+    def test_batch(self):
+        unknown = 10 ** 6
+        for path, model, counter in self.endpoints:
+            with self.subTest(path):
+                url = f'/api/recipes/{path}/'
+                self.client.post(f'/api/recipes/{self.second.pk}/{path}/')
+                ids = [self.first.pk, self.second.pk, unknown, self.first.pk]
+                response = self.client.post(
+                    url, {'recipes': ids}, format='json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data['results'], [
+                    {'id': self.first.pk, 'status': 'added'},
+                    {'id': self.second.pk, 'status': 'exists'},
+                    {'id': unknown, 'status': 'not_found'},
+                ])
+                self.assertEqual(model.objects.count(), 2)
+                self.assertCountersMatchRows()
+
+                self.client.delete(f'/api/recipes/{self.second.pk}/{path}/')
+                response = self.client.delete(
+                    url, {'recipes': ids}, format='json')
+                self.assertEqual(response.data['results'], [
+                    {'id': self.first.pk, 'status': 'removed'},
+                    {'id': self.second.pk, 'status': 'absent'},
+                    {'id': unknown, 'status': 'not_found'},
+                ])
+                self.assertFalse(model.objects.exists())
+                self.assertCountersMatchRows()
+                self.assertEqual(Recipe.objects.filter(
+                    **{counter: 0}).count(), 2)
+
+    def test_batch_validation(self):
+        for body in ({}, {'recipes': []}, {'recipes': ['abc']},
+                     {'recipes': [0]}):
+            with self.subTest(body=body):
+                self.assertEqual(self.client.post(
+                    '/api/recipes/favorite/', body, format='json',
+                ).status_code, 400)
+
+    @override_settings(RECIPE_BATCH_LIMIT=2)
+    def test_batch_limit(self):
+        response = self.client.post(
+            '/api/recipes/favorite/', {'recipes': [1, 2, 3]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Favorite.objects.exists())
+
+    def test_counters_with_several_users(self):
+        fan = make_user('fan')
+        fan_client = APIClient()
+        fan_client.force_authenticate(fan)
+        both = {'recipes': [self.first.pk, self.second.pk]}
+        for client in (self.client, fan_client):
+            client.post('/api/recipes/favorite/', both, format='json')
+            client.post('/api/recipes/shopping_cart/', both, format='json')
+        self.client.delete(f'/api/recipes/{self.first.pk}/favorite/')
+        fan_client.delete('/api/recipes/shopping_cart/',
+                          {'recipes': [self.second.pk]}, format='json')
+        self.assertCountersMatchRows()
+        self.first.refresh_from_db()
+        self.assertEqual(
+            (self.first.favorites_count, self.first.carts_count), (1, 2))
+
+    def test_cart_updates_shopping_list(self):
+        # соль — в обоих рецептах, мука — только в первом
+        both = {'recipes': [self.first.pk, self.second.pk]}
+        self.client.post('/api/recipes/shopping_cart/', both, format='json')
+        self.assertEqual(self.shopping_list(), {
+            self.salt.pk: (200, 2), self.flour.pk: (100, 1)})
+        self.client.delete(f'/api/recipes/{self.first.pk}/shopping_cart/')
+        self.assertEqual(self.shopping_list(), {self.salt.pk: (100, 1)})
+        self.client.delete('/api/recipes/shopping_cart/', both, format='json')
+        self.assertEqual(self.shopping_list(), {})
+
+
+class IngredientDiffTests(APITestCase):
+    """Правка состава рецепта — разницей с тем, что в БД."""
+
+    def setUp(self):
+        super().setUp()
+        pantry.reset()
+        self.sugar = Ingredient.objects.create(
+            name='сахар', measurement_unit='г')
+        self.pepper = Ingredient.objects.create(
+            name='перец', measurement_unit='г')
+        self.author = make_user('author')
+        self.recipe = make_recipe(
+            self.author, [self.salt, self.flour, self.sugar])
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+        self.login(self.author)
+
+    def rows(self):
+        return {row.ingredient_id: (row.pk, row.amount)
+                for row in RecipeIngredient.objects.filter(
+                    recipe=self.recipe)}
+
+    def edit(self, amounts):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.patch(self.url, {'ingredients': [
+                {'id': pk, 'amount': amount}
+                for pk, amount in amounts.items()]}, format='json')
+
+    def test_diff(self):
+        before = self.rows()
+        response = self.edit({self.salt.pk: 100, self.flour.pk: 50,
+                              self.pepper.pk: 7})
+        self.assertEqual(response.status_code, 200)
+        after = self.rows()
+        self.assertEqual(after[self.salt.pk], before[self.salt.pk])
+        self.assertEqual(after[self.flour.pk],
+                         (before[self.flour.pk][0], 50))
+        self.assertNotIn(self.sugar.pk, after)
+        self.assertEqual(after[self.pepper.pk][1], 7)
+        self.assertEqual(
+            {(item['id'], item['amount'])
+             for item in response.data['ingredients']},
+            {(self.salt.pk, 100), (self.flour.pk, 50), (self.pepper.pk, 7)})
+        self.assertEqual(
+            {item['name'] for item in response.data['ingredients']},
+            {'соль', 'мука', 'перец'})
+
+    def test_unchanged_rows_are_not_written(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.edit({self.salt.pk: 100, self.flour.pk: 100,
+                                  self.sugar.pk: 100})
+        self.assertEqual(response.status_code, 200)
+        table = RecipeIngredient._meta.db_table
+        self.assertFalse([
+            query['sql'] for query in queries
+            if table in query['sql']
+            and query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))])
+
+    def test_response_reads_ingredients_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.edit({self.salt.pk: 100, self.pepper.pk: 7})
+        self.assertEqual(response.status_code, 200)
+        table = RecipeIngredient._meta.db_table
+        reads = [query['sql'] for query in queries
+                 if query['sql'].startswith('SELECT')
+                 and f'FROM "{table}" INNER JOIN' in query['sql']]
+        # состав для ответа — одним запросом вместе с продуктами
+        self.assertEqual(len(reads), 1)
+        self.assertEqual(
+            {item['name'] for item in response.data['ingredients']},
+            {'соль', 'перец'})
+
+    def test_unknown_ingredient(self):
+        before = self.rows()
+        response = self.edit({self.salt.pk: 100, 10 ** 6: 5})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['ingredients'][0], {})
+        self.assertIn('id', response.data['ingredients'][1])
+        self.assertEqual(self.rows(), before)
+
+    def test_validate_ingredients_is_one_query(self):
+        serializer = RecipeWriteSerializer()
+        items = [{'id': pk, 'amount': 1}
+                 for pk in (self.salt.pk, self.flour.pk, self.sugar.pk)]
+        with self.assertNumQueries(1):
+            items = serializer.validate_ingredients(items)
+        self.assertEqual([item['id'] for item in items],
+                         [self.salt, self.flour, self.sugar])
+        with self.assertNumQueries(1):
+            with self.assertRaises(ValidationError):
+                serializer.validate_ingredients(
+                    [{'id': self.salt.pk, 'amount': 1},
+                     {'id': 10 ** 6, 'amount': 1}])
+        # за пределами ключа БД — без запроса к ней
+        with self.assertNumQueries(1):
+            with self.assertRaises(ValidationError):
+                serializer.validate_ingredients(
+                    [{'id': self.salt.pk, 'amount': 1},
+                     {'id': 2 ** 70, 'amount': 1}])
+
+    def test_shopping_list_follows_edit(self):
+        viewer = APIClient()
+        viewer.force_authenticate(self.user)
+        viewer.post(f'{self.url}shopping_cart/')
+        self.edit({self.salt.pk: 30, self.pepper.pk: 7})
+        self.assertEqual(
+            dict(ShoppingListItem.objects.filter(user=self.user).values_list(
+                'ingredient_id', 'total')),
+            {self.salt.pk: 30, self.pepper.pk: 7})
+
+    def test_pantry_follows_edit(self):
+        def missing(ingredients):
+            return list(pantry_index.match(
+                [item.pk for item in ingredients], 3)[:10])
+
+        self.assertEqual(missing([self.salt]), [(self.recipe.pk, 2)])
+        self.edit({self.salt.pk: 30, self.pepper.pk: 7})
+        self.assertEqual(missing([self.salt]), [(self.recipe.pk, 1)])
+        self.assertEqual(missing([self.salt, self.pepper]),
+                         [(self.recipe.pk, 0)])
+        self.assertEqual(missing([self.flour]), [])
+
+
+class ShoppingListExportTests(APITestCase):
+    """Выгрузка списка покупок: потоком и фоновой задачей."""
+
+    url = '/api/recipes/download_shopping_cart/'
+
+    def setUp(self):
+        super().setUp()
+        self.author = make_user('author')
+        self.recipe = make_recipe(self.author, [self.salt, self.flour])
+        self.login()
+        self.client.post(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+
+    def download(self, file_type):
+        response = self.client.get(self.url, {'type': file_type})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            response['Content-Disposition'],
+            f'attachment; filename="shopping_list.{file_type}"')
+        return response, b''.join(response.streaming_content)
+
+    def test_txt(self):
+        response, content = self.download('txt')
+        self.assertEqual(response['Content-Type'],
+                         'text/plain; charset=utf-8')
+        lines = content.decode().splitlines()
+        self.assertEqual(lines[1], 'Продукты:')
+        # по алфавиту
+        self.assertEqual(lines[2:4],
+                         ['1. Мука (г) — 100', '2. Соль (г) — 100'])
+        self.assertEqual(lines[4:], ['Рецепты:', 'Рецепт — author'])
+
+    def test_csv(self):
+        response, content = self.download('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        content = content.decode()
+        self.assertTrue(content.startswith('\ufeff'))
+        rows = list(csv.reader(io.StringIO(content[1:])))
+        self.assertEqual(rows[0], ['Продукт', 'Ед. измерения', 'Количество'])
+        self.assertEqual(rows[1:],
+                         [['мука', 'г', '100'], ['соль', 'г', '100']])
+
+    def test_json(self):
+        response, content = self.download('json')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = json.loads(content)
+        self.assertEqual(data['user'], 'viewer')
+        self.assertEqual(data['products'], [
+            {'name': 'мука', 'measurement_unit': 'г', 'total': 100},
+            {'name': 'соль', 'measurement_unit': 'г', 'total': 100}])
+        self.assertEqual(data['recipes'],
+                         [{'name': 'Рецепт', 'author': 'author'}])
+
+    def assertPdf(self, content, pages):
+        self.assertTrue(content.startswith(b'%PDF-1.4'))
+        self.assertTrue(content.endswith(b'%%EOF\n'))
+        self.assertEqual(content.count(b'/Type /Page '), pages)
+        # startxref указывает на таблицу xref, она — на объекты
+        xref_at = int(content.rsplit(b'startxref\n', 1)[1].split()[0])
+        self.assertTrue(content[xref_at:].startswith(b'xref\n'))
+        rows = content[xref_at:].split(b'\n')[3:]
+        for number, row in enumerate(rows[:pages * 3 + 2], 1):
+            offset = int(row.split()[0])
+            self.assertTrue(
+                content[offset:].startswith(f'{number} 0 obj'.encode()))
+
+    def test_pdf(self):
+        response, content = self.download('pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertPdf(content, pages=1)
+
+    def test_unknown_type(self):
+        response = self.client.get(self.url, {'type': 'xlsx'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('type', response.data)
+        response = self.client.get(self.url, {'type': 'xlsx', 'async': '1'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Job.objects.exists())
+
+    def test_empty_cart(self):
+        self.client.delete(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        _, content = self.download('txt')
+        self.assertEqual(content.decode().splitlines()[1:],
+                         ['Продукты:', 'Рецепты:'])
+        _, content = self.download('csv')
+        self.assertEqual(content.decode(),
+                         '\ufeffПродукт,Ед. измерения,Количество\r\n')
+        _, content = self.download('json')
+        data = json.loads(content)
+        self.assertEqual((data['products'], data['recipes']), ([], []))
+        _, content = self.download('pdf')
+        self.assertPdf(content, pages=1)
+
+    def test_async_export(self):
+        response = self.client.get(self.url, {'type': 'csv', 'async': '1'})
+        self.assertEqual(response.status_code, 202)
+        job_url = f'/api/jobs/{response.data["id"]}/'
+        self.assertTrue(response['Location'].endswith(job_url))
+        self.assertEqual(response.data['status'], Job.Status.QUEUED)
+
+        [job] = queue.claim('test', 1)
+        self.assertEqual(job.name, 'api.export_shopping_list')
+        self.assertTrue(queue.execute(job))
+        response = self.client.get(job_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], Job.Status.DONE)
+        result = response.data['result']
+        self.assertEqual(result['content_type'], 'text/csv; charset=utf-8')
+        name = result['file'].split('/media/', 1)[1]
+        with default_storage.open(name) as exported:
+            content = exported.read().decode()
+        self.assertIn('соль', content)
+        self.assertIn('мука', content)
+        # файл удалит отложенная задача
+        self.assertTrue(Job.objects.filter(
+            name='api.delete_export', payload={'name': name}).exists())
+
+        self.login(make_user('stranger'))
+        self.assertEqual(self.client.get(job_url).status_code, 404)
+
+
+@override_settings(TOKEN_CACHE_TIMEOUT=600, TOKEN_LRU_TTL=60)
+class TokenCacheTests(APITestCase):
+    """Кэш токенов: смена пароля, блокировка и выход видны сразу."""
+
+    url = '/api/users/me/'
+
+    def setUp(self):
+        super().setUp()
+        # LRU процесса — свой у каждого теста
+        patcher = mock.patch.object(
+            authentication, '_local', authentication._LRU())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        response = self.client.post('/api/auth/token/login/', {
+            'email': self.user.email, 'password': 'pass-12345'})
+        self.key = response.data['auth_token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.digest = authentication._digest(self.key)
+        # первый запрос кладёт пользователя в оба уровня кэша
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertIsNotNone(authentication._local.get(self.digest))
+        self.assertIsNotNone(
+            cache.get(authentication.ENTRY_KEY.format(self.digest)))
+
+    def get(self, local=True):
+        """Запрос с токеном; local=False — как из другого процесса."""
+        if local:
+            return self.client.get(self.url)
+        with mock.patch.object(
+                authentication, '_local', authentication._LRU()):
+            return self.client.get(self.url)
+
+    def assertStale(self):
+        version = cache.get(authentication.VERSION_KEY.format(self.digest))
+        _, local_version = authentication._local.get(self.digest)
+        _, shared_version = cache.get(
+            authentication.ENTRY_KEY.format(self.digest))
+        self.assertNotEqual(local_version, version)
+        self.assertNotEqual(shared_version, version)
+
+    def test_cached(self):
+        with mock.patch.object(
+                authentication.CachedTokenAuthentication, '_load') as load:
+            self.assertEqual(self.get().status_code, 200)
+            self.assertEqual(self.get(local=False).status_code, 200)
+        load.assert_not_called()
+
+    def test_password_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/users/set_password/', {
+                'current_password': 'pass-12345',
+                'new_password': 'new-pass-67890'})
+        self.assertEqual(response.status_code, 204)
+        self.assertStale()
+        load = mock.patch.object(
+            authentication.CachedTokenAuthentication, '_load',
+            autospec=True,
+            side_effect=authentication.CachedTokenAuthentication._load)
+        with load as spy:
+            self.assertEqual(self.get().status_code, 200)
+        spy.assert_called_once()
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password(
+            'new-pass-67890'))
+
+    def test_deactivation(self):
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertStale()
+        self.assertEqual(self.get(local=False).status_code, 401)
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_logout(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertStale()
+        self.assertEqual(self.get(local=False).status_code, 401)
+        self.assertEqual(self.get().status_code, 401)
@@ -1,11 +1,14 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
-from api.views import UserViewSet, IngredientViewSet, RecipeViewSet
+from api.views import (
+    IngredientViewSet, JobViewSet, RecipeViewSet, UserViewSet,
+)
 
 router = DefaultRouter()
 router.register(r"users", UserViewSet, basename="users")
 router.register(r"ingredients", IngredientViewSet)
 router.register(r"recipes", RecipeViewSet)
+router.register(r"jobs", JobViewSet, basename="jobs")
 
 urlpatterns = [
     path("", include(router.urls)),
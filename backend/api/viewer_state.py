@@ -0,0 +1,108 @@
+from recipes.models import Favorite, ShoppingCart
+from users.models import Follow
+
+
+class ViewerState:
+    """
+    Флаги текущего пользователя для страницы объектов:
+    is_favorited / is_in_shopping_cart / is_subscribed.
+    Считаются пачкой — один запрос на отношение,
+    для анонима запросов нет вовсе.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._favorites = {}
+        self._carts = {}
+        self._follows = {}
+
+    @classmethod
+    def of(cls, request):
+        """Одно состояние на запрос (хранится на самом request)."""
+        state = getattr(request, '_viewer_state', None)
+        if state is None or state.user != request.user:
+            state = cls(request.user)
+            request._viewer_state = state
+        return state
+
+    @property
+    def is_anonymous(self):
+        return not self.user.is_authenticated
+
+    # загрузка пачкой
+    def _missing(self, cache, ids):
+        """Ещё не известные pk; аноним ни на что не подписан — без БД."""
+        missing = {pk for pk in ids if pk not in cache}
+        if missing and self.is_anonymous:
+            cache.update(dict.fromkeys(missing, False))
+            return set()
+        return missing
+
+    def _query(self, model, field, ids):
+        return model.objects.filter(
+            user=self.user, **{f'{field}__in': ids}
+        ).values_list(field, flat=True)
+
+    def _load(self, cache, model, field, ids):
+        missing = self._missing(cache, ids)
+        if missing:
+            found = set(self._query(model, field, missing))
+            cache.update({pk: pk in found for pk in missing})
+
+    def load_recipes(self, recipes):
+        recipes = list(recipes)
+        self.load_recipe_ids(recipe.pk for recipe in recipes)
+        self.load_authors(recipe.author_id for recipe in recipes)
+
+    def load_recipe_ids(self, recipe_ids):
+        ids = set(recipe_ids)
+        self._load(self._favorites, Favorite, 'recipe_id', ids)
+        self._load(self._carts, ShoppingCart, 'recipe_id', ids)
+
+    def load_authors(self, author_ids):
+        self._load(self._follows, Follow, 'author_id', set(author_ids))
+
+    # то же для async-представлений (api.async_views)
+    async def _aload(self, cache, model, field, ids):
+        missing = self._missing(cache, ids)
+        if missing:
+            found = {pk async for pk in self._query(model, field, missing)}
+            cache.update({pk: pk in found for pk in missing})
+
+    async def aload_recipes(self, recipes):
+        await self.aload_recipe_ids(recipe.pk for recipe in recipes)
+        await self.aload_authors(recipe.author_id for recipe in recipes)
+
+    async def aload_recipe_ids(self, recipe_ids):
+        ids = set(recipe_ids)
+        await self._aload(self._favorites, Favorite, 'recipe_id', ids)
+        await self._aload(self._carts, ShoppingCart, 'recipe_id', ids)
+
+    async def aload_authors(self, author_ids):
+        await self._aload(
+            self._follows, Follow, 'author_id', set(author_ids))
+
+    def remember(self, *, favorited=(), in_cart=(), subscribed=(),
+                 value=True):
+        """Флаги, которые уже известны view — без запроса в БД."""
+        for cache, ids in ((self._favorites, favorited),
+                           (self._carts, in_cart),
+                           (self._follows, subscribed)):
+            cache.update(dict.fromkeys(ids, value))
+
+    # чтение: объект или его pk
+    @staticmethod
+    def _get(cache, obj, loader):
+        pk = getattr(obj, 'pk', obj)
+        if pk not in cache:
+            loader([pk])
+        return cache[pk]
+
+    def is_favorited(self, recipe):
+        return self._get(self._favorites, recipe, self.load_recipe_ids)
+
+    def is_in_shopping_cart(self, recipe):
+        return self._get(self._carts, recipe, self.load_recipe_ids)
+
+    def is_subscribed(self, author):
+        return self._get(self._follows, author, self.load_authors)
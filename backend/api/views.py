@@ -1,30 +1,54 @@
-from datetime import datetime
+from collections import defaultdict
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import FileResponse
+from django.db import models, transaction
+from django.db.models import Prefetch
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.permissions import (
-    AllowAny, IsAuthenticated, IsAuthenticatedOrReadOnly,
+    SAFE_METHODS, AllowAny, IsAuthenticated, IsAuthenticatedOrReadOnly,
 )
 from rest_framework.response import Response
 
-from recipes.models import Ingredient, Recipe, Favorite, ShoppingCart
+from jobs.models import Job
+from jobs.queue import enqueue
+from recipes import counters, relations, search
+from recipes.catalog import catalog_snapshot
+from recipes.ingredient_index import ingredient_index
+from recipes.models import (
+    Ingredient, Recipe, RecipeIngredient, Favorite, ShoppingCart,
+    SimilarRecipe,
+)
+from recipes.pantry import pantry_index
+from recipes.shopping_list import ShoppingList
 from users.models import Follow
+from . import conditional, response_cache
+from .exporters import EXPORTERS
+from .tasks import export_shopping_list
 from .permissions import IsAuthorOrReadOnly
 from .serializers import (
     AvatarSerializer,
     IngredientSerializer,
+    JobSerializer,
+    PantryRecipeSerializer,
+    PantrySerializer,
+    RecipeIdsSerializer,
     RecipeReadSerializer,
     RecipeShortSerializer,
     RecipeWriteSerializer,
     AuthorCardSerializer,
+    ShoppingListItemSerializer,
 )
+from .viewer_state import ViewerState
+
 User = get_user_model()
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
@@ -33,17 +57,132 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (AllowAny,)
     pagination_class = None
 
-    def get_queryset(self):
-        qs = super().get_queryset()
-        name = self.request.query_params.get('name')
-        return qs.filter(name__istartswith=name) if name else qs
+    def list(self, request, *args, **kwargs):
+        # автодополнение отвечает индекс в памяти, без запроса в БД
+        name = request.query_params.get('name')
+        if name:
+            return Response(self._search(request, name))
+        return self._catalog_response(request)
+
+    @staticmethod
+    def _search(request, name):
+        limit = request.query_params.get('limit', '')
+        return ingredient_index.search(
+            name,
+            limit=min(int(limit), settings.INGREDIENT_SEARCH_LIMIT)
+            if limit.isdigit() else None,
+        )
+
+    @staticmethod
+    def _catalog_response(request):
+        """
+        Весь справочник — готовыми байтами из снимка, с ETag:
+        повторный запрос с If-None-Match получает 304.
+        """
+        snapshot = catalog_snapshot()
+        use_gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        response = HttpResponse(
+            snapshot.gzipped if use_gzip else snapshot.body,
+            content_type='application/json',
+        )
+        if use_gzip:
+            response['Content-Encoding'] = 'gzip'
+        # у сжатого и несжатого тела разные байты — и разные ETag
+        response['ETag'] = (snapshot.etag[:-1] + '-gzip"'
+                            if use_gzip else snapshot.etag)
+        response['Cache-Control'] = (
+            f'public, max-age={settings.INGREDIENT_CATALOG_MAX_AGE}, '
+            'stale-while-revalidate=86400'
+        )
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return get_conditional_response(
+            request, etag=response['ETag'], response=response)
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
     queryset = (Recipe.objects
+                .defer('search_vector')
                 .select_related('author')
                 .prefetch_related('recipe_ingredients__ingredient'))
     permission_classes = (IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly)
+    # параметры, от которых зависит закэшированный ответ
+    cached_params = ('page', 'limit', 'author', 'cursor', 'count', 'search',
+                     'ordering')
+    # фильтры по флагам зрителя — ответ у каждого свой, не кэшируем
+    personal_params = ('is_favorited', 'is_in_shopping_cart')
+    # ?ordering= -> сортировка; без параметра (или с неизвестным) —
+    # новые первыми. popular — по хранимой популярности
+    # (recipes.popularity), индекс recipe_popular_idx
+    orderings = {'popular': ('-popularity', '-id')}
+
+    # кэш ответов и условные GET
+    def list(self, request, *args, **kwargs):
+        response = self._cached(self._list, request, *args, **kwargs)
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        etag = conditional.data_etag(request, response.data)
+        conditional.set_validators(response, etag)
+        # Last-Modified у ленты не повод для 304: удаление рецепта
+        # его не сдвигает
+        return get_conditional_response(
+            request, etag=etag, response=response)
+
+    def _list(self, request, *args, **kwargs):
+        self.page_modified = None
+        response = super().list(request, *args, **kwargs)
+        if self.page_modified is not None:
+            response['Last-Modified'] = http_date(
+                self.page_modified.timestamp())
+        return response
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page:
+            self.page_modified = max(recipe.updated_at for recipe in page)
+        return page
+
+    def retrieve(self, request, *args, **kwargs):
+        # валидаторы — одним запросом, 304 без get_object и сериализатора
+        validators = conditional.recipe_validators(request, kwargs['pk'])
+        if validators is None:
+            raise NotFound
+        etag, last_modified, version = validators
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            # тело — той же версии, что и валидаторы
+            response = self._cached(
+                super().retrieve, request, *args, version=version, **kwargs)
+        return conditional.set_validators(response, etag, last_modified)
+
+    def _cacheable(self, request):
+        return bool(
+            settings.RECIPE_CACHE_TIMEOUT
+            and request.accepted_renderer.format == 'json'
+            and not (request.user.is_authenticated
+                     and any(request.query_params.get(name) == '1'
+                             for name in self.personal_params))
+        )
+
+    def _cached(self, handler, request, *args, version=None, **kwargs):
+        if not self._cacheable(request):
+            return handler(request, *args, **kwargs)
+        key = response_cache.cache_key(request, self.cached_params, version)
+        entry = response_cache.lookup(key)
+        if entry is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                response_cache.store(key, response)
+            response['X-Cache'] = 'MISS'
+            return response
+        data, headers = entry
+        if version is None:
+            # у карточки счётчики той же версии, у ленты — из БД
+            data = response_cache.refresh_counters(data)
+        response = Response(response_cache.personalize(data, request),
+                            headers=headers)
+        response['X-Cache'] = 'HIT'
+        return response
 
     # сериализаторы
     def get_serializer_class(self):
@@ -60,41 +199,104 @@ class RecipeViewSet(viewsets.ModelViewSet):
             recipe, context={'request': self.request}).data
         return Response(data, status=code)
 
-    def _toggle_relation(self, model, recipe):
-        request = self.request
+    def _recipe_id(self):
+        """pk из пути числом; мусор — 404, как у get_object."""
+        try:
+            pk = int(self.kwargs['pk'])
+        except ValueError:
+            raise NotFound
+        if not 0 < pk <= models.BigIntegerField.MAX_BIGINT:
+            raise NotFound
+        return pk
+
+    @transaction.atomic
+    def _toggle_relation(self, model):
+        """
+        Добавить/убрать один рецепт: получилось ли — видно по самому
+        INSERT/DELETE (recipes.relations), без get_object и проверки
+        заранее; отличить 404 от 400 — запрос только на ошибку.
+        """
+        request, pk = self.request, self._recipe_id()
         if request.method == 'POST':
-            obj, created = model.objects.get_or_create(
-                user=request.user, recipe=recipe)
-            if not created:
+            if not relations.add(model, request.user, [pk]):
+                self._check_recipe(pk)
                 raise ValidationError('Рецепт уже добавлен')
+            recipe = Recipe.objects.only(
+                *RecipeShortSerializer.Meta.fields).get(pk=pk)
             return self._short_response(recipe, status.HTTP_201_CREATED)
 
         # DELETE
-        obj = model.objects.filter(
-            user=self.request.user, recipe=recipe).first()
-        if not obj:
+        if not relations.remove(model, request.user, [pk]):
+            self._check_recipe(pk)
             raise ValidationError({'errors': 'Этого рецепта нет в списке'})
-        obj.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @staticmethod
+    def _check_recipe(pk):
+        if not Recipe.objects.filter(pk=pk).exists():
+            raise NotFound
+
+    def _batch_relation(self, model):
+        """
+        Пачка id в {"recipes": [...]}: POST добавляет, DELETE убирает.
+        Ответ — исход по каждому id в порядке запроса: added / exists
+        (removed / absent для DELETE) или not_found.
+        """
+        request = self.request
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['recipes']
+        if request.method == 'POST':
+            changed = relations.add(model, request.user, ids)
+            done, skipped = 'added', 'exists'
+        else:
+            changed = relations.remove(model, request.user, ids)
+            done, skipped = 'removed', 'absent'
+        rest = [pk for pk in ids if pk not in changed]
+        known = set(Recipe.objects.filter(pk__in=rest).values_list(
+            'pk', flat=True)) if rest else set()
+        return Response({'results': [
+            {'id': pk, 'status': (done if pk in changed
+                                  else skipped if pk in known
+                                  else 'not_found')}
+            for pk in ids
+        ]})
+
     # избранное / корзина
     @action(detail=True, methods=('post', 'delete'),
             permission_classes=[IsAuthenticated])
     def favorite(self, request, pk=None):
-        return self._toggle_relation(Favorite, self.get_object())
+        return self._toggle_relation(Favorite)
 
     @action(detail=True, methods=('post', 'delete'), url_path='shopping_cart',
             permission_classes=[IsAuthenticated])
     def shopping_cart(self, request, pk=None):
-        return self._toggle_relation(ShoppingCart, self.get_object())
+        return self._toggle_relation(ShoppingCart)
+
+    @action(detail=False, methods=('post', 'delete'), url_path='favorite',
+            url_name='favorite-batch', permission_classes=[IsAuthenticated])
+    def favorite_batch(self, request):
+        return self._batch_relation(Favorite)
+
+    @action(detail=False, methods=('post', 'delete'),
+            url_path='shopping_cart', url_name='shopping-cart-batch',
+            permission_classes=[IsAuthenticated])
+    def shopping_cart_batch(self, request):
+        return self._batch_relation(ShoppingCart)
 
     # фильтрация
     def get_queryset(self):
         qs = super().get_queryset()
+        if self.request.method not in SAFE_METHODS:
+            # запись перечитывает ингредиенты сама, в транзакции
+            qs = qs.prefetch_related(None)
         params = self.request.query_params
         author = params.get('author')
         if author:
             qs = qs.filter(author_id=author)
+        ordering = self.orderings.get(params.get('ordering'))
+        if ordering:
+            qs = qs.order_by(*ordering)
 
         user = self.request.user
         if user.is_authenticated:
@@ -102,8 +304,68 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 qs = qs.filter(favorites__user=user)
             if params.get('is_in_shopping_cart') == '1':
                 qs = qs.filter(in_carts__user=user)
+
+        # поиск — после фильтров: ранжируется уже отобранное
+        term = params.get('search')
+        if term:
+            qs = search.apply(qs, term)
         return qs
 
+    # что приготовить из своих продуктов
+    @action(detail=False, methods=('get',))
+    def pantry(self, request):
+        """
+        ?ingredients=<id>&ingredients=<id>...: рецепты хотя бы с одним
+        из продуктов — сначала готовые полностью, дальше по числу
+        недостающих (не больше ?max_missing=), у каждого — чего не
+        хватает. Выдачу считает индекс в памяти (recipes.pantry), в БД —
+        только карточки страницы.
+        """
+        serializer = PantrySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ingredients']
+        ranking = pantry_index.match(ids, serializer.validated_data.get(
+            'max_missing', settings.PANTRY_MAX_MISSING))
+        page = [pk for pk, _ in self.paginator.paginate_queryset(
+            ranking, request, view=self)]
+
+        recipes = Recipe.objects.only(
+            *RecipeShortSerializer.Meta.fields).in_bulk(page)
+        missing = defaultdict(list)
+        for row in RecipeIngredient.objects.filter(
+            recipe_id__in=page,
+        ).exclude(ingredient_id__in=ids).select_related(
+                'ingredient').order_by('ingredient__name'):
+            missing[row.recipe_id].append(row)
+        cards = []
+        for pk in page:
+            if pk in recipes:  # удалён, пока индекс догонял журнал
+                recipes[pk].missing = missing[pk]
+                cards.append(recipes[pk])
+        return self.get_paginated_response(PantryRecipeSerializer(
+            cards, many=True, context={'request': request}).data)
+
+    # похожие рецепты
+    @action(detail=True, methods=('get',))
+    def similar(self, request, pk=None):
+        """
+        Соседи рецепта из готовой таблицы (manage.py build_similar),
+        самые похожие первыми; ?limit= — сколько (до SIMILAR_RECIPES_K).
+        """
+        pk = self._recipe_id()
+        limit = request.query_params.get('limit', '')
+        limit = (min(int(limit), settings.SIMILAR_RECIPES_K)
+                 if limit.isdigit() else settings.SIMILAR_RECIPES_K)
+        rows = SimilarRecipe.objects.filter(recipe_id=pk).select_related(
+            'similar').only(*(f'similar__{name}' for name in
+                              RecipeShortSerializer.Meta.fields)).order_by(
+            '-score', '-similar_id')[:limit]
+        recipes = [row.similar for row in rows]
+        if not recipes:
+            self._check_recipe(pk)
+        return Response(RecipeShortSerializer(
+            recipes, many=True, context={'request': request}).data)
+
     # короткая ссылка
     @action(detail=True, methods=('get',), url_path='get-link')
     def get_link(self, request, pk=None):
@@ -112,46 +374,69 @@ class RecipeViewSet(viewsets.ModelViewSet):
         )
         return Response({'short-link': url})
 
+    # список покупок
+    @action(detail=False, methods=('get',), url_path='shopping_list',
+            permission_classes=[IsAuthenticated])
+    def shopping_list(self, request):
+        items = ShoppingList(request.user).items()
+        return Response(ShoppingListItemSerializer(items, many=True).data)
+
     # скачать список покупок
     @action(detail=False, methods=('get',), url_path='download_shopping_cart',
             permission_classes=[IsAuthenticated])
     def download_shopping_cart(self, request):
-        # Сначала достаём продукты с суммарными количествами
-        products = (
-            Ingredient.objects
-            .filter(ingredient_recipes__recipe__in_carts__user=request.user)
-            .values('name', 'measurement_unit')
-            .annotate(total=Sum('ingredient_recipes__amount'))
-            .order_by('name')
-        )
-
-        # А потом сам отчёт в одну строчку
-        report = ('\n'.join([
-            f"Список покупок для {request.user.username} — "
-            f"{datetime.today().isoformat()} {datetime.now().strftime('%H:%M:%S')}",
-            'Продукты:',
-            *(
-                f'{i}. {item["name"].title()} '
-                f'({item["measurement_unit"]}) — {item["total"]}'
-                for i, item in enumerate(products, start=1)
-            ),
-            'Рецепты:',
-            *(
-                f'{r.name} — {r.author.username}'
-                for r in Recipe.objects.filter(in_carts__user=request.user)
-            ),
-        ]))
-
-        return FileResponse(
-            report,
-            filename="shopping_list.txt",
-            as_attachment=True,
+        # ?type=txt|csv|json|pdf (?format= занят DRF), ?async=1 — в фоне
+        file_type = request.query_params.get('type', 'txt')
+        exporter = EXPORTERS.get(file_type)
+        if exporter is None:
+            raise ValidationError(
+                {'type': f'Доступные форматы: {", ".join(EXPORTERS)}'})
+        if request.query_params.get('async') == '1':
+            # большой список — файлом в фоне, клиент опрашивает /jobs/{id}/
+            job = enqueue(export_shopping_list,
+                          {'user_id': request.user.pk, 'file_type': file_type},
+                          user=request.user)
+            return Response(
+                JobSerializer(job).data, status=status.HTTP_202_ACCEPTED,
+                headers={'Location': request.build_absolute_uri(
+                    reverse('jobs-detail', args=[job.pk]))})
+        response = StreamingHttpResponse(
+            exporter.render(ShoppingList(request.user)),
+            content_type=exporter.content_type,
         )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{file_type}"')
+        return response
 
 
 class UserViewSet(DjoserUserViewSet):
     lookup_field = 'id'
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'subscriptions' or (
+            self.action == 'subscribe' and self.request.method == 'POST'
+        ):
+            queryset = self._with_recipe_cards(queryset)
+        return queryset
+
+    def _with_recipe_cards(self, queryset):
+        """
+        Карточки авторов без N+1: первые recipes_limit рецептов всех
+        авторов страницы — одним запросом (срез в Prefetch даёт
+        ROW_NUMBER() OVER (PARTITION BY author_id)), число рецептов —
+        готовый счётчик на User.
+        """
+        recipes = Recipe.objects.only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time',
+            'favorites_count', 'author')
+        limit = self.request.query_params.get('recipes_limit')
+        if limit and limit.isdigit():
+            recipes = recipes[:int(limit)]
+        return queryset.prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='short_recipes'),
+        )
+
     # /users/me/
     @action(detail=False, methods=('get',), permission_classes=[IsAuthenticated])
     def me(self, request, *args, **kwargs):
@@ -176,8 +461,11 @@ class UserViewSet(DjoserUserViewSet):
             serializer_class=AuthorCardSerializer,
             permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
-        authors = User.objects.filter(following__user=request.user)
+        authors = self.get_queryset().filter(followers__user=request.user)
         page = self.paginate_queryset(authors)
+        # в подписках флаг известен заранее — без запроса
+        ViewerState.of(request).remember(
+            subscribed=[author.pk for author in page])
         serializer = self.get_serializer(page, many=True,
                                          context={'request': request})
         return self.get_paginated_response(serializer.data)
@@ -186,6 +474,7 @@ class UserViewSet(DjoserUserViewSet):
     @action(detail=True, methods=('post', 'delete'),
             serializer_class=AuthorCardSerializer,
             permission_classes=[IsAuthenticated])
+    @transaction.atomic
     def subscribe(self, request, id=None):
         author = self.get_object()
 
@@ -196,6 +485,9 @@ class UserViewSet(DjoserUserViewSet):
                 user=request.user, author=author)
             if not created:
                 raise ValidationError({'errors': 'Уже подписаны'})
+            counters.follow_changed(request.user.pk, author.pk, 1)
+            author.followers_count += 1
+            ViewerState.of(request).remember(subscribed=[author.pk])
             return Response(self.get_serializer(author).data,
                             status=status.HTTP_201_CREATED)
 
@@ -205,4 +497,14 @@ class UserViewSet(DjoserUserViewSet):
         if not follow:
             raise ValidationError({'errors': 'Подписки не существует'})  # 400
         follow.delete()
+        counters.follow_changed(request.user.pk, author.pk, -1)
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Фоновые задачи текущего пользователя: статус и результат."""
+    serializer_class = JobSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user)
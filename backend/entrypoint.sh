@@ -5,7 +5,12 @@ python manage.py makemigrations --noinput
 python manage.py migrate --noinput
 python manage.py collectstatic --noinput
 
-gunicorn foodgram.wsgi:application \
-    --bind 0.0.0.0:8000 \
-    --workers 4 \
-    --timeout 120
+# bind, воркеры и общий каталог метрик — в gunicorn.conf.py;
+# SERVER_MODE=asgi — uvicorn-воркеры и async-чтение (см. settings.py)
+export SERVER_MODE="${SERVER_MODE:-wsgi}"
+case "$SERVER_MODE" in
+    wsgi) exec gunicorn foodgram.wsgi:application -c gunicorn.conf.py ;;
+    asgi) exec gunicorn foodgram.asgi:application -c gunicorn.conf.py \
+              -k uvicorn.workers.UvicornWorker ;;
+    *) echo "SERVER_MODE: wsgi или asgi, а не $SERVER_MODE" >&2; exit 1 ;;
+esac
@@ -21,15 +21,19 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'djoser',
     'users',
     'recipes',
+    'jobs',
     'api',
 ]
 
 MIDDLEWARE = [
+    # первым — чтобы в total попали все остальные слои
+    'api.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -40,7 +44,12 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'foodgram.urls'
+# wsgi — синхронные воркеры gunicorn; asgi — uvicorn-воркеры, чтение
+# рецептов, ингредиентов и профилей — async (foodgram.urls_async).
+# Выбирается в entrypoint.sh
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+ROOT_URLCONF = ('foodgram.urls_async' if SERVER_MODE == 'asgi'
+                else 'foodgram.urls')
 
 TEMPLATES = [
     {
@@ -116,9 +125,26 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Общий для всех воркеров gunicorn кэш: версии справочника и т.п.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache',
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', str(BASE_DIR / 'cache')),
+    }
+}
+
+# шрифт с кириллицей для PDF-выгрузки списка покупок
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+)
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
@@ -141,3 +167,88 @@ DJOSER = {
 }
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# максимум подсказок в автодополнении ингредиентов
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', '50'))
+# сколько секунд клиенты могут не перепроверять справочник ингредиентов
+INGREDIENT_CATALOG_MAX_AGE = int(
+    os.getenv('INGREDIENT_CATALOG_MAX_AGE', '3600'))
+# с какой оценки планировщика перестаём считать COUNT(*) точно
+COUNT_ESTIMATE_THRESHOLD = int(
+    os.getenv('COUNT_ESTIMATE_THRESHOLD', '100000'))
+# как долго админка кэширует границы фильтра по времени готовки
+ADMIN_COOKING_TIME_CACHE_TIMEOUT = int(
+    os.getenv('ADMIN_COOKING_TIME_CACHE_TIMEOUT', '600'))
+# сколько секунд живёт кэш ответов ленты/карточки рецепта (0 — выключен)
+RECIPE_CACHE_TIMEOUT = int(os.getenv('RECIPE_CACHE_TIMEOUT', '300'))
+# процессов для уменьшенных копий картинок (0 — строить прямо в запросе)
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '2'))
+# где строить копии: pool — пул процессов веб-воркера,
+# queue — задачей для manage.py run_worker, inline — прямо в запросе
+IMAGE_PIPELINE = os.getenv('IMAGE_PIPELINE', 'pool')
+# очередь фоновых задач (jobs): попытки, задержка повтора (сек.)
+# и сколько задача может выполняться, прежде чем её вернут в очередь
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_BACKOFF_BASE = int(os.getenv('JOB_BACKOFF_BASE', '10'))
+JOB_BACKOFF_MAX = int(os.getenv('JOB_BACKOFF_MAX', '3600'))
+JOB_TIMEOUT = int(os.getenv('JOB_TIMEOUT', '900'))
+# сколько секунд хранится файл фоновой выгрузки списка покупок
+SHOPPING_LIST_EXPORT_TTL = int(
+    os.getenv('SHOPPING_LIST_EXPORT_TTL', str(24 * 60 * 60)))
+# заголовок Server-Timing (SQL, сериализация, рендеринг): off — никому,
+# staff — только персоналу, all — всем
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'staff')
+# больше запросов к БД за один HTTP-запрос — предупреждение в журнале
+# api.requests (0 — не проверять)
+REQUEST_QUERY_BUDGET = int(os.getenv('REQUEST_QUERY_BUDGET', '30'))
+# INFO — в журнал каждый запрос, WARNING — только сверх бюджета
+REQUEST_LOG_LEVEL = os.getenv('REQUEST_LOG_LEVEL', 'WARNING')
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.requests': {
+            'handlers': ['console'],
+            'level': REQUEST_LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
+# /metrics (Prometheus): если задан — нужен заголовок
+# Authorization: Bearer <токен>; nginx этот путь наружу не отдаёт
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# кэш токенов (api.authentication): сколько секунд запись живёт в общем
+# кэше (0 — кэш выключен), сколько — в памяти процесса и сколько
+# токенов процесс помнит
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', '600'))
+TOKEN_LRU_TTL = int(os.getenv('TOKEN_LRU_TTL', '60'))
+TOKEN_LRU_SIZE = int(os.getenv('TOKEN_LRU_SIZE', '10000'))
+# сколько рецептов можно добавить в избранное/корзину одним запросом
+RECIPE_BATCH_LIMIT = int(os.getenv('RECIPE_BATCH_LIMIT', '100'))
+# поиск рецептов (recipes.search): порог сходства слов pg_trgm для
+# опечаток в названии, 0..1 (меньше — терпимее к опечаткам)
+RECIPE_SEARCH_SIMILARITY = float(
+    os.getenv('RECIPE_SEARCH_SIMILARITY', '0.5'))
+DATABASES['default'].setdefault('OPTIONS', {})['options'] = (
+    f'-c pg_trgm.word_similarity_threshold={RECIPE_SEARCH_SIMILARITY}')
+# подбор рецептов по продуктам (recipes.pantry): сколько продуктов
+# в запросе, сколько недостающих можно (и по умолчанию) и на сколько
+# правок воркер догоняет журнал, а не строит индекс заново
+PANTRY_INGREDIENTS_LIMIT = int(os.getenv('PANTRY_INGREDIENTS_LIMIT', '100'))
+PANTRY_MAX_MISSING = int(os.getenv('PANTRY_MAX_MISSING', '3'))
+PANTRY_JOURNAL_SIZE = int(os.getenv('PANTRY_JOURNAL_SIZE', '1000'))
+# похожие рецепты (recipes.similarity): сколько соседей хранить, вес
+# общего избранного в сходстве (0 — только состав) и с какой доли
+# рецептов продукт (соль, вода) считается частым и не даёт кандидатов
+SIMILAR_RECIPES_K = int(os.getenv('SIMILAR_RECIPES_K', '12'))
+SIMILAR_FAVORITES_WEIGHT = float(
+    os.getenv('SIMILAR_FAVORITES_WEIGHT', '0.3'))
+SIMILAR_FREQUENT_SHARE = float(os.getenv('SIMILAR_FREQUENT_SHARE', '0.05'))
+# популярность рецептов (recipes.popularity, ?ordering=popular): за сколько
+# дней вклад избранного и корзины уменьшается вдвое; после смены —
+# manage.py rebuild_popularity
+POPULARITY_HALF_LIFE_DAYS = float(
+    os.getenv('POPULARITY_HALF_LIFE_DAYS', '7'))
@@ -0,0 +1,10 @@
+"""
+Маршруты для SERVER_MODE=asgi: те же, что в foodgram.urls, но чтение
+рецептов, ингредиентов, профилей и короткие ссылки — async-обработчики
+(api.async_views).
+"""
+from api.async_views import with_async_reads
+
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = with_async_reads(sync_urlpatterns)
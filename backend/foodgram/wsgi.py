@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "foodgram.settings")
 
 application = get_wsgi_application()
+
+# индексы ингредиентов и подбора по продуктам строятся при старте
+# воркера, а не на первом запросе
+from recipes.ingredient_index import ingredient_index  # noqa: E402
+from recipes.pantry import pantry_index  # noqa: E402
+
+ingredient_index.warm()
+pantry_index.warm()
@@ -0,0 +1,24 @@
+"""Настройки gunicorn (запускается из entrypoint.sh)."""
+import os
+import shutil
+
+bind = '0.0.0.0:8000'
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
+timeout = 120
+
+# метрики всех воркеров — mmap-файлы в общем каталоге (api.prometheus);
+# переменная нужна до того, как воркер импортирует prometheus_client
+multiproc_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus')
+
+
+def on_starting(server):
+    # файлы прошлого запуска — чужие значения счётчиков
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir)
+
+
+def child_exit(server, worker):
+    # gauge умершего воркера больше не учитываются
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
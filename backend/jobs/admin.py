@@ -0,0 +1,32 @@
+from django.contrib import admin
+from django.utils import timezone
+
+from recipes.utils import EstimatedCountPaginator
+
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'name', 'status', 'attempts', 'user',
+        'run_at', 'started_at', 'finished_at',
+    )
+    list_filter = ('status', 'name')
+    search_fields = ('name',)
+    list_select_related = ('user',)
+    readonly_fields = (
+        'attempts', 'created_at', 'started_at', 'finished_at',
+        'worker', 'result', 'error',
+    )
+    actions = ('retry',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @admin.action(description='Перезапустить выбранные задачи')
+    def retry(self, request, queryset):
+        count = queryset.exclude(status=Job.Status.RUNNING).update(
+            status=Job.Status.QUEUED, attempts=0, run_at=timezone.now(),
+            finished_at=None,
+        )
+        self.message_user(request, f'Возвращено в очередь: {count}.')
@@ -0,0 +1,74 @@
+import signal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from jobs import queue
+from jobs.models import Job
+
+
+class Command(BaseCommand):
+    help = "Воркер очереди фоновых задач; --status — сводка по очереди"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency", type=int, default=1,
+            help="сколько задач выполнять одновременно (потоков)",
+        )
+        parser.add_argument(
+            "--poll-interval", type=float, default=1.0,
+            help="пауза между опросами пустой очереди, сек.",
+        )
+        parser.add_argument(
+            "--once", action="store_true",
+            help="выполнить всё, что готово к запуску, и выйти",
+        )
+        parser.add_argument(
+            "--status", action="store_true",
+            help="показать состояние очереди и выйти",
+        )
+        parser.add_argument(
+            "--retry-failed", nargs="?", const="", metavar="TASK",
+            help="вернуть упавшие задачи (все или одной задачи) в очередь",
+        )
+
+    def handle(self, *args, **options):
+        if options["retry_failed"] is not None:
+            count = queue.retry_failed(options["retry_failed"] or None)
+            self.stdout.write(f"Возвращено в очередь: {count}.")
+            return
+        if options["status"]:
+            self._status()
+            return
+
+        worker = queue.Worker(
+            concurrency=options["concurrency"],
+            poll_interval=options["poll_interval"],
+        )
+        # SIGTERM/SIGINT — доделать начатое и выйти
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: worker.stop())
+        self.stdout.write(
+            f"Воркер {worker.name}: потоков {worker.concurrency}.")
+        worker.run(once=options["once"])
+        self.stdout.write(self.style.SUCCESS("Воркер остановлен."))
+
+    def _status(self):
+        counts, oldest = queue.status()
+        if not counts:
+            self.stdout.write("Очередь пуста.")
+            return
+        names = sorted({name for name, _ in counts})
+        statuses = [status for status, _ in Job.Status.choices]
+        width = max(map(len, names))
+        self.stdout.write(
+            "задача".ljust(width)
+            + "".join(status.rjust(10) for status in statuses))
+        for name in names:
+            self.stdout.write(name.ljust(width) + "".join(
+                str(counts.get((name, status), 0)).rjust(10)
+                for status in statuses))
+        if oldest is not None:
+            wait = timezone.now() - oldest
+            self.stdout.write(
+                f"Самая старая задача ждёт: {wait.total_seconds():.0f} с.")
@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """Задача очереди: имя зарегистрированной функции и её аргументы."""
+
+    class Status(models.TextChoices):
+        QUEUED = 'queued', 'В очереди'
+        RUNNING = 'running', 'Выполняется'
+        DONE = 'done', 'Готово'
+        FAILED = 'failed', 'Ошибка'
+
+    name = models.CharField('Задача', max_length=100)
+    payload = models.JSONField(
+        'Аргументы', default=dict, blank=True, encoder=DjangoJSONEncoder)
+    status = models.CharField(
+        'Статус', max_length=10,
+        choices=Status.choices, default=Status.QUEUED,
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='jobs',
+        null=True,
+        blank=True,
+        verbose_name='Поставил',
+    )
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    max_attempts = models.PositiveSmallIntegerField(
+        'Максимум попыток', default=3)
+    run_at = models.DateTimeField('Запустить не раньше', default=timezone.now)
+    created_at = models.DateTimeField('Создана', auto_now_add=True)
+    started_at = models.DateTimeField('Начата', null=True, blank=True)
+    finished_at = models.DateTimeField('Завершена', null=True, blank=True)
+    worker = models.CharField('Воркер', max_length=100, blank=True)
+    result = models.JSONField(
+        'Результат', null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField('Ошибка', blank=True)
+
+    class Meta:
+        ordering = ('-created_at',)
+        indexes = [
+            # выборка воркером: только ждущие задачи, по времени запуска
+            models.Index(
+                fields=['run_at', 'id'],
+                condition=models.Q(status='queued'),
+                name='job_queue_idx',
+            ),
+            models.Index(fields=['status', 'name'], name='job_status_idx'),
+        ]
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+
+    def __str__(self) -> str:
+        return f'{self.name} #{self.pk} ({self.get_status_display()})'
@@ -0,0 +1,235 @@
+"""
+Очередь задач в таблице Job — без брокера.
+
+Задача — функция, зарегистрированная декоратором @task в <app>/tasks.py;
+в очередь кладётся её имя и JSON-аргументы (enqueue). Воркер
+(manage.py run_worker) забирает ждущие задачи через
+SELECT ... FOR UPDATE SKIP LOCKED: несколько воркеров не берут одну
+задачу и не ждут блокировок друг друга. Упавшая задача повторяется
+с экспоненциальной задержкой, пока не кончатся попытки; задача, чей
+воркер умер посреди работы, возвращается в очередь через JOB_TIMEOUT.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Callable
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Task:
+    name: str
+    func: Callable
+    max_attempts: int
+
+
+_registry = {}
+
+
+def task(name=None, *, max_attempts=None):
+    """
+    Зарегистрировать функцию как задачу. Имя по умолчанию —
+    «<приложение>.<функция>», аргументы только именованные и JSON.
+    """
+    def decorator(func):
+        app = func.__module__.split('.')[0]
+        task_name = name or f'{app}.{func.__name__}'
+        _registry[task_name] = Task(
+            task_name, func, max_attempts or settings.JOB_MAX_ATTEMPTS)
+        func.task_name = task_name
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, *, user=None, delay=None):
+    """
+    Поставить задачу в очередь; name — имя или функция с @task.
+    Внутри транзакции задача станет видна воркерам после коммита.
+    """
+    name = getattr(name, 'task_name', name)
+    if name not in _registry:
+        raise LookupError(f'Задача «{name}» не зарегистрирована')
+    return Job.objects.create(
+        name=name,
+        payload=payload or {},
+        user=user,
+        max_attempts=_registry[name].max_attempts,
+        run_at=timezone.now() + (delay or timedelta()),
+    )
+
+
+# воркер
+def claim(worker, limit):
+    """Забрать до limit готовых к запуску задач."""
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.Status.QUEUED, run_at__lte=now)
+            .order_by('run_at', 'id')
+            .values_list('pk', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        # status в условии — на случай БД без FOR UPDATE (SQLite)
+        Job.objects.filter(pk__in=ids, status=Job.Status.QUEUED).update(
+            status=Job.Status.RUNNING,
+            worker=worker,
+            started_at=now,
+            attempts=F('attempts') + 1,
+        )
+    return list(Job.objects.filter(
+        pk__in=ids, worker=worker, started_at=now,
+        status=Job.Status.RUNNING,
+    ).order_by('run_at', 'id'))
+
+
+def backoff(attempt):
+    """Задержка перед повтором: base·2^(n-1), не больше max, ±20%."""
+    delay = min(settings.JOB_BACKOFF_BASE * 2 ** (attempt - 1),
+                settings.JOB_BACKOFF_MAX)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def _failed(job, error):
+    now = timezone.now()
+    if job.attempts < job.max_attempts:
+        changes = {'status': Job.Status.QUEUED,
+                   'run_at': now + backoff(job.attempts)}
+    else:
+        changes = {'status': Job.Status.FAILED, 'finished_at': now}
+    Job.objects.filter(pk=job.pk).update(error=error, worker='', **changes)
+
+
+def execute(job):
+    """Выполнить взятую задачу и записать исход; True — успех."""
+    entry = _registry.get(job.name)
+    if entry is None:
+        job.attempts = job.max_attempts  # повторять бессмысленно
+        _failed(job, f'Задача «{job.name}» не зарегистрирована')
+        return False
+    try:
+        result = entry.func(**job.payload)
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.Status.DONE, result=result, error='',
+            finished_at=timezone.now(),
+        )
+    except Exception:
+        logger.exception('Задача %s упала', job)
+        _failed(job, traceback.format_exc())
+        return False
+    return True
+
+
+def requeue_stale():
+    """Задачи «выполняется» дольше JOB_TIMEOUT — воркер, видимо, умер."""
+    deadline = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT)
+    stale = Job.objects.filter(
+        status=Job.Status.RUNNING, started_at__lt=deadline)
+    error = 'Превышено время выполнения'
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.Status.FAILED, finished_at=timezone.now(), error=error)
+    requeued = stale.update(
+        status=Job.Status.QUEUED, run_at=timezone.now(), error=error,
+        worker='')
+    return requeued + failed
+
+
+class Worker:
+    """concurrency потоков; каждый со своим соединением с БД."""
+
+    def __init__(self, concurrency=1, poll_interval=1.0, name=None):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = threading.Event()
+
+    def _execute(self, job):
+        try:
+            return execute(job)
+        except DatabaseError:
+            # исход не записался — задачу вернёт requeue_stale
+            logger.exception('Задача %s: не удалось записать исход', job)
+            return False
+        finally:
+            close_old_connections()
+
+    def run(self, once=False):
+        """Работать до stop(); once — разобрать очередь и выйти."""
+        running = set()
+        next_check = timezone.now()
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            while not self.stopping.is_set():
+                close_old_connections()
+                free = self.concurrency - len(running)
+                try:
+                    if timezone.now() >= next_check:
+                        requeue_stale()
+                        next_check = timezone.now() + timedelta(
+                            seconds=settings.JOB_TIMEOUT / 2)
+                    jobs = claim(self.name, free) if free else []
+                except DatabaseError:
+                    # БД недоступна — не падаем, пробуем на следующем круге
+                    logger.exception('Воркер %s: ошибка БД', self.name)
+                    jobs = []
+                running |= {pool.submit(self._execute, job) for job in jobs}
+                if once and not running:
+                    break
+                if len(running) < self.concurrency and jobs:
+                    continue  # слоты есть и очередь не пуста
+                # все слоты заняты — ждём первую освободившуюся,
+                # очередь пуста — ждём её или интервал опроса
+                if running:
+                    _, running = wait(
+                        running,
+                        timeout=(None if len(running) == self.concurrency
+                                 else self.poll_interval),
+                        return_when=FIRST_COMPLETED,
+                    )
+                else:
+                    self.stopping.wait(self.poll_interval)
+            # остановка: дожидаемся начатого
+            wait(running)
+
+    def stop(self):
+        self.stopping.set()
+
+
+def status():
+    """
+    Сводка: {(задача, статус): число} и время запуска самой старой
+    задачи, которая уже могла бы выполняться (None — таких нет).
+    """
+    counts = {
+        (row['name'], row['status']): row['total']
+        for row in Job.objects.order_by().values('name', 'status')
+        .annotate(total=Count('pk'))
+    }
+    oldest = Job.objects.filter(
+        status=Job.Status.QUEUED, run_at__lte=timezone.now(),
+    ).aggregate(oldest=Min('run_at'))['oldest']
+    return counts, oldest
+
+
+def retry_failed(name=None):
+    """Вернуть упавшие задачи в очередь с новым запасом попыток."""
+    failed = Job.objects.filter(status=Job.Status.FAILED)
+    if name:
+        failed = failed.filter(name=name)
+    return failed.update(
+        status=Job.Status.QUEUED, attempts=0, run_at=timezone.now(),
+        finished_at=None)
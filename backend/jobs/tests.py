@@ -0,0 +1,120 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from . import queue
+from .models import Job
+
+calls = []
+
+
+@queue.task(name='jobs.test_echo')
+def echo(value):
+    calls.append(value)
+    return {'value': value}
+
+
+@queue.task(name='jobs.test_broken', max_attempts=2)
+def broken():
+    raise RuntimeError('сломалось')
+
+
+@override_settings(JOB_BACKOFF_BASE=10, JOB_BACKOFF_MAX=60, JOB_TIMEOUT=60)
+class QueueTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_claim(self):
+        first, second, third = (
+            queue.enqueue(echo, {'value': value}) for value in range(3))
+        queue.enqueue(echo, {'value': 3}, delay=timedelta(minutes=1))
+        self.assertEqual(queue.claim('a', 2), [first, second])
+        # взятое не выдаётся второй раз, отложенное — раньше срока
+        self.assertEqual(queue.claim('b', 5), [third])
+        self.assertEqual(queue.claim('c', 5), [])
+        first.refresh_from_db()
+        self.assertEqual(
+            (first.status, first.worker, first.attempts),
+            (Job.Status.RUNNING, 'a', 1))
+
+    def test_claim_race(self):
+        job = queue.enqueue(echo, {'value': 1})
+        queue.claim('a', 1)
+        # второй воркер прочитал задачу до того, как её забрал первый
+        # (без FOR UPDATE, как в SQLite)
+        stale = mock.Mock()
+        stale.filter.return_value = Job.objects.filter(pk=job.pk)
+        with mock.patch.object(
+                Job.objects, 'select_for_update', return_value=stale):
+            self.assertEqual(queue.claim('b', 1), [])
+        job.refresh_from_db()
+        self.assertEqual((job.worker, job.attempts), ('a', 1))
+
+    def test_execute(self):
+        job = queue.enqueue(echo, {'value': 7})
+        [job] = queue.claim('a', 1)
+        self.assertTrue(queue.execute(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.DONE)
+        self.assertEqual(job.result, {'value': 7})
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(calls, [7])
+
+    def test_backoff(self):
+        with mock.patch('jobs.queue.random.uniform', return_value=1.0):
+            self.assertEqual(
+                [queue.backoff(attempt).total_seconds()
+                 for attempt in range(1, 6)],
+                [10, 20, 40, 60, 60])
+
+    def test_failed_is_retried_until_max_attempts(self):
+        job = queue.enqueue(broken)
+        self.assertEqual(job.max_attempts, 2)
+        [job] = queue.claim('a', 1)
+        before = timezone.now()
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            self.assertFalse(queue.execute(job))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), (Job.Status.QUEUED, ''))
+        self.assertIn('сломалось', job.error)
+        # повтор — через base·2^0 ± 20%
+        delay = (job.run_at - before).total_seconds()
+        self.assertTrue(8 <= delay <= 12.5, delay)
+        self.assertEqual(queue.claim('a', 1), [])
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        [job] = queue.claim('a', 1)
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            self.assertFalse(queue.execute(job))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.FAILED, 2))
+        self.assertIsNotNone(job.finished_at)
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.assertEqual(queue.claim('a', 1), [])
+
+    def test_unregistered_task_fails_at_once(self):
+        job = Job.objects.create(name='jobs.missing', max_attempts=3)
+        [job] = queue.claim('a', 1)
+        self.assertFalse(queue.execute(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.FAILED)
+
+    def test_requeue_stale(self):
+        jobs = [queue.enqueue(echo, {'value': value}) for value in range(3)]
+        queue.claim('a', 3)
+        long_ago = timezone.now() - timedelta(seconds=61)
+        alive, dead, exhausted = jobs
+        Job.objects.filter(pk__in=[dead.pk, exhausted.pk]).update(
+            started_at=long_ago)
+        Job.objects.filter(pk=exhausted.pk).update(attempts=3)
+        self.assertEqual(queue.requeue_stale(), 2)
+        statuses = dict(Job.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses, {
+            alive.pk: Job.Status.RUNNING,
+            dead.pk: Job.Status.QUEUED,
+            exhausted.pk: Job.Status.FAILED,
+        })
+        self.assertEqual(queue.claim('b', 3), [Job.objects.get(pk=dead.pk)])
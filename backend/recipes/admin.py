@@ -1,47 +1,77 @@
 # recipes/admin.py
+from django.conf import settings
 from django.contrib import admin
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
 from django.utils.safestring import mark_safe
 
+from . import pantry, relations, shopping_list
+from .images import variant_urls
 from .models import (
     Ingredient, Recipe, RecipeIngredient, Favorite, ShoppingCart
 )
+from .utils import EstimatedCountPaginator
 
 
 #  фильтр коротко / средне / долго
 class CookingTimeFilter(admin.SimpleListFilter):
     title = "Время готовки"
     parameter_name = "cooking_time"
+    cache_key = "admin:cooking-time-thresholds"
+
+    @staticmethod
+    def _thresholds():
+        """
+        Терцили времени готовки по всем рецептам и размеры групп.
+        Считаются по гистограмме (GROUP BY cooking_time) — в Python
+        приходит по строке на значение, а не на рецепт.
+        """
+        histogram = list(
+            Recipe.objects.order_by("cooking_time")
+            .values_list("cooking_time")
+            .annotate(total=Count("pk"))
+        )
+        if len(histogram) < 3:
+            return None
+        recipes = sum(total for _, total in histogram)
+        n = m = None
+        seen = 0
+        for time, total in histogram:
+            seen += total
+            if n is None and seen * 3 >= recipes:
+                n = time
+            if m is None and seen * 3 >= recipes * 2:
+                m = time
+        short_cnt = sum(total for time, total in histogram if time < n)
+        med_cnt = sum(total for time, total in histogram if n <= time < m)
+        return n, m, (short_cnt, med_cnt, recipes - short_cnt - med_cnt)
+
+    def thresholds(self):
+        if not hasattr(self, "_cached"):
+            self._cached = cache.get_or_set(
+                self.cache_key, self._thresholds,
+                settings.ADMIN_COOKING_TIME_CACHE_TIMEOUT,
+            )
+        return self._cached
 
     def lookups(self, request, model_admin):
-        # уникальные значения, отсортированные по возрастанию
-        times = sorted({*model_admin.get_queryset(request)
-                        .values_list("cooking_time", flat=True)})
-        if len(times) < 3:          
+        thresholds = self.thresholds()
+        if thresholds is None:
             return []
-
-        third = len(times) // 3 or 1
-        n = times[third - 1]
-        m = times[2 * third - 1]
-
-        short_cnt = sum(t < n for t in times)
-        med_cnt = sum(n <= t < m for t in times)
-        long_cnt = len(times) - short_cnt - med_cnt
-
+        n, m, (short_cnt, med_cnt, long_cnt) = thresholds
         return [
             ("short", f"быстрее {n} мин ({short_cnt})"),
             ("medium", f"до {m} мин ({med_cnt})"),
-            ("long", f"дольше {m} мин ({long_cnt})"),
+            ("long", f"от {m} мин ({long_cnt})"),
         ]
 
     def queryset(self, request, qs):
         val = self.value()
-        if not val:
+        thresholds = self.thresholds()
+        if not val or thresholds is None:
             return qs
-
-        times = sorted({*qs.values_list("cooking_time", flat=True)})
-        third = len(times) // 3 or 1
-        n = times[third - 1]
-        m = times[2 * third - 1]
+        n, m, _ = thresholds
 
         if val == "short":
             return qs.filter(cooking_time__lt=n)
@@ -52,10 +82,44 @@ class CookingTimeFilter(admin.SimpleListFilter):
         return qs
 
 
+class RelationAdmin(admin.ModelAdmin):
+    """
+    Избранное/корзина: строки из админки проходят через
+    recipes.relations — счётчики, популярность и списки покупок
+    не расходятся со строками.
+    """
+    list_select_related = ("user", "recipe")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        if change:
+            old = type(obj).objects.get(pk=obj.pk)
+        super().save_model(request, obj, form, change)
+        # сначала новая строка: settle() после удаления старой
+        # пересчитывает по истории, где новая уже есть
+        relations.row_added(obj)
+        if change:
+            relations.row_removed(old)
+
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        relations.row_removed(obj)
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        rows = list(queryset.select_related("user", "recipe"))
+        super().delete_queryset(request, queryset)
+        for row in rows:
+            relations.row_removed(row)
+
+
 #  корзина
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "recipe")
+class ShoppingCartAdmin(RelationAdmin):
+    list_display = ("id", "user", "recipe", "created_at")
     search_fields = ("user__username", "recipe__name")
 
 
@@ -66,10 +130,16 @@ class IngredientAdmin(admin.ModelAdmin):
     search_fields = ("name", "measurement_unit")
     list_filter = ("measurement_unit",)
     ordering = ("name",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
-    @admin.display(description="Рецептов")
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            recipes_count=Count("ingredient_recipes"))
+
+    @admin.display(description="Рецептов", ordering="recipes_count")
     def recipes_count(self, ingredient):
-        return ingredient.recipes.count()
+        return ingredient.recipes_count
 
 
 # inline-форма для ингредиентов в рецепте
@@ -88,31 +158,48 @@ class RecipeAdmin(admin.ModelAdmin):
     search_fields = ("name", "author__username")
     list_filter = (CookingTimeFilter, "author")
     inlines = (IngredientInline,)
-
-    @admin.display(description="В избранном")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            "author"
+        ).prefetch_related("recipe_ingredients__ingredient")
+
+    def save_related(self, request, form, formsets, change):
+        old = shopping_list.recipe_amounts(form.instance) if change else {}
+        super().save_related(request, form, formsets, change)
+        new = shopping_list.recipe_amounts(form.instance)
+        if change:
+            shopping_list.recipe_changed(form.instance, old, new)
+        pantry.recipe_changed(form.instance.pk, old, new)
+
+    @admin.display(description="В избранном", ordering="favorites_count")
     def favorites_count(self, recipe):
-        return recipe.favorites.count()
+        return recipe.favorites_count
 
     @admin.display(description="Продукты")
     @mark_safe
     def products_list(self, recipe):
         return "<br>".join(
             f"{ri.ingredient.name} ({ri.amount} {ri.ingredient.measurement_unit})"
-            for ri in recipe.recipe_ingredients.select_related("ingredient")
+            for ri in recipe.recipe_ingredients.all()
         )
 
     @admin.display(description="Изображение")
     @mark_safe
     def image_tag(self, recipe):
         if recipe.image:
+            # уменьшенная копия, пока её нет — оригинал
+            thumb = variant_urls(recipe.image_variants).get("thumb", {})
             return (
-                f'<img src="{recipe.image.url}" width="50" height="50" '
-                'style="border-radius:4px;" />'
+                f'<img src="{thumb.get("webp", recipe.image.url)}" '
+                'width="50" height="50" style="border-radius:4px;" />'
             )
         return ""
 
 
 #  избранное
 @admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
-    list_display = ("user", "recipe")
+class FavoriteAdmin(RelationAdmin):
+    list_display = ("user", "recipe", "created_at")
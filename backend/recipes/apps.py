@@ -7,3 +7,10 @@ class RecipesConfig(AppConfig):
 
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import counters, search, signals  # noqa: F401
+        post_migrate.connect(search.install, sender=self)
+        post_migrate.connect(counters.backfill, sender=self)
@@ -0,0 +1,76 @@
+"""
+Версия справочника ингредиентов и его готовый JSON-снимок.
+
+Версия лежит в общем кэше и меняется при любой записи в Ingredient
+(сигналы) и после load_ingredients. Снимок — уже сериализованные
+и сжатые байты всего справочника: строится один раз на версию
+в каждом воркере, дальше отдаётся как есть.
+"""
+import gzip
+import hashlib
+import json
+import threading
+import uuid
+from dataclasses import dataclass
+
+from django.core.cache import cache
+
+from .models import Ingredient
+
+VERSION_KEY = 'ingredients:catalog-version'
+
+
+def catalog_version():
+    """Текущая версия справочника (создаётся при первом обращении)."""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """Справочник изменился — снимки и индекс поиска устарели."""
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    version: str
+    etag: str
+    body: bytes
+    gzipped: bytes
+
+
+_lock = threading.Lock()
+_snapshot = None
+
+
+def catalog_snapshot():
+    """Снимок текущей версии; пересобирается только после её смены."""
+    global _snapshot
+    version = catalog_version()
+    snapshot = _snapshot
+    if snapshot is None or snapshot.version != version:
+        with _lock:
+            if _snapshot is None or _snapshot.version != version:
+                _snapshot = _build(version)
+            snapshot = _snapshot
+    return snapshot
+
+
+def _build(version):
+    rows = Ingredient.objects.order_by('id').values(
+        'id', 'name', 'measurement_unit')
+    body = json.dumps(
+        list(rows), ensure_ascii=False, separators=(',', ':')
+    ).encode()
+    # ETag из содержимого: у всех воркеров он одинаковый,
+    # даже если версия в кэше у каждого своя
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    return CatalogSnapshot(
+        version=version,
+        etag=f'"{digest}"',
+        body=body,
+        gzipped=gzip.compress(body, compresslevel=9, mtime=0),
+    )
@@ -0,0 +1,125 @@
+"""
+Денормализованные счётчики: избранное/корзины у рецепта,
+рецепты/подписчики/подписки у пользователя.
+
+Меняются F()-выражениями (атомарно на стороне БД) — вызывать внутри
+той же транзакции, что и сама запись; уменьшение не опускает счётчик
+ниже нуля, даже если он уже разошёлся со строками. Разошедшиеся
+счётчики (правка в обход API и админки) чинит reconcile(): после
+каждого migrate (backfill) и командой manage.py reconcile_counters.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models import (
+    Case, Count, F, IntegerField, OuterRef, Q, Subquery, Value, When,
+)
+from django.db.models.functions import Coalesce, Greatest, Now
+
+from users.models import Follow
+
+from .models import Favorite, Recipe, ShoppingCart
+
+User = get_user_model()
+
+RELATION_FIELDS = {
+    Favorite: 'favorites_count',
+    ShoppingCart: 'carts_count',
+}
+
+
+def _shifted(field, delta):
+    # PositiveIntegerField: счётчик, отставший от строк, не должен
+    # превращать удаление в IntegrityError
+    return Greatest(F(field) + delta, Value(0))
+
+
+def relation_changed(model, recipe_ids, delta, popularity=None):
+    """
+    Рецепты добавили в избранное/корзину (delta > 0) или убрали;
+    popularity — новое значение Recipe.popularity (recipes.popularity),
+    пишется тем же UPDATE.
+    """
+    field = RELATION_FIELDS[model]
+    extra = {} if popularity is None else {'popularity': popularity}
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        **{field: _shifted(field, delta)}, updated_at=Now(), **extra)
+
+
+def follow_changed(user_id, author_id, delta):
+    """Подписка user → author создана или удалена: один UPDATE на двоих."""
+    User.objects.filter(pk__in=(user_id, author_id)).update(
+        following_count=_shifted('following_count', Case(
+            When(pk=user_id, then=Value(delta)), default=Value(0))),
+        followers_count=_shifted('followers_count', Case(
+            When(pk=author_id, then=Value(delta)), default=Value(0))),
+    )
+
+
+def recipes_changed(author_id, delta):
+    User.objects.filter(pk=author_id).update(
+        recipes_count=_shifted('recipes_count', delta))
+
+
+def user_deleting(user):
+    """
+    Связи пользователя удалятся каскадом — вычитаем их из счётчиков
+    других пользователей и рецептов.
+    """
+    User.objects.filter(followers__user=user).update(
+        followers_count=_shifted('followers_count', -1))
+    User.objects.filter(following__author=user).update(
+        following_count=_shifted('following_count', -1))
+    for model, field in RELATION_FIELDS.items():
+        Recipe.objects.filter(
+            pk__in=model.objects.filter(user=user).values('recipe_id'),
+        ).update(**{field: _shifted(field, -1)}, updated_at=Now())
+
+
+# сверка
+def _count(model, field, **outer):
+    return Coalesce(Subquery(
+        model.objects.filter(**outer)
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total'),
+        output_field=IntegerField(),
+    ), 0)
+
+
+def reconcile():
+    """Пересчитать разошедшиеся счётчики; {поле: починено строк}."""
+    result = {}
+    expected = {
+        Recipe: {
+            'favorites_count': lambda: _count(
+                Favorite, 'recipe', recipe=OuterRef('pk')),
+            'carts_count': lambda: _count(
+                ShoppingCart, 'recipe', recipe=OuterRef('pk')),
+        },
+        User: {
+            'recipes_count': lambda: _count(
+                Recipe, 'author', author=OuterRef('pk')),
+            'followers_count': lambda: _count(
+                Follow, 'author', author=OuterRef('pk')),
+            'following_count': lambda: _count(
+                Follow, 'user', user=OuterRef('pk')),
+        },
+    }
+    for model, fields in expected.items():
+        # у рецепта счётчик виден в карточке — сдвигаем и updated_at
+        touch = {'updated_at': Now()} if model is Recipe else {}
+        for field, count in fields.items():
+            # UPDATE ... WHERE field <> (SELECT COUNT ...) — только дрейф
+            result[field] = model.objects.alias(
+                expected=count(),
+            ).filter(~Q(**{field: F('expected')})).update(
+                **{field: count()}, **touch)
+    return result
+
+
+def backfill(**kwargs):
+    """
+    post_migrate: новые колонки счётчиков создаются нулями — заполняем
+    их по уже существующим строкам (и чиним дрейф) без ручного шага.
+    """
+    reconcile()
@@ -0,0 +1,213 @@
+"""
+Уменьшенные копии картинок рецептов и аватаров.
+
+Оригинал сохраняется как раньше, а варианты (thumb, card, detail;
+WebP и JPEG для клиентов без WebP) строятся после коммита в пуле
+процессов или задачей очереди jobs (IMAGE_PIPELINE) — ответ API
+их не ждёт. Готовые пути записываются
+в JSON-поле модели (`image_variants` / `avatar_variants`) вместе
+с именем исходника: если картинку успели заменить, устаревший
+результат отбрасывается.
+
+Функция render_variants выполняется в дочернем процессе, поэтому
+модуль не должен трогать реестр приложений при импорте.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models.signals import ModelSignal
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# имя: (ширина, высота, обрезать ли до точного размера)
+RECIPE_VARIANTS = {
+    'thumb': (100, 100, True),
+    'card': (640, 480, True),
+    'detail': (1280, 1280, False),
+}
+AVATAR_VARIANTS = {
+    'thumb': (100, 100, True),
+    'card': (300, 300, True),
+    'detail': (600, 600, False),
+}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True,
+                      'progressive': True}),
+}
+
+# варианты записаны: sender — модель (можно строкой), pk — объект
+variants_ready = ModelSignal(use_caching=True)
+
+
+# дочерний процесс: только Pillow
+def _prepare(image):
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert(
+            'RGBA' if 'transparency' in image.info else 'RGB')
+    return image
+
+
+def _flatten(image):
+    """JPEG без альфа-канала: прозрачное — на белый фон."""
+    if image.mode != 'RGBA':
+        return image
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def render_variants(data, specs):
+    """{имя: {формат: байты}} для исходных байтов картинки."""
+    with Image.open(BytesIO(data)) as source:
+        # JPEG декодируется сразу в уменьшенном виде
+        source.draft('RGB', (max(w for w, _, _ in specs.values()),
+                             max(h for _, h, _ in specs.values())))
+        image = _prepare(source)
+        result = {}
+        for name, (width, height, crop) in specs.items():
+            if crop:
+                variant = ImageOps.fit(
+                    image, (width, height), Image.Resampling.LANCZOS)
+            else:
+                variant = image.copy()
+                variant.thumbnail((width, height), Image.Resampling.LANCZOS)
+            result[name] = {}
+            for ext, (fmt, options) in FORMATS.items():
+                buffer = BytesIO()
+                (variant if fmt == 'WEBP' else _flatten(variant)).save(
+                    buffer, fmt, **options)
+                result[name][ext] = buffer.getvalue()
+        return result
+
+
+# родительский процесс
+_lock = threading.Lock()
+_executor = None
+
+
+def _pool():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # spawn, а не fork: форк многопоточного воркера с открытыми
+            # соединениями к БД чреват зависшими блокировками
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS,
+                mp_context=get_context('spawn'),
+            )
+        return _executor
+
+
+def _variant_name(source, name, ext):
+    head, tail = os.path.split(source)
+    stem = os.path.splitext(tail)[0]
+    return f'{head}/variants/{stem}-{name}.{ext}'
+
+
+def variant_urls(variants):
+    """{имя: {формат: url}} для сериализаторов и админки."""
+    return {
+        name: {ext: default_storage.url(path) for ext, path in paths.items()}
+        for name, paths in variants.get('files', {}).items()
+    }
+
+
+def _delete_files(variants):
+    for paths in variants.get('files', {}).values():
+        for path in paths.values():
+            default_storage.delete(path)
+
+
+def _save(model, pk, field, source, rendered):
+    """Записать файлы и путь к ним — если исходник не сменился."""
+    variants_field = f'{field}_variants'
+    files = {
+        name: {
+            ext: default_storage.save(
+                _variant_name(source, name, ext), ContentFile(data))
+            for ext, data in formats.items()
+        }
+        for name, formats in rendered.items()
+    }
+    old = model.objects.filter(pk=pk).values_list(
+        variants_field, flat=True).first()
+    updated = model.objects.filter(pk=pk, **{field: source}).update(
+        **{variants_field: {'source': source, 'files': files}})
+    if not updated:
+        # картинку заменили или объект удалили — результат не нужен
+        _delete_files({'files': files})
+        return
+    if old and old.get('source') != source:
+        _delete_files(old)
+    variants_ready.send(sender=model, pk=pk)
+
+
+def _done(model, pk, field, source, future):
+    try:
+        _save(model, pk, field, source, future.result())
+    except Exception:
+        logger.exception('Не удалось подготовить варианты %s', source)
+    finally:
+        # колбэк выполняется в служебном потоке пула
+        close_old_connections()
+
+
+def build(instance, field, specs, pipeline=None):
+    """
+    Построить варианты: в пуле процессов (pool), задачей очереди jobs
+    (queue) или прямо сейчас (inline, а также при IMAGE_WORKERS=0).
+    """
+    pipeline = pipeline or settings.IMAGE_PIPELINE
+    source = getattr(instance, field).name
+    args = (type(instance), instance.pk, field, source)
+    if pipeline == 'queue':
+        from jobs.queue import enqueue  # модуль грузится и в дочернем
+        enqueue('recipes.build_image_variants', {
+            'model': instance._meta.label, 'pk': instance.pk,
+            'field': field, 'source': source, 'specs': specs,
+        })
+        return
+    with default_storage.open(source) as file:
+        data = file.read()
+    if pipeline == 'inline' or not settings.IMAGE_WORKERS:
+        _save(*args, render_variants(data, specs))
+        return
+    future = _pool().submit(render_variants, data, specs)
+    future.add_done_callback(lambda future: _done(*args, future))
+
+
+def schedule(instance, field, specs):
+    """
+    Из post_save: построить варианты после коммита, если картинка
+    новая; убрать их, если картинку удалили.
+    """
+    image = getattr(instance, field)
+    variants = getattr(instance, f'{field}_variants') or {}
+    if not image:
+        if variants:
+            type(instance).objects.filter(pk=instance.pk).update(
+                **{f'{field}_variants': {}})
+            transaction.on_commit(
+                lambda: _delete_files(variants), robust=True)
+        return
+    if variants.get('source') != image.name:
+        transaction.on_commit(
+            lambda: build(instance, field, specs), robust=True)
+
+
+def discard(instance, field):
+    """Из post_delete: варианты удалённого объекта больше не нужны."""
+    variants = getattr(instance, f'{field}_variants') or {}
+    if variants:
+        transaction.on_commit(lambda: _delete_files(variants), robust=True)
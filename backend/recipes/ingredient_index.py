@@ -0,0 +1,195 @@
+"""
+Индекс ингредиентов в памяти процесса для автодополнения.
+
+Справочник небольшой (несколько тысяч строк), поэтому целиком живёт
+в памяти воркера, и поиск по `name` не ходит в БД. Порядок выдачи:
+начало названия → начало любого слова → подстрока → опечатки
+(кандидаты по триграммам, проверка расстоянием Дамерау–Левенштейна).
+"""
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from .catalog import catalog_version
+from .models import Ingredient
+
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Регистр и «ё» не важны: «Ёлка» == «елка»."""
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+def trigrams(word, closed=True):
+    """Триграммы как в pg_trgm; closed=False — для префикса слова."""
+    padded = f'  {word} ' if closed else f'  {word}'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def typo_limit(word):
+    """Сколько опечаток прощаем слову запроса."""
+    if len(word) < 4:
+        return 0
+    return 1 if len(word) <= 7 else 2
+
+
+def prefix_distance(query, word, limit):
+    """
+    Расстояние Дамерау–Левенштейна от query до ближайшего префикса word
+    с отсечкой: всё, что больше limit, — limit + 1.
+    """
+    word = word[:len(query) + limit]
+    prev2, prev = None, list(range(len(word) + 1))
+    for i, qc in enumerate(query, 1):
+        cur = [i] + [0] * len(word)
+        for j, wc in enumerate(word, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1,
+                         prev[j - 1] + (qc != wc))
+            if (i > 1 and j > 1 and qc == word[j - 2]
+                    and query[i - 2] == wc):
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return min(min(prev[max(len(query) - limit, 0):]), limit + 1)
+
+
+class IngredientIndex:
+    """Потокобезопасный индекс; перестраивается при смене версии."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+        self._version = None
+
+    # построение
+    def warm(self):
+        """Построить индекс заранее (при старте воркера)."""
+        try:
+            self._ensure()
+        except DatabaseError:
+            pass  # БД ещё не готова — построим на первом запросе
+
+    def _ensure(self):
+        # версия общая для всех воркеров: правка в одном процессе
+        # (или load_ingredients) перестраивает индекс во всех
+        version = catalog_version()
+        if self._version != version:
+            with self._lock:
+                if self._version != version:
+                    self._state = self._build()
+                    self._version = version
+        return self._state
+
+    @staticmethod
+    def _build():
+        rows = Ingredient.objects.order_by('name').values_list(
+            'id', 'name', 'measurement_unit')
+        entries, names, words, grams = [], [], [], {}
+        for pos, (pk, name, unit) in enumerate(rows):
+            norm = normalize(name)
+            entries.append({
+                'id': pk,
+                'name': name,
+                'measurement_unit': unit,
+                '_norm': norm,
+                '_words': WORD_RE.findall(norm),
+            })
+            names.append((norm, pos))
+            for word in entries[-1]['_words']:
+                words.append((word, pos))
+                for gram in trigrams(word):
+                    grams.setdefault(gram, set()).add(pos)
+        names.sort()
+        words.sort()
+        return entries, names, words, grams
+
+    # поиск
+    @staticmethod
+    def _prefix_range(pairs, prefix):
+        start = bisect_left(pairs, (prefix,))
+        for key, pos in pairs[start:]:
+            if not key.startswith(prefix):
+                break
+            yield pos
+
+    def _word_prefix(self, entries, words, query_words):
+        """Каждое слово запроса — начало какого-то слова названия."""
+        first, *rest = query_words
+        for pos in self._prefix_range(words, first):
+            entry_words = entries[pos]['_words']
+            if all(any(w.startswith(q) for w in entry_words) for q in rest):
+                yield pos
+
+    @staticmethod
+    def _fuzzy(entries, grams, query_words, seen):
+        """Опечатки: кандидаты по триграммам самого длинного слова."""
+        longest = max(query_words, key=len)
+        limit = typo_limit(longest)
+        if not limit:
+            return []
+        query_grams = trigrams(longest, closed=False)
+        # каждая правка портит не больше трёх триграмм
+        need = max(len(query_grams) - 3 * limit, 1)
+        candidates = Counter()
+        for gram in query_grams:
+            candidates.update(grams.get(gram, ()))
+        found = []
+        for pos, shared in candidates.items():
+            if shared < need or pos in seen:
+                continue
+            entry_words = entries[pos]['_words']
+            total = 0
+            for word in query_words:
+                word_limit = typo_limit(word)
+                distance = min(prefix_distance(word, w, word_limit)
+                               for w in entry_words)
+                if distance > word_limit:
+                    break
+                total += distance
+            else:
+                norm = entries[pos]['_norm']
+                found.append((total, len(norm), norm, pos))
+        return [pos for *_, pos in sorted(found)]
+
+    def search(self, query, limit=None):
+        """Ранжированные ингредиенты в формате IngredientSerializer."""
+        entries, names, words, grams = self._ensure()
+        limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+        query = normalize(query)
+        query_words = WORD_RE.findall(query)
+        if not query_words:
+            return []
+
+        def by_length(positions):
+            return sorted(set(positions), key=lambda pos: (
+                len(entries[pos]['_norm']), entries[pos]['_norm']))
+
+        result, seen = [], set()
+        tiers = (
+            lambda: by_length(self._prefix_range(names, query)),
+            lambda: by_length(self._word_prefix(entries, words, query_words)),
+            lambda: by_length(pos for pos, entry in enumerate(entries)
+                              if query in entry['_norm']),
+            lambda: self._fuzzy(entries, grams, query_words, seen),
+        )
+        for tier in tiers:
+            for pos in tier():
+                if pos not in seen:
+                    seen.add(pos)
+                    result.append(pos)
+            if len(result) >= limit:
+                break
+        return [
+            {key: entries[pos][key]
+             for key in ('id', 'name', 'measurement_unit')}
+            for pos in result[:limit]
+        ]
+
+
+ingredient_index = IngredientIndex()
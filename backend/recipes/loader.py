@@ -0,0 +1,218 @@
+"""
+Потоковая загрузка справочника ингредиентов (JSON и CSV).
+
+Файл читается по частям и не держится в памяти целиком: строки идут
+пачками по batch_size, каждая пачка — своя транзакция. Повторы внутри
+пачки схлопываются, уже известные пары (name, measurement_unit)
+не вставляются — поэтому «добавлено» и «пропущено» точные. На Postgres
+пачку можно залить через COPY во временную таблицу и перенести одним
+INSERT ... ON CONFLICT DO NOTHING.
+
+После каждой пачки позиция пишется в файл-контрольную точку: прерванную
+загрузку можно продолжить с места остановки (load_ingredients --resume).
+Повторная вставка безопасна, так что потеря последней отметки приведёт
+лишь к повторной проверке одной пачки.
+"""
+import csv
+import io
+import itertools
+import json
+import os
+from dataclasses import asdict, dataclass
+
+from django.db import connection, transaction
+
+from .models import Ingredient
+
+CHUNK_SIZE = 1 << 16
+# одна запись справочника крупнее — значит, файл битый
+MAX_ITEM_SIZE = 1 << 20
+NAME_LENGTH = Ingredient._meta.get_field('name').max_length
+UNIT_LENGTH = Ingredient._meta.get_field('measurement_unit').max_length
+CSV_HEADER = ('name', 'measurement_unit')
+
+
+@dataclass
+class LoadStats:
+    read: int = 0       # строк прочитано из файла (с учётом --resume)
+    inserted: int = 0
+    skipped: int = 0    # уже были в справочнике или повтор в файле
+    invalid: int = 0    # нет названия/единицы или не влезают в поля
+
+
+# чтение
+def _json_items(file):
+    """Элементы JSON-массива верхнего уровня по одному."""
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = file.read(CHUNK_SIZE)
+        buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+
+    def skip_space():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos:pos + 1]
+            fill()
+
+    fill()
+    if skip_space() != '[':
+        raise ValueError('ожидался JSON-массив')
+    pos += 1
+    if skip_space() == ']':
+        return
+    while True:
+        skip_space()  # raw_decode не пропускает пробелы перед значением
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            item, end = None, None
+        # значение разобрано, только если за ним что-то есть:
+        # иначе число или строка могли оборваться на границе куска
+        if end is None or (end == len(buffer) and not eof):
+            if len(buffer) - pos > MAX_ITEM_SIZE:
+                raise ValueError(f'запись длиннее {MAX_ITEM_SIZE} символов')
+            fill()
+            continue
+        pos = end
+        yield item
+        separator = skip_space()
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError(f'ожидалась «,» или «]», а не «{separator}»')
+        pos += 1
+
+
+def _csv_items(file):
+    rows = csv.reader(file)
+    first = next(rows, None)
+    if first is None:
+        return
+    if tuple(cell.strip() for cell in first) != CSV_HEADER:
+        yield first
+    yield from rows
+
+
+def read_items(file, fmt):
+    """Сырые записи файла: dict из JSON или список ячеек из CSV."""
+    return _json_items(file) if fmt == 'json' else _csv_items(file)
+
+
+def _key(item):
+    """(name, measurement_unit) или None, если запись негодная."""
+    if isinstance(item, dict):
+        name, unit = item.get('name'), item.get('measurement_unit')
+    elif isinstance(item, list) and len(item) >= 2:
+        name, unit = item[0], item[1]
+    else:
+        return None
+    if not isinstance(name, str) or not isinstance(unit, str):
+        return None
+    name, unit = name.strip(), unit.strip()
+    if not name or not unit or len(name) > NAME_LENGTH \
+            or len(unit) > UNIT_LENGTH:
+        return None
+    return name, unit
+
+
+# запись
+def _insert(keys):
+    """Вставить новые пары из keys; вернуть число вставленных."""
+    existing = set(
+        Ingredient.objects.filter(name__in={name for name, _ in keys})
+        .values_list('name', 'measurement_unit')
+    )
+    new = [Ingredient(name=name, measurement_unit=unit)
+           for name, unit in keys if (name, unit) not in existing]
+    # ignore_conflicts — на случай параллельной загрузки тех же строк
+    Ingredient.objects.bulk_create(new, ignore_conflicts=True)
+    return len(new)
+
+
+def _copy(keys):
+    """То же через COPY во временную таблицу (только Postgres)."""
+    table = connection.ops.quote_name(Ingredient._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMP TABLE IF NOT EXISTS ingredient_load '
+            f'(name varchar({NAME_LENGTH}), '
+            f'measurement_unit varchar({UNIT_LENGTH}))'
+        )
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(keys)
+        sql = ('COPY ingredient_load (name, measurement_unit) '
+               'FROM STDIN WITH (FORMAT csv)')
+        raw = cursor.cursor
+        if hasattr(raw, 'copy_expert'):  # psycopg2
+            buffer.seek(0)
+            raw.copy_expert(sql, buffer)
+        else:  # psycopg 3
+            with raw.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+        cursor.execute(
+            f'INSERT INTO {table} (name, measurement_unit) '
+            'SELECT name, measurement_unit FROM ingredient_load '
+            'ON CONFLICT (name, measurement_unit) DO NOTHING'
+        )
+        inserted = cursor.rowcount
+        cursor.execute('TRUNCATE ingredient_load')
+    return inserted
+
+
+def load(items, batch_size=1000, use_copy=False, stats=None,
+         on_batch=None):
+    """
+    Загрузить записи пачками; on_batch(stats) вызывается после
+    коммита каждой пачки. Возвращает LoadStats.
+    """
+    if use_copy and connection.vendor != 'postgresql':
+        raise ValueError('COPY доступен только на PostgreSQL')
+    stats = stats or LoadStats()
+    insert = _copy if use_copy else _insert
+    items = iter(items)
+    while batch := list(itertools.islice(items, batch_size)):
+        valid = [key for key in map(_key, batch) if key]
+        keys = list(dict.fromkeys(valid))  # без повторов, порядок файла
+        with transaction.atomic():
+            inserted = insert(keys) if keys else 0
+        stats.read += len(batch)
+        stats.invalid += len(batch) - len(valid)
+        stats.inserted += inserted
+        stats.skipped += len(valid) - inserted
+        if on_batch:
+            on_batch(stats)
+    return stats
+
+
+# контрольная точка
+def _fingerprint(path):
+    info = os.stat(path)
+    return {'source': os.path.abspath(path), 'size': info.st_size,
+            'mtime_ns': info.st_mtime_ns}
+
+
+def save_checkpoint(checkpoint, path, stats):
+    data = {**_fingerprint(path), **asdict(stats)}
+    temporary = f'{checkpoint}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump(data, file)
+    os.replace(temporary, checkpoint)  # атомарно: файл либо старый, либо новый
+
+
+def read_checkpoint(checkpoint, path):
+    """LoadStats с места остановки; ValueError — точка от другого файла."""
+    with open(checkpoint, encoding='utf-8') as file:
+        data = json.load(file)
+    if {key: data.get(key) for key in ('source', 'size', 'mtime_ns')} \
+            != _fingerprint(path):
+        raise ValueError('файл изменился после сохранения контрольной точки')
+    return LoadStats(**{field: data[field]
+                        for field in LoadStats.__dataclass_fields__})
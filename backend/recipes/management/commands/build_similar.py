@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from recipes import similarity
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает похожие рецепты (SimilarRecipe) и меряет время"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--changed", action="store_true",
+            help="только изменённые после прошлого расчёта и их соседи",
+        )
+        parser.add_argument(
+            "--recipe", type=int, action="append", dest="recipes",
+            help="id рецепта (можно несколько раз)",
+        )
+        parser.add_argument("--k", type=int, help="соседей у рецепта")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, changed=False, recipes=None, k=None,
+               batch_size=1000, **options):
+        stats = similarity.rebuild(
+            recipes, k=k, batch_size=batch_size, only_changed=changed)
+        total = stats["load"] + stats["compute"] + stats["write"]
+        speed = stats["recipes"] / total if total else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Рецептов: {stats['recipes']}, строк: {stats['rows']} "
+            f"за {total:.1f} с ({speed:.0f} рецептов/с): "
+            f"загрузка {stats['load']:.1f} с, расчёт "
+            f"{stats['compute']:.1f} с, запись {stats['write']:.1f} с."
+        ))
@@ -1,36 +1,138 @@
-
-import json
+import itertools
+import os
+import time
 from pathlib import Path
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from recipes import loader
+from recipes.catalog import bump_catalog_version
 
-from recipes.models import Ingredient
+# прогресс — не чаще раза в столько секунд
+PROGRESS_EVERY = 2.0
 
 
 class Command(BaseCommand):
-    help = "Импортирует ингредиенты из data/ingredients.json"
+    help = (
+        "Импортирует ингредиенты из JSON или CSV (по умолчанию "
+        "data/ingredients.json) потоково, пачками"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", nargs="?",
+            default=str(Path(settings.BASE_DIR) / "data" / "ingredients.json"),
+            help="файл со справочником",
+        )
+        parser.add_argument(
+            "--format", choices=("json", "csv"),
+            help="формат файла (по умолчанию — по расширению)",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="строк в одной пачке (транзакции)",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="посчитать, что добавится, и откатить",
+        )
+        parser.add_argument(
+            "--copy", action="store_true",
+            help="заливать пачки через COPY (только PostgreSQL)",
+        )
+        parser.add_argument(
+            "--resume", action="store_true",
+            help="продолжить с контрольной точки прерванной загрузки",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="файл контрольной точки (по умолчанию <файл>.checkpoint)",
+        )
 
     def handle(self, *args, **options):
-        file_path = Path(settings.BASE_DIR) / "data" / "ingredients.json"
+        path = Path(options["path"])
+        fmt = options["format"] or path.suffix.lstrip(".").lower()
+        if fmt not in ("json", "csv"):
+            raise CommandError(
+                f"Не удалось определить формат «{path.name}», "
+                "укажите --format."
+            )
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size должен быть положительным.")
+        dry_run = options["dry_run"]
+        checkpoint = options["checkpoint"] or f"{path}.checkpoint"
+        if dry_run and options["resume"]:
+            raise CommandError("--dry-run и --resume несовместимы.")
+        if options["copy"] and connection.vendor != "postgresql":
+            raise CommandError("--copy доступен только на PostgreSQL.")
 
+        stats = loader.LoadStats()
+        if options["resume"] and os.path.exists(checkpoint):
+            try:
+                stats = loader.read_checkpoint(checkpoint, path)
+            except (OSError, ValueError, KeyError) as exc:
+                raise CommandError(
+                    f"Контрольная точка «{checkpoint}» не подходит: {exc}. "
+                    "Удалите её, чтобы начать заново."
+                ) from exc
+            self.stdout.write(f"Продолжаем со строки {stats.read + 1}.")
         try:
-            with file_path.open(encoding="utf-8") as fp:
-                raw = json.load(fp)
+            with path.open(encoding="utf-8-sig", newline="") as fp:
+                items = itertools.islice(
+                    loader.read_items(fp, fmt), stats.read, None)
+                self.started = self.reported = time.monotonic()
+                self.start_read = stats.read
+                if dry_run:
+                    # всё в одной транзакции, которая откатывается, —
+                    # счётчики точные и без лишней памяти на повторы
+                    with transaction.atomic():
+                        self._load(items, options, stats)
+                        transaction.set_rollback(True)
+                else:
+                    self._load(items, options, stats, checkpoint, path)
+        except Exception as exc:
+            resumable = not dry_run and os.path.exists(checkpoint)
+            raise CommandError(
+                f"Импорт из «{path.name}» прерван после {stats.read} "
+                f"строк: {exc}"
+                + (" Продолжить: --resume." if resumable else "")
+            ) from exc
+        finally:
+            # bulk-вставки не шлют сигналов — версию меняем сами
+            if stats.inserted and not dry_run:
+                bump_catalog_version()
 
-            created = Ingredient.objects.bulk_create(
-                (Ingredient(**item) for item in raw),
-                ignore_conflicts=True,
-            )
+        if os.path.exists(checkpoint) and not dry_run:
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            ("Проверка без записи" if dry_run else "Импорт завершён")
+            + f": добавлено {stats.inserted}, пропущено {stats.skipped}, "
+            f"ошибочных строк {stats.invalid} ({self._rate(stats)})."
+        ))
 
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f"Импорт завершён: добавлено {len(created)}, "
-                    f"пропущено {len(raw) - len(created)}."
+    def _load(self, items, options, stats, checkpoint=None, path=None):
+        def on_batch(stats):
+            if checkpoint:
+                loader.save_checkpoint(checkpoint, path, stats)
+            now = time.monotonic()
+            if now - self.reported >= PROGRESS_EVERY:
+                self.reported = now
+                self.stdout.write(
+                    f"… {stats.read} строк, добавлено {stats.inserted} "
+                    f"({self._rate(stats)})"
                 )
-            )
 
-        except Exception as exc:
-            raise CommandError(
-                f"Импорт из «{file_path.name}» прерван: {exc}"
-            ) from exc
+        loader.load(
+            items,
+            batch_size=options["batch_size"],
+            use_copy=options["copy"],
+            stats=stats,
+            on_batch=on_batch,
+        )
+
+    def _rate(self, stats):
+        elapsed = time.monotonic() - self.started
+        rows = stats.read - self.start_read
+        return f"{rows / elapsed:.0f} строк/с" if elapsed else "—"
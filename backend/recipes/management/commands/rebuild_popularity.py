@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from recipes import popularity
+
+
+class Command(BaseCommand):
+    help = ("Пересчитывает популярность рецептов по истории избранного "
+            "и корзин")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, batch_size=1000, **options):
+        rows = popularity.rebuild(batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано рецептов: {rows}."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from recipes import search
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает векторы полнотекстового поиска рецептов (Postgres)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--missing", action="store_true",
+            help="только рецепты без вектора",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, missing=False, batch_size=1000, **options):
+        if connection.vendor != "postgresql":
+            self.stdout.write(self.style.WARNING(
+                "Вектор поиска есть только на PostgreSQL — пропускаю."))
+            return
+        recipes = Recipe.objects.all()
+        if missing:
+            recipes = recipes.filter(search_vector__isnull=True)
+        rows = search.rebuild(recipes, batch_size)
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано рецептов: {rows}."))
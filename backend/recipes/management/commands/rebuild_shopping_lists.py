@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from recipes import shopping_list
+
+
+class Command(BaseCommand):
+    help = "Пересобирает или сверяет готовые списки покупок (ShoppingListItem)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify", action="store_true",
+            help="только сравнить с корзинами, ничего не менять",
+        )
+        parser.add_argument(
+            "--user", type=int, action="append", dest="users",
+            help="id пользователя (можно несколько раз)",
+        )
+
+    def handle(self, *args, verify=False, users=None, **options):
+        drift = shopping_list.drift(users)
+        if drift:
+            self.stdout.write(self.style.WARNING(
+                f"Расхождения у {len(drift)} пользователей, "
+                f"строк: {sum(drift.values())}."
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS("Расхождений нет."))
+        if verify or not drift:
+            return
+
+        rows = shopping_list.rebuild(list(drift))
+        self.stdout.write(self.style.SUCCESS(
+            f"Пересобрано: пользователей {len(drift)}, строк {rows}."
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from recipes import counters
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает разошедшиеся счётчики рецептов и пользователей"
+
+    def handle(self, *args, **options):
+        fixed = counters.reconcile()
+        for field, rows in fixed.items():
+            self.stdout.write(f"{field}: исправлено {rows}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово, всего исправлено строк: {sum(fixed.values())}."
+        ))
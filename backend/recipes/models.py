@@ -1,6 +1,8 @@
 # recipes/models.py
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.utils import timezone
 
 User = settings.AUTH_USER_MODEL
 
@@ -16,6 +18,8 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
         related_name="in_carts",
     )
+    # время — для затухания популярности рецепта (recipes.popularity)
+    created_at = models.DateTimeField("Добавлено", default=timezone.now)
 
     class Meta:
         constraints = [
@@ -63,6 +67,10 @@ class Recipe(models.Model):
     )
     name = models.CharField("Название", max_length=256)           
     image = models.ImageField("Фото блюда", upload_to="recipes/images/")
+    # уменьшенные копии строит recipes.images после сохранения
+    image_variants = models.JSONField(
+        "Варианты фото", default=dict, blank=True, editable=False,
+    )
     text = models.TextField("Описание")
     cooking_time = models.PositiveSmallIntegerField(
         "Время приготовления, мин",
@@ -74,9 +82,32 @@ class Recipe(models.Model):
         related_name="+",              
     )
     pub_date = models.DateTimeField("Дата публикации", auto_now_add=True)
+    # меняется при любой правке того, что видно в карточке рецепта:
+    # сам рецепт, его ингредиенты, счётчик избранного, профиль автора,
+    # названия продуктов — по нему отвечает Last-Modified
+    updated_at = models.DateTimeField("Дата изменения", auto_now=True)
+    # счётчики поддерживает recipes.counters, чинит reconcile_counters
+    favorites_count = models.PositiveIntegerField(
+        "В избранном", default=0, editable=False,
+    )
+    carts_count = models.PositiveIntegerField(
+        "В корзинах", default=0, editable=False,
+    )
+    # логарифм затухающей суммы публикации, избранного и корзин
+    # (recipes.popularity) — порядок ?ordering=popular
+    popularity = models.FloatField("Популярность", default=0, editable=False)
+    # название, продукты и описание для ?search= (recipes.search);
+    # на Postgres заполняется после сохранения, на SQLite пустой
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
-        ordering = ("-pub_date",)
+        # id — чтобы порядок был однозначным (курсорная пагинация)
+        ordering = ("-pub_date", "-id")
+        indexes = [
+            models.Index(fields=["-pub_date", "-id"], name="recipe_feed_idx"),
+            models.Index(fields=["-popularity", "-id"],
+                         name="recipe_popular_idx"),
+        ]
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
 
@@ -122,6 +153,7 @@ class Favorite(models.Model):
         on_delete=models.CASCADE,
         related_name="favorites",
     )
+    created_at = models.DateTimeField("Добавлено", default=timezone.now)
 
     class Meta:
         constraints = [
@@ -135,3 +167,72 @@ class Favorite(models.Model):
 
     def __str__(self) -> str:
         return f"{self.user} → {self.recipe}"
+
+
+class ShoppingListItem(models.Model):
+    """
+    Готовая строка списка покупок: сумма продукта по всем рецептам
+    корзины пользователя. Поддерживается инкрементально
+    (recipes.shopping_list), пересобирается rebuild_shopping_lists.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="shopping_list",
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    total = models.PositiveIntegerField("Количество", default=0)
+    recipes_count = models.PositiveIntegerField("Рецептов", default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("user", "ingredient"),
+                name="unique_shopping_list_item",
+            ),
+        ]
+        verbose_name = "Строка списка покупок"
+        verbose_name_plural = "Строки списков покупок"
+
+    def __str__(self) -> str:
+        return f"{self.user}: {self.ingredient} – {self.total}"
+
+
+class SimilarRecipe(models.Model):
+    """
+    Похожий рецепт: top-K соседей по составу и общему избранному.
+    Считается заранее (recipes.similarity, manage.py build_similar).
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="neighbors",
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="similar_to",
+    )
+    score = models.FloatField("Сходство")
+    computed_at = models.DateTimeField("Рассчитано", db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("recipe", "similar"),
+                name="unique_similar_recipe",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=("recipe", "-score"),
+                         name="similar_recipe_score_idx"),
+        ]
+        verbose_name = "Похожий рецепт"
+        verbose_name_plural = "Похожие рецепты"
+
+    def __str__(self) -> str:
+        return f"{self.recipe} ~ {self.similar} ({self.score:.2f})"
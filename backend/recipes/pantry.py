@@ -0,0 +1,327 @@
+"""
+«Что приготовить из того, что есть»: обратный индекс продукт → рецепты.
+
+Индекс живёт в памяти воркера. У рецепта — позиция (по порядку id,
+новые — в конец), у продукта — позиции его рецептов: у частых битовой
+маской (int), у редких отсортированным array('q') — что компактнее.
+Число продуктов рецепта тоже хранится масками, по одной на разряд.
+
+Подбор не перебирает рецепты по одному: совпадения считаются
+поразрядным сложением масок продуктов из запроса, недостающие —
+вычитанием совпадений из числа продуктов рецепта; на каждое «не хватает
+d» — своя маска. Длина выдачи — число единиц в масках, страница
+достаёт из них только свои позиции.
+
+Свежесть: правка состава (RecipeWriteSerializer, админка, удаление
+рецепта) после коммита сразу применяется к индексу своего процесса
+и пишется в журнал в общем кэше. Номер записи — cache.incr, но
+атомарен он не везде (у FileBasedCache это get + set, два воркера
+могут получить один номер), поэтому номер ещё и занимается
+cache.add() ключа записи: занят — берём следующий. Другие воркеры
+на следующем запросе догоняют журнал; если записи вытеснены или
+отставание больше PANTRY_JOURNAL_SIZE — строят индекс заново.
+Удаление продукта и массовая загрузка — reset().
+"""
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+
+from .models import RecipeIngredient
+
+SEQUENCE_KEY = 'recipes:pantry:sequence'
+CHANGE_KEY = 'recipes:pantry:change:{}'
+JOURNAL_TIMEOUT = 60 * 60 * 24
+PUBLISH_ATTEMPTS = 10
+CHUNK_SIZE = 5000
+
+NONZERO = re.compile(rb'[^\x00]')
+# номера единичных битов байта — от старшего к младшему
+BITS = [tuple(bit for bit in range(7, -1, -1) if byte >> bit & 1)
+        for byte in range(256)]
+
+
+# битовые маски
+def _mask(positions):
+    """Маска из отсортированных позиций — без сдвигов огромных int."""
+    if not positions:
+        return 0
+    buf = bytearray(positions[-1] // 8 + 1)
+    for position in positions:
+        buf[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buf, 'little')
+
+
+def _positions(mask):
+    """Позиции единиц mask от старших к младшим, лениво."""
+    raw = mask.to_bytes((mask.bit_length() + 7) // 8, 'big')
+    top = len(raw) - 1
+    for match in NONZERO.finditer(raw):
+        base = (top - match.start()) * 8
+        for bit in BITS[match.group()[0]]:
+            yield base + bit
+
+
+def _add(digits, mask):
+    """Прибавить 1 в позициях mask к числам, записанным разрядами."""
+    digits, carry = list(digits), mask
+    for index, digit in enumerate(digits):
+        if not carry:
+            break
+        digits[index], carry = digit ^ carry, digit & carry
+    if carry:
+        digits.append(carry)
+    return digits
+
+
+def _subtract(minuend, subtrahend):
+    """Разность чисел, записанных разрядами (уменьшаемое не меньше)."""
+    result, borrow = [], 0
+    for index in range(max(len(minuend), len(subtrahend))):
+        x = minuend[index] if index < len(minuend) else 0
+        y = subtrahend[index] if index < len(subtrahend) else 0
+        result.append(x ^ y ^ borrow)
+        borrow = (~x & y) | (~(x ^ y) & borrow)
+    return result
+
+
+def _equal(digits, value):
+    """Маска позиций, где число равно value (-1 — «все»)."""
+    if value >> len(digits):
+        return 0
+    mask = -1
+    for index, digit in enumerate(digits):
+        mask &= digit if value >> index & 1 else ~digit
+    return mask
+
+
+class Ranking:
+    """
+    Выдача подбора: (id рецепта, сколько продуктов не хватает).
+    len() — без перебора, срез (только срез) достаёт лишь свои
+    позиции; годится Paginator'у вместо queryset.
+    """
+
+    def __init__(self, ids, buckets):
+        self._ids = ids
+        self._buckets = [(missing, mask, mask.bit_count())
+                         for missing, mask in enumerate(buckets)]
+
+    def __len__(self):
+        return sum(count for *_, count in self._buckets)
+
+    def __getitem__(self, index):
+        start, stop, _ = index.indices(len(self))
+        result = []
+        for missing, mask, count in self._buckets:
+            if start < count and stop > 0:
+                result.extend(
+                    (self._ids[position], missing)
+                    for position in islice(
+                        _positions(mask), max(start, 0), stop))
+            start, stop = start - count, stop - count
+        return result
+
+
+@dataclass(frozen=True)
+class _State:
+    ids: array        # позиция -> id рецепта; только дописывается
+    postings: dict    # продукт -> маска или array позиций
+    sizes: list       # разряды числа продуктов рецепта
+
+
+# журнал правок в общем кэше
+def _sequence():
+    """Номер последней правки (счётчик создаётся при первом обращении)."""
+    sequence = cache.get(SEQUENCE_KEY)
+    if sequence is None:
+        # старт со времени: пересозданный счётчик не совпадёт со старым
+        cache.add(SEQUENCE_KEY, time.time_ns(), None)
+        sequence = cache.get(SEQUENCE_KEY)
+    return sequence
+
+
+def _publish(recipe_id, old, new):
+    pantry_index.apply(recipe_id, old, new)
+    for _ in range(PUBLISH_ATTEMPTS):
+        try:
+            sequence = cache.incr(SEQUENCE_KEY)
+        except ValueError:
+            _sequence()  # счётчика не было: новый номер — перестройка у всех
+            return
+        if cache.add(CHANGE_KEY.format(sequence), (recipe_id, old, new),
+                     JOURNAL_TIMEOUT):
+            return
+    reset()  # номера всё время заняты — журналу не доверяем
+
+
+def recipe_changed(recipe_id, old, new):
+    """Состав рецепта изменился: old/new — id продуктов (или словари)."""
+    old, new = frozenset(old), frozenset(new)
+    if old != new:
+        transaction.on_commit(lambda: _publish(recipe_id, old, new))
+
+
+def reset():
+    """Индекс устарел целиком — перестроить во всех воркерах."""
+    cache.set(SEQUENCE_KEY, time.time_ns(), None)
+    pantry_index.clear()
+
+
+class PantryIndex:
+    """Потокобезопасный индекс: запись — под замком, чтение — снимок."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+        self._sequence = None
+
+    # построение
+    def warm(self):
+        """Построить индекс заранее (при старте воркера)."""
+        try:
+            self._ensure()
+        except DatabaseError:
+            pass  # БД ещё не готова — построим на первом запросе
+
+    def clear(self):
+        with self._lock:
+            self._state = None
+
+    def _ensure(self):
+        sequence = _sequence()
+        if self._state is None or self._sequence != sequence:
+            with self._lock:
+                if self._state is None or self._sequence != sequence:
+                    self._catch_up(sequence)
+                    self._sequence = sequence
+        return self._state
+
+    def _catch_up(self, sequence):
+        """Применить пропущенные правки журнала или построить заново."""
+        behind = None
+        if self._state is not None and None not in (sequence,
+                                                    self._sequence):
+            behind = sequence - self._sequence
+        if behind is not None and 0 < behind <= settings.PANTRY_JOURNAL_SIZE:
+            keys = [CHANGE_KEY.format(number)
+                    for number in range(self._sequence + 1, sequence + 1)]
+            changes = cache.get_many(keys)
+            if len(changes) == len(keys):
+                for key in keys:
+                    self._apply(*changes[key])
+                return
+        # номер прочитан до построения: правки, закоммиченные во время
+        # него, придут журналом ещё раз — применение идемпотентно
+        self._state = self._build()
+
+    @staticmethod
+    def _build():
+        ids, counts, lists = array('q'), [], {}
+        rows = RecipeIngredient.objects.order_by('recipe_id').values_list(
+            'recipe_id', 'ingredient_id')
+        for recipe_id, ingredient_id in rows.iterator(chunk_size=CHUNK_SIZE):
+            if not ids or ids[-1] != recipe_id:
+                ids.append(recipe_id)
+                counts.append(0)
+            counts[-1] += 1
+            lists.setdefault(ingredient_id, array('q')).append(len(ids) - 1)
+        # маска — len(ids) бит, массив — 64 бита на рецепт
+        postings = {
+            pk: _mask(positions) if len(positions) * 64 >= len(ids)
+            else positions
+            for pk, positions in lists.items()
+        }
+        sizes = [
+            _mask([position for position, count in enumerate(counts)
+                   if count >> digit & 1])
+            for digit in range(max(counts, default=0).bit_length())
+        ]
+        return _State(ids, postings, sizes)
+
+    # правки
+    def apply(self, recipe_id, old, new):
+        """Правка своего процесса — сразу, не дожидаясь журнала."""
+        with self._lock:
+            if self._state is not None:
+                self._apply(recipe_id, old, new)
+
+    def _apply(self, recipe_id, old, new):
+        state = self._state
+        position = self._position(state.ids, recipe_id)
+        if position is None:
+            if not new:
+                return
+            position = len(state.ids)
+            state.ids.append(recipe_id)
+        bit = 1 << position
+        # новый снимок целиком: читатели видят либо старый, либо новый
+        postings = dict(state.postings)
+        for pk in old - new:
+            postings[pk] = self._without(postings.get(pk, 0), position)
+        for pk in new - old:
+            postings[pk] = self._with(postings.get(pk, 0), position)
+        size = len(new)
+        sizes = list(state.sizes)
+        sizes.extend([0] * (size.bit_length() - len(sizes)))
+        sizes = [digit | bit if size >> index & 1 else digit & ~bit
+                 for index, digit in enumerate(sizes)]
+        self._state = _State(state.ids, postings, sizes)
+
+    @staticmethod
+    def _position(ids, recipe_id):
+        position = bisect_left(ids, recipe_id)
+        if position < len(ids) and ids[position] == recipe_id:
+            return position
+        try:  # рецепт, закоммиченный позже следующего по id
+            return ids.index(recipe_id)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _with(posting, position):
+        if isinstance(posting, int):
+            return posting | 1 << position
+        positions = array('q', posting)
+        index = bisect_left(positions, position)
+        if index == len(positions) or positions[index] != position:
+            positions.insert(index, position)
+        return positions
+
+    @staticmethod
+    def _without(posting, position):
+        if isinstance(posting, int):
+            return posting & ~(1 << position)
+        positions = array('q', posting)
+        index = bisect_left(positions, position)
+        if index < len(positions) and positions[index] == position:
+            del positions[index]
+        return positions
+
+    # подбор
+    def match(self, ingredient_ids, max_missing):
+        """
+        Рецепты хотя бы с одним продуктом из ingredient_ids, которым
+        не хватает не больше max_missing: сначала готовые полностью,
+        дальше — по числу недостающих, при равенстве — новые раньше.
+        """
+        state = self._ensure()
+        found, hits = 0, []
+        for pk in set(ingredient_ids):
+            posting = state.postings.get(pk, 0)
+            mask = posting if isinstance(posting, int) else _mask(posting)
+            found |= mask
+            hits = _add(hits, mask)
+        missing = _subtract(state.sizes, hits)
+        return Ranking(state.ids, [found & _equal(missing, count)
+                                   for count in range(max_missing + 1)])
+
+
+pantry_index = PantryIndex()
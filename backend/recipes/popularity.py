@@ -0,0 +1,125 @@
+"""
+Популярность рецепта для ?ordering=popular: избранное и корзины
+с затуханием по времени.
+
+Вклад события весом w, случившегося в момент t, к моменту now —
+w · 2^(-(now - t) / POPULARITY_HALF_LIFE_DAYS). Множитель 2^(-now / ...)
+у всех рецептов общий, поэтому для порядка достаточно хранить
+log Σ w · 2^((t - EPOCH) / half_life): значение не стареет, и пересчитывать
+его по расписанию не нужно. Логарифм — потому что сама сумма за
+пару десятков лет переполнила бы float.
+
+Добавление события — p' = log(e^p + e^x), удаление — log(e^p - e^x), где
+x — вклад события на момент его добавления (created_at строки). Оба
+считаются в том же UPDATE, что и счётчики (recipes.counters), —
+атомарно на стороне БД. Публикация — такое же событие весом
+PUBLISHED_WEIGHT: новый рецепт не падает в конец выдачи, и сумма
+никогда не пустеет.
+
+Если после удаления остаётся меньше доли MIN_SHARE суммы (убрали
+единственное свежее событие «остывшего» рецепта), вычитание
+в логарифмах теряет точность: UPDATE пишет метку LOST, и такие рецепты
+тут же, в той же транзакции, пересчитываются по истории (settle()).
+Целиком по истории считает rebuild() (manage.py rebuild_popularity) —
+его нужно запустить после смены POPULARITY_HALF_LIFE_DAYS.
+"""
+import math
+from collections import defaultdict
+from datetime import UTC, datetime
+
+from django.conf import settings
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+from django.db.models.lookups import LessThan
+
+from .models import Favorite, Recipe, ShoppingCart
+
+EPOCH = datetime(2025, 1, 1, tzinfo=UTC)
+# корзина — намерение приготовить — весит больше избранного
+WEIGHTS = {Favorite: 1.0, ShoppingCart: 2.0}
+PUBLISHED_WEIGHT = 1.0
+MIN_SHARE = 1e-6
+LOST = -1e300
+# exp() меньше этого Postgres считает ошибкой (underflow)
+MIN_EXPONENT = -700.0
+CHUNK_SIZE = 1000
+
+
+def _term(weight, at):
+    """Логарифм вклада события весом weight в момент at."""
+    half_life = settings.POPULARITY_HALF_LIFE_DAYS * 86400
+    return math.log(weight) + (
+        (at - EPOCH).total_seconds() / half_life * math.log(2))
+
+
+def _exp(expression):
+    return Exp(Greatest(expression, Value(MIN_EXPONENT)))
+
+
+def published(at):
+    """Популярность только что опубликованного рецепта."""
+    return _term(PUBLISHED_WEIGHT, at)
+
+
+def added(model, at):
+    """Выражение для Recipe.popularity: добавили в избранное/корзину в at."""
+    value, term = F('popularity'), Value(_term(WEIGHTS[model], at))
+    return Greatest(value, term) + Ln(
+        Value(1.0) + _exp(-Abs(value - term)))
+
+
+def removed(model, times):
+    """
+    Выражение для Recipe.popularity: убрали из избранного/корзины;
+    times — {id рецепта: created_at убранной строки}.
+    """
+    value = F('popularity')
+    term = Case(
+        *(When(pk=pk, then=Value(_term(WEIGHTS[model], at)))
+          for pk, at in times.items()),
+        output_field=FloatField(),
+    )
+    share = Value(1.0) - _exp(term - value)  # что остаётся от суммы
+    return Case(
+        When(LessThan(share, Value(MIN_SHARE)), then=Value(LOST)),
+        default=value + Ln(share),
+        output_field=FloatField(),
+    )
+
+
+def settle(recipe_ids):
+    """После removed(): пересчитать по истории рецепты с меткой LOST."""
+    lost = list(Recipe.objects.filter(
+        pk__in=recipe_ids, popularity=LOST).values_list('pk', flat=True))
+    if lost:
+        rebuild(lost)
+
+
+# пересчёт по истории
+def _log_sum(terms):
+    top = max(terms)
+    return top + math.log(sum(math.exp(term - top) for term in terms))
+
+
+def rebuild(recipe_ids=None, batch_size=CHUNK_SIZE):
+    """Пересчитать популярность по истории пачками; вернуть число рецептов."""
+    recipes = Recipe.objects.order_by('pk')
+    if recipe_ids is not None:
+        recipes = recipes.filter(pk__in=recipe_ids)
+    ids = list(recipes.values_list('pk', flat=True))
+    for start in range(0, len(ids), batch_size):
+        block = ids[start:start + batch_size]
+        terms = defaultdict(list)
+        for pk, at in Recipe.objects.filter(pk__in=block).values_list(
+                'pk', 'pub_date'):
+            terms[pk].append(published(at))
+        for model, weight in WEIGHTS.items():
+            rows = model.objects.filter(recipe_id__in=block)
+            for pk, at in rows.values_list('recipe_id', 'created_at'):
+                terms[pk].append(_term(weight, at))
+        Recipe.objects.bulk_update(
+            [Recipe(pk=pk, popularity=_log_sum(values))
+             for pk, values in terms.items()],
+            ['popularity'],
+        )
+    return len(ids)
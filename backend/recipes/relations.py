@@ -0,0 +1,150 @@
+"""
+Избранное и корзина: добавление и удаление пачкой.
+
+Строки меняются одним оператором — INSERT ... ON CONFLICT DO NOTHING
+RETURNING и DELETE ... RETURNING отдают ровно те рецепты, что добавил
+или убрал этот вызов. По ним в той же транзакции сдвигаются счётчики
+и популярность (recipes.counters, recipes.popularity) и список покупок
+(recipes.shopping_list): повтор или параллельный запрос того же
+пользователя ничего не посчитает дважды. Несуществующие рецепты
+отсекает сам INSERT ... SELECT.
+
+Без RETURNING (SQLite старше 3.35) — выборка уже добавленных,
+bulk_create(ignore_conflicts=True) и DELETE по списку.
+
+Строки меняются в обход save()/delete() — сигналов у Favorite
+и ShoppingCart нет. Строку, сохранённую или удалённую через ORM
+(админка), надо провести через row_added()/row_removed().
+"""
+from datetime import UTC, datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import counters, popularity, shopping_list
+from .models import Recipe, ShoppingCart
+
+
+def _names(model):
+    quote = connection.ops.quote_name
+    return (
+        quote(model._meta.db_table),
+        quote(model._meta.get_field('user').column),
+        quote(model._meta.get_field('recipe').column),
+        quote(model._meta.get_field('created_at').column),
+    )
+
+
+def _datetime(value):
+    """created_at из RETURNING: SQLite отдаёт строку в UTC."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value if timezone.is_aware(value) else value.replace(tzinfo=UTC)
+
+
+def _insert(model, user_id, recipe_ids, now):
+    """Вставить недостающие пары; вернуть id добавленных рецептов."""
+    if not connection.features.can_return_columns_from_insert:
+        existing = set(model.objects.filter(
+            user_id=user_id, recipe_id__in=recipe_ids,
+        ).values_list('recipe_id', flat=True))
+        new = set(Recipe.objects.filter(pk__in=recipe_ids).exclude(
+            pk__in=existing).values_list('pk', flat=True))
+        model.objects.bulk_create(
+            (model(user_id=user_id, recipe_id=pk, created_at=now)
+             for pk in new),
+            ignore_conflicts=True,
+        )
+        return new
+    table, user, recipe, created = _names(model)
+    quote = connection.ops.quote_name
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({user}, {recipe}, {created}) '
+            f'SELECT %s, {quote(Recipe._meta.pk.column)}, %s '
+            f'FROM {quote(Recipe._meta.db_table)} '
+            f'WHERE {quote(Recipe._meta.pk.column)} IN ({placeholders}) '
+            f'ON CONFLICT ({user}, {recipe}) DO NOTHING '
+            f'RETURNING {recipe}',
+            [user_id, connection.ops.adapt_datetimefield_value(now),
+             *recipe_ids],
+        )
+        return {pk for pk, in cursor.fetchall()}
+
+
+def _delete(model, user_id, recipe_ids):
+    """Удалить пары; вернуть {id рецепта: когда был добавлен}."""
+    if not connection.features.can_return_columns_from_insert:
+        rows = model.objects.filter(
+            user_id=user_id, recipe_id__in=recipe_ids)
+        removed = dict(rows.values_list('recipe_id', 'created_at'))
+        rows.filter(recipe_id__in=removed).delete()
+        return removed
+    table, user, recipe, created = _names(model)
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} '
+            f'WHERE {user} = %s AND {recipe} IN ({placeholders}) '
+            f'RETURNING {recipe}, {created}',
+            [user_id, *recipe_ids],
+        )
+        return {pk: _datetime(at) for pk, at in cursor.fetchall()}
+
+
+# savepoint=False: внутри транзакции представления — без лишних
+# SAVEPOINT/RELEASE
+def add(model, user, recipe_ids):
+    """Добавить рецепты в избранное/корзину; вернуть добавленные."""
+    recipe_ids = set(recipe_ids)
+    if not recipe_ids:
+        return set()
+    now = timezone.now()
+    with transaction.atomic(savepoint=False):
+        added = _insert(model, user.pk, recipe_ids, now)
+        if added:
+            counters.relation_changed(
+                model, added, 1, popularity.added(model, now))
+            if model is ShoppingCart:
+                shopping_list.carts_added(user, added)
+    return added
+
+
+def remove(model, user, recipe_ids):
+    """Убрать рецепты из избранного/корзины; вернуть убранные."""
+    recipe_ids = set(recipe_ids)
+    if not recipe_ids:
+        return set()
+    with transaction.atomic(savepoint=False):
+        removed = _delete(model, user.pk, recipe_ids)
+        if removed:
+            counters.relation_changed(
+                model, removed, -1, popularity.removed(model, removed))
+            popularity.settle(removed)
+            if model is ShoppingCart:
+                shopping_list.carts_removed(user, set(removed))
+    return set(removed)
+
+
+# строки, записанные через ORM (админка)
+def row_added(row):
+    """Строка избранного/корзины сохранена save(): то же, что add()."""
+    model = type(row)
+    with transaction.atomic(savepoint=False):
+        counters.relation_changed(
+            model, [row.recipe_id], 1, popularity.added(model, row.created_at))
+        if model is ShoppingCart:
+            shopping_list.cart_added(row.user, row.recipe)
+
+
+def row_removed(row):
+    """Строка удалена delete() (уже после удаления): то же, что remove()."""
+    model = type(row)
+    with transaction.atomic(savepoint=False):
+        counters.relation_changed(
+            model, [row.recipe_id], -1,
+            popularity.removed(model, {row.recipe_id: row.created_at}))
+        popularity.settle([row.recipe_id])
+        if model is ShoppingCart:
+            shopping_list.cart_removed(row.user, row.recipe)
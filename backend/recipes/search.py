@@ -0,0 +1,123 @@
+"""
+Поиск рецептов по названию, продуктам и описанию (?search=).
+
+На Postgres — полнотекстовый поиск (конфигурация russian) по готовому
+вектору Recipe.search_vector: название с весом A, названия продуктов —
+B, описание — C. Опечатки в названии ловит pg_trgm: оператор <%
+(порог — RECIPE_SEARCH_SIMILARITY). Оба условия идут по GIN-индексам,
+порядок — ts_rank, затем сходство названия.
+
+Вектор пересчитывается после коммита сохранения рецепта (его
+ингредиенты к этому моменту уже записаны) и переименования продукта
+(recipes.signals); массовая загрузка и правка в обход ORM —
+manage.py rebuild_search. Расширение и индексы создаёт install() после
+migrate: миграции в репозитории генерируются при деплое.
+
+На других БД (SQLite в тестах) — icontains по тем же полям
+с ранжированием «название > продукт > описание»; регистр там
+не учитывается только у латиницы.
+"""
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity,
+)
+from django.db import connection
+from django.db.models import (
+    Case, F, FloatField, OuterRef, Q, Subquery, TextField, Value, When,
+)
+from django.db.models.functions import Cast, Coalesce
+
+from .models import Recipe, RecipeIngredient
+
+CONFIG = 'russian'
+# длиннее — обрезается: и tsquery, и триграммы растут с длиной запроса
+MAX_LENGTH = 100
+CHUNK_SIZE = 1000
+
+INDEXES = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS recipe_search_idx '
+    'ON {table} USING gin (search_vector)',
+    'CREATE INDEX IF NOT EXISTS recipe_name_trgm_idx '
+    'ON {table} USING gin (name gin_trgm_ops)',
+)
+
+
+def _enabled():
+    return connection.vendor == 'postgresql'
+
+
+# вектор
+def _document():
+    names = Subquery(
+        RecipeIngredient.objects.filter(recipe=OuterRef('pk'))
+        .order_by()
+        .values('recipe')
+        .annotate(names=StringAgg('ingredient__name', ' '))
+        .values('names'),
+        output_field=TextField(),
+    )
+    return (
+        SearchVector('name', weight='A', config=CONFIG)
+        + SearchVector(Coalesce(names, Value('')), weight='B', config=CONFIG)
+        + SearchVector('text', weight='C', config=CONFIG)
+    )
+
+
+def refresh(recipes):
+    """Пересчитать вектор у рецептов queryset одним UPDATE."""
+    if not _enabled():
+        return 0
+    return recipes.update(search_vector=_document())
+
+
+def rebuild(recipes=None, batch_size=CHUNK_SIZE):
+    """Пересчитать векторы пачками по pk; возвращает число рецептов."""
+    if not _enabled():
+        return 0
+    recipes = Recipe.objects.all() if recipes is None else recipes
+    ids = list(recipes.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(ids), batch_size):
+        refresh(Recipe.objects.filter(pk__in=ids[start:start + batch_size]))
+    return len(ids)
+
+
+def install(**kwargs):
+    """post_migrate: pg_trgm, GIN-индексы и векторы новых строк."""
+    if not _enabled():
+        return
+    table = connection.ops.quote_name(Recipe._meta.db_table)
+    with connection.cursor() as cursor:
+        for sql in INDEXES:
+            cursor.execute(sql.format(table=table))
+    rebuild(Recipe.objects.filter(search_vector__isnull=True))
+
+
+# поиск
+def apply(queryset, term):
+    """Рецепты queryset, подходящие под term, — самые релевантные первыми."""
+    term = term.strip()[:MAX_LENGTH]
+    if not term:
+        return queryset
+    ordering = queryset.query.order_by or Recipe._meta.ordering
+    if _enabled():
+        query = SearchQuery(term, config=CONFIG, search_type='websearch')
+        return queryset.filter(
+            Q(search_vector=query) | Q(name__trigram_word_similar=term),
+        ).annotate(
+            # real -> double: значение из курсора должно совпасть точно
+            rank=Cast(SearchRank(F('search_vector'), query), FloatField()),
+            similarity=Cast(TrigramWordSimilarity(term, 'name'), FloatField()),
+        ).order_by('-rank', '-similarity', *ordering)
+
+    in_ingredients = Q(pk__in=RecipeIngredient.objects.filter(
+        ingredient__name__icontains=term).values('recipe_id'))
+    return queryset.filter(
+        Q(name__icontains=term) | in_ingredients | Q(text__icontains=term),
+    ).annotate(
+        rank=Case(
+            When(name__icontains=term, then=Value(3)),
+            When(in_ingredients, then=Value(2)),
+            default=Value(1),
+        ),
+    ).order_by('-rank', *ordering)
@@ -0,0 +1,217 @@
+"""
+Синтетические данные для проверок под нагрузкой (manage.py seed_foodgram).
+
+Популярность неравномерная, как на живом сервисе: авторы, рецепты
+и продукты выбираются с весами по закону Ципфа — немногие авторы
+пишут большую часть рецептов, немногие рецепты собирают большую часть
+избранного, соль встречается чаще шафрана. Ингредиенты берутся
+из настоящего справочника (load_ingredients).
+
+Всё пишется bulk_create пачками, без сигналов, поэтому денормализованные
+счётчики, списки покупок, векторы поиска и популярность пересчитываются
+в конце, а индекс подбора по продуктам строится заново.
+"""
+import itertools
+import random
+import secrets
+from contextlib import contextmanager
+from datetime import timedelta
+from io import BytesIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image
+
+from users.models import Follow
+
+from . import counters, pantry, popularity, search, shopping_list
+from .models import (
+    Favorite, Ingredient, Recipe, RecipeIngredient, ShoppingCart,
+)
+
+User = get_user_model()
+
+PASSWORD = 'seed-password'
+IMAGE_NAME = 'recipes/images/seed.jpg'
+# показатель Ципфа: чем больше, тем сильнее перекос к «хитам»
+SKEW = 1.1
+FIRST_NAMES = ('Анна', 'Иван', 'Мария', 'Пётр', 'Ольга', 'Сергей',
+               'Елена', 'Дмитрий', 'Наталья', 'Алексей')
+LAST_NAMES = ('Иванова', 'Смирнов', 'Кузнецова', 'Попов', 'Соколова',
+              'Лебедев', 'Козлова', 'Новиков', 'Морозова', 'Волков')
+DISHES = ('Салат', 'Суп', 'Рагу', 'Запеканка', 'Пирог', 'Омлет',
+          'Каша', 'Паста', 'Котлеты', 'Блины')
+
+
+class Zipf:
+    """Случайный выбор из items с весом 1/rank^SKEW (порядок — случайный)."""
+
+    def __init__(self, items, rng):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.cum_weights = list(itertools.accumulate(
+            1 / rank ** SKEW for rank in range(1, len(self.items) + 1)))
+        self.rng = rng
+
+    def one(self):
+        return self.rng.choices(self.items, cum_weights=self.cum_weights)[0]
+
+    def sample(self, k, exclude=None):
+        """До k разных элементов (популярные — чаще)."""
+        k = min(k, len(self.items) - (exclude is not None))
+        result = set()
+        # популярные выпадают повторно — добираем несколькими заходами
+        for _ in range(3):
+            result.update(self.rng.choices(
+                self.items, cum_weights=self.cum_weights,
+                k=k - len(result)))
+            result.discard(exclude)
+            if len(result) >= k:
+                break
+        return list(result)[:k]
+
+
+@contextmanager
+def _explicit_dates(model):
+    """auto_now/auto_now_add выключены — даты проставляем сами."""
+    fields = [field for field in model._meta.concrete_fields
+              if getattr(field, 'auto_now', False)
+              or getattr(field, 'auto_now_add', False)]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _image():
+    """Одна картинка на все рецепты: файлы на диске не плодим."""
+    if not default_storage.exists(IMAGE_NAME):
+        buffer = BytesIO()
+        Image.new('RGB', (640, 480), (222, 184, 135)).save(buffer, 'JPEG')
+        default_storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+    return IMAGE_NAME
+
+
+def _flush(model, rows, batch_size, force=False):
+    """Записать накопленное, если набралась пачка; вернуть сколько."""
+    if not rows or not force and len(rows) < batch_size:
+        return 0
+    model.objects.bulk_create(
+        rows, batch_size=batch_size, ignore_conflicts=True)
+    count = len(rows)
+    rows.clear()
+    return count
+
+
+def _per_user(rng, mean):
+    """Сколько связей у пользователя: большинство — мало, единицы — много."""
+    return int(rng.expovariate(1 / mean)) if mean else 0
+
+
+def seed(users=100, recipes=1000, follows=5, favorites=10, carts=3,
+         ingredients=(3, 12), days=365, batch_size=1000, random_seed=None,
+         progress=None):
+    """
+    Создать пользователей и рецепты со связями; follows/favorites/carts —
+    среднее число на пользователя. Возвращает {что: сколько создано}.
+    """
+    rng = random.Random(random_seed)
+    catalog = list(Ingredient.objects.values_list('pk', flat=True))
+    if not catalog:
+        raise ValueError('справочник пуст — сначала load_ingredients')
+    if recipes and not users:
+        raise ValueError('у рецептов должны быть авторы: users > 0')
+    progress = progress or (lambda message: None)
+    tag = secrets.token_hex(3)
+    now = timezone.now()
+
+    # пользователи: один хэш пароля на всех — PBKDF2 медленный
+    password = make_password(PASSWORD)
+    user_ids = []
+    for start in range(0, users, batch_size):
+        created = User.objects.bulk_create(
+            User(
+                email=f'seed-{tag}-{number}@example.com',
+                username=f'seed_{tag}_{number}',
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                password=password,
+            )
+            for number in range(start, min(start + batch_size, users))
+        )
+        user_ids += [user.pk for user in created]
+    progress(f'пользователей: {len(user_ids)}')
+
+    # рецепты и их ингредиенты
+    authors, products = Zipf(user_ids, rng), Zipf(catalog, rng)
+    image = _image()
+    recipe_ids, recipe_ingredients, published_at = [], [], {}
+    with _explicit_dates(Recipe):
+        for start in range(0, recipes, batch_size):
+            batch = []
+            for number in range(start, min(start + batch_size, recipes)):
+                published = now - timedelta(seconds=rng.uniform(
+                    0, days * 86400))
+                batch.append(Recipe(
+                    author_id=authors.one(),
+                    name=f'{rng.choice(DISHES)} №{number} ({tag})',
+                    image=image,
+                    text='Сгенерированный рецепт. ' * rng.randint(1, 20),
+                    cooking_time=max(1, min(600, int(rng.lognormvariate(
+                        3.3, 0.6)))),
+                    pub_date=published,
+                    updated_at=published,
+                ))
+            for recipe in Recipe.objects.bulk_create(batch):
+                recipe_ids.append(recipe.pk)
+                published_at[recipe.pk] = recipe.pub_date
+                recipe_ingredients += [
+                    RecipeIngredient(recipe_id=recipe.pk, ingredient_id=pk,
+                                     amount=rng.randint(1, 500))
+                    for pk in products.sample(rng.randint(*ingredients))
+                ]
+            _flush(RecipeIngredient, recipe_ingredients, batch_size)
+            progress(f'рецептов: {len(recipe_ids)}')
+    _flush(RecipeIngredient, recipe_ingredients, batch_size, force=True)
+
+    # подписки, избранное, корзины
+    result = {'users': len(user_ids), 'recipes': len(recipe_ids),
+              'follows': 0, 'favorites': 0, 'carts': 0}
+    popular = Zipf(recipe_ids, rng) if recipe_ids else None
+    names = {Follow: 'follows', Favorite: 'favorites', ShoppingCart: 'carts'}
+    rows = {model: [] for model in names}
+    for user_id in user_ids:
+        for author_id in authors.sample(
+                _per_user(rng, follows), exclude=user_id):
+            rows[Follow].append(Follow(user_id=user_id, author_id=author_id))
+        if popular:
+            for model, mean in ((Favorite, favorites), (ShoppingCart, carts)):
+                # добавлен в случайный момент после публикации
+                rows[model] += [
+                    model(user_id=user_id, recipe_id=pk,
+                          created_at=published_at[pk] + rng.random() * (
+                              now - published_at[pk]))
+                    for pk in popular.sample(_per_user(rng, mean))
+                ]
+        for model, pending in rows.items():
+            result[names[model]] += _flush(model, pending, batch_size)
+    for model, pending in rows.items():
+        result[names[model]] += _flush(
+            model, pending, batch_size, force=True)
+    progress('связи записаны, пересчёт счётчиков, списков покупок, поиска '
+             'и популярности')
+
+    counters.reconcile()
+    for start in range(0, len(user_ids), batch_size):
+        shopping_list.rebuild(user_ids[start:start + batch_size])
+    search.rebuild(batch_size=batch_size)
+    popularity.rebuild(batch_size=batch_size)
+    pantry.reset()
+    return result
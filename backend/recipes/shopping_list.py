@@ -0,0 +1,214 @@
+"""
+Список покупок пользователя.
+
+Суммы продуктов хранятся готовыми в ShoppingListItem и меняются
+дельтами: при добавлении/удалении рецепта из корзины и при правке
+ингредиентов рецепта, который уже лежит в чьих-то корзинах. Выгрузка
+и просмотр списка — одно чтение по индексу (user, ingredient).
+"""
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Sum, Value, When
+from django.utils import timezone
+
+from .models import (
+    Recipe, RecipeIngredient, ShoppingCart, ShoppingListItem,
+)
+
+CHUNK_SIZE = 500
+
+
+# инкрементальное обновление
+def recipe_amounts(recipe):
+    """{ingredient_id: amount} рецепта."""
+    return dict(RecipeIngredient.objects.filter(
+        recipe=recipe).values_list('ingredient_id', 'amount'))
+
+
+def _apply(user_ids, changes):
+    """
+    Применить дельты {ingredient_id: (Δtotal, Δrecipes_count)}
+    к спискам пользователей: вставка недостающих строк, один UPDATE
+    с F()-выражениями и удаление опустевших строк.
+    """
+    user_ids = list(user_ids)
+    changes = {pk: delta for pk, delta in changes.items() if any(delta)}
+    if not user_ids or not changes:
+        return
+    # внутри транзакции вызывающего — без лишнего SAVEPOINT
+    with transaction.atomic(savepoint=False):
+        ShoppingListItem.objects.bulk_create(
+            (ShoppingListItem(user_id=user_id, ingredient_id=pk)
+             for user_id in user_ids
+             for pk, (_, count) in changes.items() if count > 0),
+            ignore_conflicts=True,
+        )
+
+        def delta(position):
+            return Case(
+                *(When(ingredient_id=pk, then=Value(values[position]))
+                  for pk, values in changes.items()),
+                default=Value(0),
+            )
+
+        ShoppingListItem.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=changes,
+        ).update(
+            total=F('total') + delta(0),
+            recipes_count=F('recipes_count') + delta(1),
+        )
+        if any(count < 0 for _, count in changes.values()):
+            ShoppingListItem.objects.filter(
+                user_id__in=user_ids, recipes_count__lte=0,
+            ).delete()
+
+
+def cart_added(user, recipe, amounts=None):
+    amounts = recipe_amounts(recipe) if amounts is None else amounts
+    _apply([user.pk], {pk: (amount, 1) for pk, amount in amounts.items()})
+
+
+def cart_removed(user, recipe, amounts=None):
+    amounts = recipe_amounts(recipe) if amounts is None else amounts
+    _apply([user.pk], {pk: (-amount, -1) for pk, amount in amounts.items()})
+
+
+def _amounts(recipe_ids):
+    """{ingredient_id: (сумма, число рецептов)} по нескольким рецептам."""
+    rows = RecipeIngredient.objects.filter(
+        recipe_id__in=recipe_ids,
+    ).values_list('ingredient_id').annotate(
+        total=Sum('amount'),
+        recipes_count=Count('recipe_id'),
+    ).order_by()
+    return {pk: (total, count) for pk, total, count in rows}
+
+
+def carts_added(user, recipe_ids):
+    """Пачка рецептов легла в корзину: суммы — одним запросом."""
+    _apply([user.pk], _amounts(recipe_ids))
+
+
+def carts_removed(user, recipe_ids):
+    amounts = _amounts(recipe_ids)
+    _apply([user.pk], {pk: (-total, -count)
+                       for pk, (total, count) in amounts.items()})
+
+
+def recipe_changed(recipe, old, new):
+    """Ингредиенты рецепта изменились: old/new — {ingredient_id: amount}."""
+    if old == new:
+        return
+    user_ids = ShoppingCart.objects.filter(
+        recipe=recipe).values_list('user_id', flat=True)
+    changes = {}
+    for pk in old.keys() | new.keys():
+        changes[pk] = (new.get(pk, 0) - old.get(pk, 0),
+                       (pk in new) - (pk in old))
+    _apply(user_ids, changes)
+
+
+def recipe_deleted(recipe, amounts=None):
+    """Вызывается до каскадного удаления корзин с этим рецептом."""
+    amounts = recipe_amounts(recipe) if amounts is None else amounts
+    _apply(
+        ShoppingCart.objects.filter(recipe=recipe)
+        .values_list('user_id', flat=True),
+        {pk: (-amount, -1) for pk, amount in amounts.items()},
+    )
+
+
+# полная пересборка / сверка
+def expected_items(user_ids=None):
+    """{(user_id, ingredient_id): (total, recipes_count)} из корзин."""
+    # одно условие на корзины — один JOIN (отдельные filter() по
+    # многозначной связи дали бы два)
+    carts = ({'recipe__in_carts__user_id__in': user_ids}
+             if user_ids is not None
+             else {'recipe__in_carts__isnull': False})
+    rows = RecipeIngredient.objects.filter(**carts).values_list(
+        'recipe__in_carts__user_id', 'ingredient_id',
+    ).annotate(
+        total=Sum('amount'),
+        recipes_count=Count('recipe_id'),
+    ).order_by()
+    return {(user_id, pk): (total, count)
+            for user_id, pk, total, count
+            in rows.iterator(chunk_size=CHUNK_SIZE)}
+
+
+def stored_items(user_ids=None):
+    rows = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    rows = rows.values_list(
+        'user_id', 'ingredient_id', 'total', 'recipes_count')
+    return {(user_id, pk): (total, count)
+            for user_id, pk, total, count
+            in rows.iterator(chunk_size=CHUNK_SIZE)}
+
+
+def rebuild(user_ids=None, batch_size=CHUNK_SIZE):
+    """Пересобрать списки с нуля; возвращает число строк."""
+    items = expected_items(user_ids)
+    with transaction.atomic():
+        stale = ShoppingListItem.objects.all()
+        if user_ids is not None:
+            stale = stale.filter(user_id__in=user_ids)
+        stale.delete()
+        ShoppingListItem.objects.bulk_create(
+            (ShoppingListItem(user_id=user_id, ingredient_id=pk,
+                              total=total, recipes_count=count)
+             for (user_id, pk), (total, count) in items.items()),
+            batch_size=batch_size,
+        )
+    return len(items)
+
+
+def drift(user_ids=None):
+    """Расхождения {user_id: число строк} между хранимым и ожидаемым."""
+    expected, stored = expected_items(user_ids), stored_items(user_ids)
+    result = defaultdict(int)
+    for key in expected.keys() | stored.keys():
+        if expected.get(key) != stored.get(key):
+            result[key[0]] += 1
+    return dict(result)
+
+
+# чтение
+@dataclass
+class ShoppingList:
+    user: object
+    created: datetime = field(default_factory=timezone.localtime)
+
+    @property
+    def title(self):
+        return (f'Список покупок для {self.user.username} — '
+                f'{self.created:%Y-%m-%d %H:%M:%S}')
+
+    def items(self):
+        return (
+            ShoppingListItem.objects
+            .filter(user=self.user)
+            .select_related('ingredient')
+            .order_by('ingredient__name')
+        )
+
+    def products(self):
+        """(название, единица, сумма) по алфавиту."""
+        return self.items().values_list(
+            'ingredient__name', 'ingredient__measurement_unit', 'total',
+        ).iterator(chunk_size=CHUNK_SIZE)
+
+    def recipes(self):
+        """(рецепт, автор) — автор джойном, без запроса на строку."""
+        return (
+            Recipe.objects
+            .filter(in_carts__user=self.user)
+            .order_by('name')
+            .values_list('name', 'author__username')
+            .iterator(chunk_size=CHUNK_SIZE)
+        )
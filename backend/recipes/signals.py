@@ -0,0 +1,139 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import Now
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import counters, images, pantry, popularity, search, shopping_list
+from .catalog import bump_catalog_version
+from .models import Favorite, Ingredient, Recipe, ShoppingCart
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredients_changed(**kwargs):
+    """Любая правка справочника — новая версия снимка и индекса."""
+    # после коммита: иначе другой воркер успеет собрать снимок под новой
+    # версией из ещё старых данных
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(instance, created, **kwargs):
+    # название продукта видно в карточках рецептов с ним
+    if not created:
+        Recipe.objects.filter(
+            recipe_ingredients__ingredient=instance,
+        ).update(updated_at=Now())
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(**kwargs):
+    # строки рецептов с продуктом удалены каскадом, мимо журнала индекса
+    transaction.on_commit(pantry.reset)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_renamed(instance, created, **kwargs):
+    if not created:
+        search.refresh(Recipe.objects.filter(
+            recipe_ingredients__ingredient=instance))
+
+
+@receiver(pre_delete, sender=Ingredient)
+def ingredient_deleting(instance, **kwargs):
+    # строки рецептов удалятся каскадом — векторы пересчитаем после
+    ids = list(Recipe.objects.filter(
+        recipe_ingredients__ingredient=instance).values_list('pk', flat=True))
+    if ids:
+        transaction.on_commit(
+            lambda: search.refresh(Recipe.objects.filter(pk__in=ids)))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_search_saved(instance, update_fields=None, **kwargs):
+    """Вектор поиска — после коммита: ингредиенты пишутся после save()."""
+    if update_fields and not {'name', 'text'} & set(update_fields):
+        return
+    pk = instance.pk
+    transaction.on_commit(
+        lambda: search.refresh(Recipe.objects.filter(pk=pk)))
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(instance, **kwargs):
+    """Корзины удалятся каскадом — сначала вычитаем рецепт из списков."""
+    amounts = shopping_list.recipe_amounts(instance)
+    shopping_list.recipe_deleted(instance, amounts)
+    pantry.recipe_changed(instance.pk, amounts, ())
+    counters.recipes_changed(instance.author_id, -1)
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_publishing(instance, **kwargs):
+    # публикация — первое событие популярности рецепта
+    if instance._state.adding:
+        instance.popularity = popularity.published(
+            instance.pub_date or timezone.now())
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(instance, created, **kwargs):
+    if created:
+        counters.recipes_changed(instance.author_id, 1)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(instance, created, update_fields=None, **kwargs):
+    # профиль автора виден в карточках его рецептов; вход меняет
+    # только last_login
+    if created or update_fields and set(update_fields) == {'last_login'}:
+        return
+    Recipe.objects.filter(author=instance).update(updated_at=Now())
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def user_deleting(instance, **kwargs):
+    counters.user_deleting(instance)
+    # избранное и корзины удалятся каскадом — популярность их рецептов
+    # пересчитаем по оставшейся истории
+    ids = {pk for model in (Favorite, ShoppingCart)
+           for pk in model.objects.filter(user=instance).values_list(
+               'recipe_id', flat=True)}
+    if ids:
+        transaction.on_commit(lambda: popularity.rebuild(ids))
+
+
+# уменьшенные копии картинок
+@receiver(post_save, sender=Recipe)
+def recipe_image_saved(instance, **kwargs):
+    images.schedule(instance, 'image', images.RECIPE_VARIANTS)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def avatar_saved(instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    images.schedule(instance, 'avatar', images.AVATAR_VARIANTS)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_image_deleted(instance, **kwargs):
+    images.discard(instance, 'image')
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def avatar_deleted(instance, **kwargs):
+    images.discard(instance, 'avatar')
+
+
+@receiver(images.variants_ready, sender=Recipe)
+def recipe_variants_ready(pk, **kwargs):
+    Recipe.objects.filter(pk=pk).update(updated_at=Now())
+
+
+@receiver(images.variants_ready, sender=settings.AUTH_USER_MODEL)
+def avatar_variants_ready(pk, **kwargs):
+    Recipe.objects.filter(author_id=pk).update(updated_at=Now())
@@ -0,0 +1,199 @@
+"""
+Похожие рецепты: top-K соседей каждого рецепта, посчитанные заранее
+(manage.py build_similar) и сложенные в SimilarRecipe.
+
+Сходство — смесь двух мер с весом SIMILAR_FAVORITES_WEIGHT:
+коэффициент Жаккара по составу (общие продукты / все продукты двух
+рецептов) и косинус по избранному (сколько пользователей отметили
+оба рецепта). Матрицы «рецепт × продукт» X и «рецепт × пользователь» F —
+разреженные 0/1 (scipy.sparse CSR, данные — массивы numpy, а не объекты
+Python): около 12 байт на строку RecipeIngredient и Favorite.
+
+Соседи считаются блоками строк: пересечения блока со всеми рецептами —
+одно произведение X[блок] @ X.T (и F[блок] @ F.T), сходства — векторно
+по плотной матрице блок × все рецепты, top-K в строке — partition.
+Память на расчёт ограничена размером блока (BLOCK_CELLS ячеек), а не
+числом пар рецептов; кандидатов ничто не отсекает — соседи точные.
+Блоками по batch_size строки SimilarRecipe заменяются одной
+транзакцией. Рецепты без продуктов пропускаются.
+
+Инкрементальный пересчёт (changed()) берёт рецепты, изменённые после
+прошлого расчёта, тех, у кого они в соседях, и тех, в чей top-K они
+теперь проходят: сходство симметрично, поэтому строка изменённого
+рецепта сравнивается с K-м соседом каждого другого.
+"""
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+from scipy import sparse
+
+from .models import Favorite, Recipe, RecipeIngredient, SimilarRecipe
+
+CHUNK_SIZE = 1000
+# ячеек плотной матрицы сходств на блок: 4 млн float64 — 32 МБ
+BLOCK_CELLS = 4_000_000
+
+
+def _pairs(queryset, fields):
+    """Два столбца values_list в массивы numpy, без списка кортежей."""
+    rows = queryset.order_by(*fields).values_list(*fields).iterator(
+        chunk_size=CHUNK_SIZE)
+    flat = np.fromiter((value for row in rows for value in row),
+                       dtype=np.int64)
+    return flat[0::2], flat[1::2]
+
+
+class Model:
+    """Состав и избранное всех рецептов; соседи — блоками строк."""
+
+    def __init__(self, favorites_weight=None):
+        self.favorites_weight = (
+            settings.SIMILAR_FAVORITES_WEIGHT
+            if favorites_weight is None else favorites_weight)
+        recipes, ingredients = _pairs(
+            RecipeIngredient.objects, ('recipe_id', 'ingredient_id'))
+        # строка матрицы — позиция id в ids (по возрастанию)
+        self.ids, rows = np.unique(recipes, return_inverse=True)
+        self.x = self._matrix(rows, ingredients)
+        self.sizes = np.asarray(self.x.sum(axis=1)).ravel()
+
+        self.f = None
+        if self.favorites_weight:
+            recipes, users = _pairs(Favorite.objects, ('recipe_id', 'user_id'))
+            known = np.isin(recipes, self.ids)
+            self.f = self._matrix(
+                np.searchsorted(self.ids, recipes[known]), users[known])
+            self.fans = np.asarray(self.f.sum(axis=1)).ravel()
+
+    def _matrix(self, rows, columns):
+        _, columns = np.unique(columns, return_inverse=True)
+        return sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, columns)),
+            shape=(len(self.ids), columns.max(initial=-1) + 1))
+
+    @property
+    def block_rows(self):
+        return max(1, BLOCK_CELLS // max(len(self.ids), 1))
+
+    def positions(self, recipe_ids):
+        """Позиции рецептов в матрицах; рецепты без продуктов отброшены."""
+        recipe_ids = np.fromiter(recipe_ids, dtype=np.int64)
+        found = np.searchsorted(self.ids, recipe_ids)
+        found = found[found < len(self.ids)]
+        return np.unique(found[np.isin(self.ids[found], recipe_ids)])
+
+    def scores(self, positions):
+        """Плотная матрица сходств: строки positions × все рецепты."""
+        shared = (self.x[positions] @ self.x.T).toarray()
+        union = self.sizes[positions, None] + self.sizes[None, :] - shared
+        result = shared / union
+        weight = self.favorites_weight
+        if weight:
+            shared = (self.f[positions] @ self.f.T).toarray()
+            norms = np.sqrt(self.fans[positions, None] * self.fans[None, :])
+            cosine = np.divide(shared, norms, out=np.zeros_like(shared),
+                               where=norms > 0)
+            result = (1 - weight) * result + weight * cosine
+        result[np.arange(len(positions)), positions] = 0  # сам с собой
+        return result
+
+    def neighbors(self, positions, k):
+        """
+        {id рецепта: [(id, сходство)]} — k самых похожих с ненулевым
+        сходством, при равенстве новее.
+        """
+        scores = self.scores(positions)
+        k = min(k, len(self.ids))
+        if k == 0:
+            return {int(self.ids[position]): [] for position in positions}
+        # K-е по величине сходство строки; равные ему — тоже кандидаты,
+        # из них выше новые
+        kth = -np.partition(-scores, k - 1, axis=1)[:, k - 1]
+        result = {}
+        for row, position in enumerate(positions):
+            columns = np.nonzero(scores[row] >= max(kth[row], 0))[0]
+            values = scores[row, columns]
+            # порядок: сходство по убыванию, затем id по убыванию
+            order = np.lexsort((-self.ids[columns], -values))[:k]
+            result[int(self.ids[position])] = [
+                (int(self.ids[columns[index]]), float(values[index]))
+                for index in order if values[index] > 0]
+        return result
+
+    def blocks(self, positions):
+        for start in range(0, len(positions), self.block_rows):
+            yield positions[start:start + self.block_rows]
+
+
+def changed(model, k):
+    """Что пересчитать после прошлого расчёта; None — расчёта не было."""
+    last = SimilarRecipe.objects.aggregate(last=Max('computed_at'))['last']
+    if last is None:
+        return None
+    recipe_ids = set(Recipe.objects.filter(
+        updated_at__gt=last).values_list('pk', flat=True))
+    affected = set(recipe_ids)
+    affected.update(SimilarRecipe.objects.filter(
+        similar_id__in=recipe_ids).values_list('recipe_id', flat=True))
+    # порог входа в top-K: сходство K-го соседа (0, если соседей меньше)
+    floor = np.zeros(len(model.ids))
+    full = SimilarRecipe.objects.values('recipe_id').annotate(
+        total=Count('pk'), lowest=Min('score')).filter(total__gte=k)
+    for row in full.iterator(chunk_size=CHUNK_SIZE):
+        position = np.searchsorted(model.ids, row['recipe_id'])
+        if (position < len(model.ids)
+                and model.ids[position] == row['recipe_id']):
+            floor[position] = row['lowest']
+    for block in model.blocks(model.positions(recipe_ids)):
+        # сходство симметрично: строка изменённого рецепта — это его
+        # сходство в строках всех остальных
+        scores = model.scores(block)
+        passing = (scores > 0) & (scores >= floor[None, :])
+        affected.update(
+            int(pk) for pk in model.ids[np.nonzero(passing.any(axis=0))[0]])
+    return affected
+
+
+def rebuild(recipe_ids=None, k=None, batch_size=CHUNK_SIZE,
+            only_changed=False):
+    """
+    Пересчитать соседей recipe_ids (None — всех). Возвращает
+    {recipes, rows, load, compute, write}: числа и секунды по этапам.
+    """
+    k = k or settings.SIMILAR_RECIPES_K
+    # метка — до чтения: правка во время расчёта попадёт в следующий
+    computed_at = timezone.now()
+    started = time.perf_counter()
+    model = Model()
+    if only_changed:
+        recipe_ids = changed(model, k)
+    positions = (np.arange(len(model.ids)) if recipe_ids is None
+                 else model.positions(recipe_ids))
+    stats = {'recipes': len(positions), 'rows': 0,
+             'load': time.perf_counter() - started,
+             'compute': 0.0, 'write': 0.0}
+
+    for start in range(0, len(positions), batch_size):
+        batch = positions[start:start + batch_size]
+        started = time.perf_counter()
+        neighbors = {}
+        for block in model.blocks(batch):
+            neighbors.update(model.neighbors(block, k))
+        rows = [
+            SimilarRecipe(recipe_id=recipe_id, similar_id=other,
+                          score=score, computed_at=computed_at)
+            for recipe_id, found in neighbors.items()
+            for other, score in found
+        ]
+        stats['compute'] += time.perf_counter() - started
+        started = time.perf_counter()
+        with transaction.atomic():
+            SimilarRecipe.objects.filter(recipe_id__in=neighbors).delete()
+            SimilarRecipe.objects.bulk_create(rows, batch_size=batch_size)
+        stats['write'] += time.perf_counter() - started
+        stats['rows'] += len(rows)
+    return stats
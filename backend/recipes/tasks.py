@@ -0,0 +1,37 @@
+"""Фоновые задачи recipes (выполняет manage.py run_worker)."""
+from io import StringIO
+
+from django.apps import apps
+from django.core.management import call_command
+
+from jobs.queue import task
+
+from . import counters, images, shopping_list
+
+
+@task()
+def reconcile_counters():
+    return counters.reconcile()
+
+
+@task()
+def rebuild_shopping_lists(users=None):
+    drift = shopping_list.drift(users)
+    rows = shopping_list.rebuild(list(drift)) if drift else 0
+    return {'users': len(drift), 'rows': rows}
+
+
+@task()
+def build_image_variants(model, pk, field, source, specs):
+    instance = apps.get_model(model).objects.filter(pk=pk).first()
+    if instance is None or getattr(instance, field).name != source:
+        return {'skipped': True}  # картинку уже заменили
+    images.build(instance, field, specs, pipeline='inline')
+    return {'source': source}
+
+
+@task(max_attempts=1)
+def load_ingredients(**options):
+    out = StringIO()
+    call_command('load_ingredients', stdout=out, **options)
+    return out.getvalue()
@@ -1,3 +1,867 @@
-from django.test import TestCase
+import io
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from users.models import Follow
+
+from . import (
+    images, loader, pantry, popularity, relations, search, similarity,
+)
+from .models import (
+    Favorite, Ingredient, Recipe, RecipeIngredient, ShoppingCart,
+    ShoppingListItem, SimilarRecipe,
+)
+from .pantry import PantryIndex, pantry_index
+
+User = get_user_model()
+
+MEDIA_ROOT = tempfile.mkdtemp()
+IMAGE = 'recipes/images/test.jpg'
+
+
+# кэш — свой у каждого теста, картинки — во временном каталоге
+@override_settings(
+    CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    MEDIA_ROOT=MEDIA_ROOT, IMAGE_PIPELINE='inline',
+)
+class RecipesTestCase(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        pantry.reset()
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='pass-12345', first_name='Автор', last_name='Тестов')
+
+    def make_ingredients(self, *names):
+        return [Ingredient.objects.create(name=name, measurement_unit='г')
+                for name in names]
+
+    def make_recipe(self, ingredients, name='Рецепт'):
+        recipe = Recipe.objects.create(
+            author=self.author, name=name, image=IMAGE, text='Описание',
+            cooking_time=10)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=100)
+            for ingredient in ingredients)
+        return recipe
+
+
+class PantryTests(RecipesTestCase):
+    """Подбор рецептов по продуктам: выдача индекса и его свежесть."""
+
+    def setUp(self):
+        super().setUp()
+        self.a, self.b, self.c, self.d = self.make_ingredients(
+            'яйца', 'молоко', 'мука', 'сахар')
+        self.omelette = self.make_recipe([self.a, self.b], 'Омлет')
+        self.pancakes = self.make_recipe([self.a, self.b, self.c], 'Блины')
+        self.cookies = self.make_recipe([self.c, self.d], 'Печенье')
+        self.boiled = self.make_recipe([self.a], 'Варёные яйца')
+
+    @staticmethod
+    def expected(ingredient_ids, max_missing):
+        """Та же выдача перебором строк из БД."""
+        ingredient_ids = set(ingredient_ids)
+        compositions = {}
+        for recipe_id, pk in RecipeIngredient.objects.values_list(
+                'recipe_id', 'ingredient_id'):
+            compositions.setdefault(recipe_id, set()).add(pk)
+        ranking = [
+            (recipe_id, len(products - ingredient_ids))
+            for recipe_id, products in compositions.items()
+            if products & ingredient_ids
+            and len(products - ingredient_ids) <= max_missing
+        ]
+        return sorted(ranking, key=lambda row: (row[1], -row[0]))
+
+    @staticmethod
+    def match(ingredients, max_missing=3, index=pantry_index):
+        ranking = index.match([item.pk for item in ingredients], max_missing)
+        return list(ranking[:len(ranking)])
+
+    def test_full_pantry(self):
+        self.assertEqual(
+            self.match([self.a, self.b, self.c, self.d]),
+            [(self.boiled.pk, 0), (self.cookies.pk, 0),
+             (self.pancakes.pk, 0), (self.omelette.pk, 0)])
+
+    def test_partial_pantry(self):
+        # сначала готовые полностью, дальше — по числу недостающих;
+        # печенье без яиц и молока в выдачу не попадает совсем
+        self.assertEqual(
+            self.match([self.a, self.b]),
+            [(self.boiled.pk, 0), (self.omelette.pk, 0),
+             (self.pancakes.pk, 1)])
+        self.assertEqual(self.match([self.a, self.b], max_missing=0),
+                         [(self.boiled.pk, 0), (self.omelette.pk, 0)])
+        self.assertEqual(
+            self.match([self.d]), [(self.cookies.pk, 1)])
+        self.assertEqual(self.match([]), [])
+
+    def test_ranking_slices(self):
+        ranking = pantry_index.match([self.a.pk, self.c.pk], 3)
+        rows = ranking[:len(ranking)]
+        self.assertEqual(len(ranking), 4)
+        self.assertEqual(rows, self.expected([self.a.pk, self.c.pk], 3))
+        for start in range(len(rows)):
+            with self.subTest(start=start):
+                self.assertEqual(ranking[start:start + 2],
+                                 rows[start:start + 2])
+
+    def test_matches_brute_force(self):
+        # много рецептов: у частых продуктов — маски, у редких — массивы
+        products = self.make_ingredients(*(f'продукт {n}' for n in range(6)))
+        generator = random.Random(1)
+        for number in range(100):
+            self.make_recipe(
+                generator.sample(products, generator.randint(1, 4)),
+                f'Рецепт {number}')
+        pantry.reset()
+        for size in range(1, 5):
+            chosen = [item.pk for item in generator.sample(products, size)]
+            for max_missing in range(4):
+                with self.subTest(size=size, max_missing=max_missing):
+                    ranking = pantry_index.match(chosen, max_missing)
+                    self.assertEqual(ranking[:len(ranking)],
+                                     self.expected(chosen, max_missing))
+
+    def test_edit_updates_index(self):
+        self.match([self.a])  # индекс построен до правки
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredient.objects.filter(
+                recipe=self.omelette, ingredient=self.b).delete()
+            RecipeIngredient.objects.create(
+                recipe=self.omelette, ingredient=self.d, amount=5)
+            pantry.recipe_changed(
+                self.omelette.pk, {self.a.pk, self.b.pk},
+                {self.a.pk, self.d.pk})
+        with mock.patch.object(PantryIndex, '_build') as build:
+            self.assertEqual(self.match([self.a, self.d], max_missing=0),
+                             [(self.boiled.pk, 0), (self.omelette.pk, 0)])
+            self.assertEqual(self.match([self.b]), [(self.pancakes.pk, 2)])
+        build.assert_not_called()
+
+    def test_new_recipe_is_indexed(self):
+        self.match([self.a])
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = self.make_recipe([self.d], 'Сахар')
+            pantry.recipe_changed(recipe.pk, (), {self.d.pk})
+        self.assertEqual(self.match([self.d]),
+                         [(recipe.pk, 0), (self.cookies.pk, 1)])
+
+    def test_recipe_delete_updates_index(self):
+        self.match([self.a])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boiled.delete()
+        self.assertEqual(self.match([self.a]),
+                         [(self.omelette.pk, 1), (self.pancakes.pk, 2)])
+
+    def test_ingredient_delete_rebuilds_index(self):
+        self.match([self.a])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.b.delete()
+        self.assertEqual(
+            self.match([self.a]),
+            [(self.boiled.pk, 0), (self.omelette.pk, 0),
+             (self.pancakes.pk, 1)])
+
+    def test_other_worker_catches_up(self):
+        other = PantryIndex()
+        self.match([self.d], index=other)
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredient.objects.create(
+                recipe=self.boiled, ingredient=self.d, amount=5)
+            pantry.recipe_changed(
+                self.boiled.pk, {self.a.pk}, {self.a.pk, self.d.pk})
+        # по журналу в общем кэше, без перестройки
+        with mock.patch.object(PantryIndex, '_build') as build:
+            self.assertEqual(
+                self.match([self.d], index=other),
+                [(self.boiled.pk, 1), (self.cookies.pk, 1)])
+        build.assert_not_called()
+
+    def test_journal_survives_non_atomic_incr(self):
+        # у FileBasedCache incr — get + set: два воркера, правящие
+        # одновременно, получают один номер записи
+        other = PantryIndex()
+        self.match([self.d], index=other)
+        start, incr = cache.get(pantry.SEQUENCE_KEY), cache.incr
+        stale = iter([start + 1, start + 1])
+
+        def racy_incr(key, *args):
+            value = next(stale, None) if key == pantry.SEQUENCE_KEY else None
+            if value is None:
+                return incr(key, *args)
+            cache.set(key, value, None)
+            return value
+
+        with mock.patch.object(cache, 'incr', side_effect=racy_incr):
+            for recipe in (self.boiled, self.omelette):
+                with self.captureOnCommitCallbacks(execute=True):
+                    RecipeIngredient.objects.create(
+                        recipe=recipe, ingredient=self.d, amount=5)
+                    products = set(recipe.recipe_ingredients.exclude(
+                        ingredient=self.d).values_list(
+                            'ingredient_id', flat=True))
+                    pantry.recipe_changed(
+                        recipe.pk, products, products | {self.d.pk})
+        with mock.patch.object(PantryIndex, '_build') as build:
+            self.assertEqual(self.match([self.d], index=other),
+                             self.expected([self.d.pk], 3))
+        build.assert_not_called()
+
+    @override_settings(PANTRY_JOURNAL_SIZE=1)
+    def test_other_worker_rebuilds_when_far_behind(self):
+        other = PantryIndex()
+        self.match([self.d], index=other)
+        for recipe in (self.boiled, self.omelette):
+            with self.captureOnCommitCallbacks(execute=True):
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredient=self.d, amount=5)
+                products = set(recipe.recipe_ingredients.exclude(
+                    ingredient=self.d).values_list('ingredient_id', flat=True))
+                pantry.recipe_changed(
+                    recipe.pk, products, products | {self.d.pk})
+        with mock.patch.object(PantryIndex, '_build',
+                               wraps=PantryIndex._build) as build:
+            self.assertEqual(self.match([self.d], index=other),
+                             self.expected([self.d.pk], 3))
+        build.assert_called_once()
+
+    def test_endpoint(self):
+        client = APIClient()
+        response = client.get(
+            '/api/recipes/pantry/',
+            {'ingredients': [self.a.pk, self.b.pk], 'max_missing': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(
+            [(recipe['id'], [item['name'] for item in recipe['missing']])
+             for recipe in response.data['results']],
+            [(self.boiled.pk, []), (self.omelette.pk, []),
+             (self.pancakes.pk, ['мука'])])
+
+
+@override_settings(POPULARITY_HALF_LIFE_DAYS=7)
+class PopularityTests(RecipesTestCase):
+    """Популярность с затуханием: формула, инкремент и пересчёт по истории."""
+
+    HALF_LIFE = timedelta(days=7)
+
+    def setUp(self):
+        super().setUp()
+        self.salt, = self.make_ingredients('соль')
+        self.users = [
+            User.objects.create_user(
+                username=f'fan{number}', email=f'fan{number}@example.com',
+                password='pass-12345', first_name='Фан', last_name='Тестов')
+            for number in range(3)]
+        self.now = timezone.now()
+
+    def score(self, recipe):
+        recipe.refresh_from_db(fields=['popularity'])
+        return recipe.popularity
+
+    def at(self, days):
+        """relations.* с часами, переведёнными на days от self.now."""
+        return mock.patch('recipes.relations.timezone.now',
+                          return_value=self.now + timedelta(days=days))
+
+    def assertMatchesRebuild(self, recipes):
+        incremental = [self.score(recipe) for recipe in recipes]
+        popularity.rebuild([recipe.pk for recipe in recipes])
+        for recipe, value in zip(recipes, incremental):
+            self.assertAlmostEqual(value, self.score(recipe), places=6)
+
+    def test_term(self):
+        # через период полураспада вклад того же события вдвое больше,
+        # корзина весит как избранное на период позже
+        at = self.now
+        self.assertAlmostEqual(
+            popularity._term(1.0, at + self.HALF_LIFE)
+            - popularity._term(1.0, at), math.log(2))
+        self.assertAlmostEqual(
+            popularity._term(popularity.WEIGHTS[ShoppingCart], at),
+            popularity._term(popularity.WEIGHTS[Favorite],
+                             at + self.HALF_LIFE))
+        self.assertAlmostEqual(popularity._term(1.0, popularity.EPOCH), 0)
+
+    def test_recent_beats_old(self):
+        # три добавления три периода назад (3/8) < одно сейчас (1)
+        old = self.make_recipe([self.salt], 'Старый хит')
+        fresh = self.make_recipe([self.salt], 'Новинка')
+        for user in self.users:
+            with self.at(-21):
+                relations.add(Favorite, user, [old.pk])
+        with self.at(0):
+            relations.add(Favorite, self.users[0], [fresh.pk])
+        self.assertGreater(self.score(fresh), self.score(old))
+        response = APIClient().get('/api/recipes/?ordering=popular')
+        self.assertEqual([recipe['id'] for recipe in response.data['results']],
+                         [fresh.pk, old.pk])
+
+    def test_favorite_raises_score(self):
+        recipe = self.make_recipe([self.salt])
+        before = self.score(recipe)
+        with self.at(1):
+            relations.add(Favorite, self.users[0], [recipe.pk])
+        term = popularity._term(1.0, self.now + timedelta(days=1))
+        self.assertGreater(self.score(recipe), before)
+        self.assertAlmostEqual(
+            self.score(recipe),
+            math.log(math.exp(before) + math.exp(term)), places=6)
+        with self.at(1):
+            relations.remove(Favorite, self.users[0], [recipe.pk])
+        self.assertAlmostEqual(self.score(recipe), before, places=6)
+
+    def test_incremental_matches_rebuild(self):
+        recipes = [self.make_recipe([self.salt], f'Рецепт {number}')
+                   for number in range(3)]
+        ids = [recipe.pk for recipe in recipes]
+        steps = [
+            (3, relations.add, Favorite, 0, ids),
+            (5, relations.add, ShoppingCart, 1, ids[:2]),
+            (8, relations.add, Favorite, 2, ids[1:]),
+            (13, relations.remove, Favorite, 0, ids[:1]),
+            (21, relations.add, Favorite, 0, ids[:1]),
+            (34, relations.remove, ShoppingCart, 1, ids),
+        ]
+        for days, change, model, user, batch in steps:
+            with self.at(days):
+                change(model, self.users[user], batch)
+        self.assertMatchesRebuild(recipes)
+
+    def test_removing_dominant_event_settles(self):
+        # свежее событие в миллиард раз больше остальной суммы:
+        # вычитание в логарифмах теряет точность — пересчёт по истории
+        recipe = self.make_recipe([self.salt])
+        with self.at(30 * 7):
+            relations.add(ShoppingCart, self.users[0], [recipe.pk])
+        with self.at(30 * 7), mock.patch(
+                'recipes.popularity.rebuild',
+                wraps=popularity.rebuild) as rebuild:
+            relations.remove(ShoppingCart, self.users[0], [recipe.pk])
+        rebuild.assert_called_once_with([recipe.pk])
+        self.assertNotEqual(self.score(recipe), popularity.LOST)
+        recipe.refresh_from_db(fields=['pub_date'])
+        self.assertAlmostEqual(self.score(recipe),
+                               popularity.published(recipe.pub_date),
+                               places=6)
+
+    def test_rebuild(self):
+        recipe = self.make_recipe([self.salt])
+        for days, user in ((-7, 0), (0, 1)):
+            Favorite.objects.create(
+                user=self.users[user], recipe=recipe,
+                created_at=self.now + timedelta(days=days))
+        recipe.refresh_from_db(fields=['pub_date'])
+        self.assertEqual(popularity.rebuild(), 1)
+        self.assertAlmostEqual(self.score(recipe), math.log(
+            math.exp(popularity.published(recipe.pub_date))
+            + math.exp(popularity._term(1.0, self.now - self.HALF_LIFE))
+            + math.exp(popularity._term(1.0, self.now))), places=6)
+
+
+class CounterTests(RecipesTestCase):
+    """Денормализованные счётчики: не уходят в минус и заполняются сами."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.make_recipe(self.make_ingredients('соль'))
+        self.fan = User.objects.create_user(
+            username='fan', email='fan@example.com', password='pass-12345',
+            first_name='Фан', last_name='Тестов')
+        self.client = APIClient()
+        self.client.force_authenticate(self.fan)
+
+    def test_remove_with_drifted_counter(self):
+        # строка записана мимо счётчиков — удаление не падает
+        Favorite.objects.create(user=self.fan, recipe=self.recipe)
+        Follow.objects.create(user=self.fan, author=self.author)
+        self.assertEqual(self.client.delete(
+            f'/api/recipes/{self.recipe.pk}/favorite/').status_code, 204)
+        self.assertEqual(self.client.delete(
+            f'/api/users/{self.author.pk}/subscribe/').status_code, 204)
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.fan.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+        self.assertEqual(
+            (self.author.followers_count, self.fan.following_count), (0, 0))
+
+    def test_user_delete_with_drifted_counters(self):
+        ShoppingCart.objects.create(user=self.fan, recipe=self.recipe)
+        Follow.objects.create(user=self.fan, author=self.author)
+        self.fan.delete()
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.recipe.carts_count, 0)
+        self.assertEqual(self.author.followers_count, 0)
+
+    def test_backfill_after_migrate(self):
+        # колонки после миграции — нули при уже существующих строках
+        Favorite.objects.create(user=self.fan, recipe=self.recipe)
+        ShoppingCart.objects.create(user=self.fan, recipe=self.recipe)
+        Follow.objects.create(user=self.fan, author=self.author)
+        User.objects.update(recipes_count=0)
+        call_command('migrate', verbosity=0)
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.fan.refresh_from_db()
+        self.assertEqual(
+            (self.recipe.favorites_count, self.recipe.carts_count), (1, 1))
+        self.assertEqual(
+            (self.author.recipes_count, self.author.followers_count), (1, 1))
+        self.assertEqual(self.fan.following_count, 1)
+
+
+class AdminTests(RecipesTestCase):
+    """Избранное, корзины и подписки из админки — со счётчиками."""
+
+    def setUp(self):
+        super().setUp()
+        self.salt, = self.make_ingredients('соль')
+        self.recipe = self.make_recipe([self.salt])
+        self.fan = User.objects.create_user(
+            username='fan', email='fan@example.com', password='pass-12345',
+            first_name='Фан', last_name='Тестов')
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com',
+            password='pass-12345', first_name='Админ', last_name='Тестов')
+        self.client.force_login(admin)
+
+    def add(self, model, **fields):
+        now = timezone.localtime()
+        url = f'/admin/{model._meta.app_label}/{model._meta.model_name}/add/'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {
+                **fields,
+                'created_at_0': now.strftime('%d.%m.%Y'),
+                'created_at_1': now.strftime('%H:%M:%S'),
+            })
+        self.assertEqual(response.status_code, 302)
+        return model.objects.latest('pk')
+
+    def delete(self, model, rows):
+        opts = model._meta
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f'/admin/{opts.app_label}/{opts.model_name}/', {
+                    'action': 'delete_selected',
+                    '_selected_action': [row.pk for row in rows],
+                    'post': 'yes',
+                })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(model.objects.filter(
+            pk__in=[row.pk for row in rows]).exists())
+
+    def test_favorite(self):
+        before = self.recipe.popularity
+        row = self.add(Favorite, user=self.fan.pk, recipe=self.recipe.pk)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertGreater(self.recipe.popularity, before)
+        opts = Favorite._meta
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                f'/admin/{opts.app_label}/{opts.model_name}/{row.pk}/delete/',
+                {'post': 'yes'})
+        self.assertFalse(Favorite.objects.exists())
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+        self.assertAlmostEqual(self.recipe.popularity, before, places=6)
+
+    def test_cart(self):
+        rows = [self.add(ShoppingCart, user=user.pk, recipe=self.recipe.pk)
+                for user in (self.fan, self.author)]
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.carts_count, 2)
+        self.assertEqual(ShoppingListItem.objects.filter(
+            ingredient=self.salt).count(), 2)
+        self.delete(ShoppingCart, rows)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.carts_count, 0)
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_follow(self):
+        opts = Follow._meta
+        url = f'/admin/{opts.app_label}/{opts.model_name}/'
+        response = self.client.post(
+            f'{url}add/', {'user': self.fan.pk, 'author': self.author.pk})
+        self.assertEqual(response.status_code, 302)
+        self.fan.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(
+            (self.fan.following_count, self.author.followers_count), (1, 1))
+        self.delete(Follow, Follow.objects.all())
+        self.fan.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(
+            (self.fan.following_count, self.author.followers_count), (0, 0))
+
+
+@override_settings(SIMILAR_FAVORITES_WEIGHT=0.3)
+class SimilarityTests(RecipesTestCase):
+    """Похожие рецепты: блочный расчёт совпадает с попарным перебором."""
+
+    K = 4
+
+    def setUp(self):
+        super().setUp()
+        generator = random.Random(7)
+        self.products = self.make_ingredients(
+            *(f'продукт {number}' for number in range(12)))
+        self.recipes = [
+            self.make_recipe(
+                generator.sample(self.products, generator.randint(1, 5)),
+                f'Рецепт {number}')
+            for number in range(40)]
+        # соль — почти везде: через неё похожи все
+        salt, = self.make_ingredients('соль')
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=salt, amount=1)
+            for recipe in self.recipes[:30])
+        users = [
+            User.objects.create_user(
+                username=f'fan{number}', email=f'fan{number}@example.com',
+                password='pass-12345', first_name='Фан', last_name='Тестов')
+            for number in range(8)]
+        Favorite.objects.bulk_create(
+            Favorite(user=user, recipe=recipe)
+            for user in users
+            for recipe in generator.sample(self.recipes, 6))
+
+    def expected(self, k):
+        """Соседи перебором всех пар."""
+        def sets(model, field):
+            result = {}
+            for pk, value in model.objects.values_list('recipe_id', field):
+                result.setdefault(pk, set()).add(value)
+            return result
+
+        products = sets(RecipeIngredient, 'ingredient_id')
+        fans = sets(Favorite, 'user_id')
+        result = {}
+        for pk, own in products.items():
+            scores = []
+            for other, theirs in products.items():
+                if other == pk:
+                    continue
+                jaccard = len(own & theirs) / len(own | theirs)
+                a, b = fans.get(pk, set()), fans.get(other, set())
+                cosine = len(a & b) / math.sqrt(len(a) * len(b)) if (
+                    a and b) else 0
+                score = (1 - 0.3) * jaccard + 0.3 * cosine
+                if score > 0:
+                    scores.append((score, other))
+            scores.sort(key=lambda item: (-item[0], -item[1]))
+            result[pk] = [(other, score) for score, other in scores[:k]]
+        return result
+
+    def stored(self):
+        result = {}
+        for pk, other, score in SimilarRecipe.objects.order_by(
+                'recipe_id', '-score', '-similar_id').values_list(
+                'recipe_id', 'similar_id', 'score'):
+            result.setdefault(pk, []).append((other, score))
+        return result
+
+    def assertMatches(self, expected):
+        stored = self.stored()
+        self.assertEqual(stored.keys(), expected.keys())
+        for pk, neighbors in expected.items():
+            with self.subTest(recipe=pk):
+                self.assertEqual([other for other, _ in stored[pk]],
+                                 [other for other, _ in neighbors])
+                for (_, got), (_, want) in zip(stored[pk], neighbors):
+                    self.assertAlmostEqual(got, want)
+
+    def test_rebuild_matches_brute_force(self):
+        # блоки по 3 строки и запись пачками по 7 рецептов
+        with mock.patch.object(similarity, 'BLOCK_CELLS', 3 * 40):
+            stats = similarity.rebuild(k=self.K, batch_size=7)
+        self.assertEqual(stats['recipes'], 40)
+        self.assertMatches(self.expected(self.K))
+
+    def test_changed_matches_full_rebuild(self):
+        similarity.rebuild(k=self.K)
+        edited = self.recipes[5]
+        RecipeIngredient.objects.filter(recipe=edited).delete()
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=edited, ingredient=product, amount=1)
+            for product in self.products[:3])
+        edited.save()
+        stats = similarity.rebuild(k=self.K, only_changed=True)
+        self.assertLess(stats['recipes'], 40)
+        self.assertMatches(self.expected(self.K))
+
+    def test_recipe_without_ingredients_is_skipped(self):
+        empty = self.make_recipe([], 'Пустой')
+        similarity.rebuild([empty.pk, self.recipes[0].pk], k=self.K)
+        self.assertFalse(SimilarRecipe.objects.filter(recipe=empty).exists())
+        self.assertTrue(SimilarRecipe.objects.filter(
+            recipe=self.recipes[0]).exists())
+
+
+class LoaderTests(RecipesTestCase):
+    """Загрузка справочника продуктов: load_ingredients."""
+
+    def setUp(self):
+        super().setUp()
+        self.make_ingredients('соль')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.directory = directory
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def load(self, path, *args):
+        out = io.StringIO()
+        call_command('load_ingredients', path, *args, stdout=out)
+        return out.getvalue()
+
+    def catalog(self):
+        return set(Ingredient.objects.values_list(
+            'name', 'measurement_unit'))
+
+    def test_json(self):
+        items = [
+            {'name': 'соль', 'measurement_unit': 'г'},
+            {'name': 'мука', 'measurement_unit': 'г'},
+            {'name': ' мука ', 'measurement_unit': 'г'},
+            {'name': 'мука', 'measurement_unit': 'кг'},
+            {'name': '', 'measurement_unit': 'г'},
+            {'name': 'x' * 500, 'measurement_unit': 'г'},
+        ]
+        path = self.write('ingredients.json', json.dumps(
+            items, ensure_ascii=False, indent=2))
+        # куски меньше записи: разбор на границах кусков
+        with mock.patch.object(loader, 'CHUNK_SIZE', 7):
+            output = self.load(path, '--batch-size', '4')
+        self.assertEqual(self.catalog(), {
+            ('соль', 'г'), ('мука', 'г'), ('мука', 'кг')})
+        self.assertIn('добавлено 2, пропущено 2, ошибочных строк 2', output)
+
+    def test_csv(self):
+        path = self.write(
+            'ingredients.csv',
+            'name,measurement_unit\nсоль,г\nмука,г\n"сахар, песок",г\n'
+            'мука,г\nбез единицы\n')
+        output = self.load(path, '--batch-size', '2')
+        self.assertEqual(self.catalog(), {
+            ('соль', 'г'), ('мука', 'г'), ('сахар, песок', 'г')})
+        self.assertIn('добавлено 2, пропущено 2, ошибочных строк 1', output)
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+    def test_dry_run(self):
+        path = self.write('ingredients.csv', 'мука,г\nсахар,г\nсоль,г\n')
+        output = self.load(path, '--dry-run', '--batch-size', '1')
+        self.assertIn('Проверка без записи: добавлено 2, пропущено 1', output)
+        self.assertEqual(self.catalog(), {('соль', 'г')})
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+    def test_resume(self):
+        names = [f'продукт {i}' for i in range(5)]
+        path = self.write(
+            'ingredients.csv', ''.join(f'{name},г\n' for name in names))
+        insert = loader._insert
+        batches = []
+
+        def interrupted(keys):
+            batches.append(keys)
+            if len(batches) == 2:
+                raise RuntimeError('соединение потеряно')
+            return insert(keys)
+
+        with mock.patch.object(loader, '_insert', interrupted):
+            with self.assertRaisesMessage(CommandError, '--resume'):
+                self.load(path, '--batch-size', '2')
+        # первая пачка записана, вторая откатилась
+        self.assertEqual(self.catalog() - {('соль', 'г')},
+                         {(name, 'г') for name in names[:2]})
+        self.assertEqual(
+            loader.read_checkpoint(f'{path}.checkpoint', path).read, 2)
+
+        with mock.patch.object(loader, '_insert', side_effect=insert) as spy:
+            output = self.load(path, '--resume', '--batch-size', '2')
+        self.assertIn('Продолжаем со строки 3.', output)
+        # прочитанные до остановки строки не перечитываются
+        self.assertEqual([call.args[0] for call in spy.call_args_list], [
+            [(name, 'г') for name in names[2:4]], [(names[4], 'г')]])
+        self.assertIn('добавлено 5, пропущено 0', output)
+        self.assertEqual(self.catalog() - {('соль', 'г')},
+                         {(name, 'г') for name in names})
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+    def test_resume_rejects_changed_file(self):
+        path = self.write('ingredients.csv', 'мука,г\n')
+        loader.save_checkpoint(
+            f'{path}.checkpoint', path, loader.LoadStats(read=1))
+        self.write('ingredients.csv', 'мука,г\nсахар,г\n')
+        with self.assertRaisesMessage(CommandError, 'не подходит'):
+            self.load(path, '--resume')
+
+
+class SearchTests(RecipesTestCase):
+    """Поиск без Postgres: icontains с ранжированием."""
+
+    def setUp(self):
+        super().setUp()
+        tomato, salt = self.make_ingredients('томаты', 'соль')
+        # новее — выше в обычном порядке; поиск ранжирует по-своему
+        self.by_name = self.make_recipe([salt], 'Суп из томатов')
+        self.by_ingredient = self.make_recipe([tomato, salt], 'Салат')
+        self.by_text = self.make_recipe([salt], 'Паста')
+        Recipe.objects.filter(pk=self.by_text.pk).update(
+            text='Подавать с соусом из томатов')
+        self.other = self.make_recipe([salt], 'Каша')
+
+    def find(self, term, queryset=None):
+        queryset = Recipe.objects.all() if queryset is None else queryset
+        return list(search.apply(queryset, term).values_list(
+            'pk', flat=True))
+
+    def test_rank(self):
+        self.assertEqual(self.find('томат'), [
+            self.by_name.pk, self.by_ingredient.pk, self.by_text.pk])
+
+    def test_ties_keep_queryset_order(self):
+        soup = self.make_recipe([], 'Суп томатный')
+        self.assertEqual(self.find('томат')[:2], [soup.pk, self.by_name.pk])
+        self.assertEqual(
+            self.find('томат', Recipe.objects.order_by('pk'))[:2],
+            [self.by_name.pk, soup.pk])
+
+    def test_blank_term(self):
+        everything = Recipe.objects.all()
+        self.assertIs(search.apply(everything, '   '), everything)
+        self.assertEqual(self.find('  томат\n'), [
+            self.by_name.pk, self.by_ingredient.pk, self.by_text.pk])
+
+    def test_api(self):
+        response = APIClient().get('/api/recipes/', {'search': 'томат'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [self.by_name.pk, self.by_ingredient.pk, self.by_text.pk])
+
+
+class ImageTests(RecipesTestCase):
+    """Уменьшенные копии картинок рецептов (IMAGE_PIPELINE=inline)."""
+
+    def save_image(self, name, size=(2000, 1000), mode='RGB'):
+        buffer = BytesIO()
+        Image.new(mode, size, 'red').save(buffer, 'PNG')
+        return default_storage.save(
+            f'recipes/images/{name}', ContentFile(buffer.getvalue()))
+
+    def create(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                author=self.author, name='Рецепт', image=image,
+                text='Описание', cooking_time=10)
+        recipe.refresh_from_db()
+        return recipe
+
+    def replace(self, recipe, image):
+        recipe.image = image
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        recipe.refresh_from_db()
+
+    def paths(self, recipe):
+        return [path for formats in recipe.image_variants['files'].values()
+                for path in formats.values()]
+
+    def test_variants(self):
+        source = self.save_image('photo.png', mode='RGBA')
+        recipe = self.create(source)
+        variants = recipe.image_variants
+        self.assertEqual(variants['source'], source)
+        sizes = {'thumb': (100, 100), 'card': (640, 480),
+                 'detail': (1280, 640)}  # detail — без обрезки
+        self.assertEqual(set(variants['files']), set(sizes))
+        for name, formats in variants['files'].items():
+            self.assertEqual(set(formats), {'webp', 'jpeg'})
+            for ext, path in formats.items():
+                with default_storage.open(path) as file:
+                    image = Image.open(file)
+                    self.assertEqual(image.format, images.FORMATS[ext][0])
+                    self.assertEqual(image.size, sizes[name])
+                    if ext == 'jpeg':
+                        self.assertEqual(image.mode, 'RGB')
+        response = APIClient().get(f'/api/recipes/{recipe.pk}/')
+        self.assertTrue(response.data['image_variants']['card'][
+            'webp'].endswith(variants['files']['card']['webp']))
+
+    def test_replaced_image(self):
+        recipe = self.create(self.save_image('old.png'))
+        old = self.paths(recipe)
+        self.replace(recipe, self.save_image('new.png', size=(300, 200)))
+        self.assertEqual(recipe.image_variants['source'], recipe.image.name)
+        self.assertFalse(any(map(default_storage.exists, old)))
+        self.assertTrue(all(map(default_storage.exists, self.paths(recipe))))
+
+    def test_stale_result_is_discarded(self):
+        recipe = self.create(self.save_image('first.png'))
+        current = recipe.image_variants
+        stale = Recipe.objects.get(pk=recipe.pk)
+        Recipe.objects.filter(pk=recipe.pk).update(
+            image=self.save_image('second.png'))
+        # сборка для прежней картинки закончилась после замены
+        saved = []
+        save = default_storage.save
+
+        def spy(name, content):
+            saved.append(save(name, content))
+            return saved[-1]
+
+        with mock.patch.object(default_storage, 'save', spy):
+            images.build(stale, 'image', images.RECIPE_VARIANTS, 'inline')
+        self.assertEqual(len(saved), 6)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_variants, current)
+        self.assertFalse(any(map(default_storage.exists, saved)))
+
+    def test_discard(self):
+        recipe = self.create(self.save_image('photo.png'))
+        paths = self.paths(recipe)
+        self.assertTrue(all(map(default_storage.exists, paths)))
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertFalse(any(map(default_storage.exists, paths)))
+
+    def test_image_removed(self):
+        recipe = self.create(self.save_image('photo.png'))
+        paths = self.paths(recipe)
+        self.replace(recipe, '')
+        self.assertEqual(recipe.image_variants, {})
+        self.assertFalse(any(map(default_storage.exists, paths)))
@@ -1,9 +1,15 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.db import transaction
 from django.utils.safestring import mark_safe
 
+from recipes import counters
+from recipes.images import variant_urls
+from recipes.utils import EstimatedCountPaginator
+
 from .models import User, Follow
 
+
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
     list_display = (
@@ -17,15 +23,21 @@ class UserAdmin(BaseUserAdmin):
     list_filter = (
         'is_staff', 'is_active'
     )
+    # счётчики — колонки модели, так что строка списка не делает
+    # запросов; общий COUNT(*) на больших таблицах — оценка
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     @admin.display(description='Аватар')
     @mark_safe
     def avatar_tag(self, obj):
         """Отображает аватар пользователя в виде тега <img>."""
         if obj.avatar:
+            # уменьшенная копия, пока её нет — оригинал
+            thumb = variant_urls(obj.avatar_variants).get('thumb', {})
             return (
-                f'<img src="{obj.avatar.url}" width="50" '
-                'height="50" style="border-radius:50%;" />'
+                f'<img src="{thumb.get("webp", obj.avatar.url)}" '
+                'width="50" height="50" style="border-radius:50%;" />'
             )
         return ''
 
@@ -34,27 +46,47 @@ class UserAdmin(BaseUserAdmin):
         """Сочетание имени и фамилии пользователя."""
         return f'{obj.first_name} {obj.last_name}'
 
-    @admin.display(description='Рецептов')
+    @admin.display(description='Рецептов', ordering='recipes_count')
     def recipes_count(self, obj):
         """Сколько рецептов создал пользователь."""
-        return obj.recipes.count()
+        return obj.recipes_count
 
-    @admin.display(description='Подписок')
+    @admin.display(description='Подписок', ordering='following_count')
     def subscriptions_count(self, obj):
-        """Сколько авторов подписано этим пользователем."""
-        return Follow.objects.filter(
-            user=obj
-        ).count()
+        """На скольких авторов подписан пользователь."""
+        return obj.following_count
 
-    @admin.display(description='Подписчиков')
+    @admin.display(description='Подписчиков', ordering='followers_count')
     def followers_count(self, obj):
         """Сколько подписчиков у пользователя."""
-        return Follow.objects.filter(
-            author=obj
-        ).count()
+        return obj.followers_count
 
 
 @admin.register(Follow)
 class FollowAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'author')
     search_fields = ('user__username', 'author__username')
+    list_select_related = ('user', 'author')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    # подписки из админки сдвигают те же счётчики, что и API
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        if change:
+            old = Follow.objects.get(pk=obj.pk)
+            counters.follow_changed(old.user_id, old.author_id, -1)
+        super().save_model(request, obj, form, change)
+        counters.follow_changed(obj.user_id, obj.author_id, 1)
+
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        counters.follow_changed(obj.user_id, obj.author_id, -1)
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        pairs = list(queryset.values_list('user_id', 'author_id'))
+        super().delete_queryset(request, queryset)
+        for user_id, author_id in pairs:
+            counters.follow_changed(user_id, author_id, -1)
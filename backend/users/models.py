@@ -16,6 +16,10 @@ class User(AbstractUser):
         blank=True,
         null=True,
     )
+    # уменьшенные копии строит recipes.images после сохранения
+    avatar_variants = models.JSONField(
+        'Варианты аватара', default=dict, blank=True, editable=False,
+    )
     email = models.EmailField(
         'E-mail',
         max_length=254,
@@ -41,6 +45,16 @@ class User(AbstractUser):
         'Фамилия',
         max_length=150,
     )
+    # счётчики поддерживает recipes.counters, чинит reconcile_counters
+    recipes_count = models.PositiveIntegerField(
+        'Рецептов', default=0, editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        'Подписчиков', default=0, editable=False,
+    )
+    following_count = models.PositiveIntegerField(
+        'Подписок', default=0, editable=False,
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']